@@ -1,6 +1,12 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.templatetags.static import static
+from django.utils import timezone
+from django.utils.html import format_html
+from .inventory import ConcurrentApproval, approve_deliveries
+from .jobs import cancel
 from .models import Customer, Supplier, Store, Product, Purchase, PurchaseDetail, SupplierDelivery, Stock, \
-    StockMovement, Cart
+    StockMovement, Cart, ProductAvailability, ImageManifest, Job, \
+    MovementArchive
 
 
 # @admin.register(Customer)
@@ -18,8 +24,63 @@ class StoreAdmin(admin.ModelAdmin):
     search_fields = ('name',)
 
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'image')
+    list_display = ('name', 'price', 'image', 'thumbnail')
     search_fields = ('name', 'store__name')
+    readonly_fields = ('image_hash', 'image_variants')
+
+    @admin.display(description='Miniatura')
+    def thumbnail(self, obj):
+        if 'admin' not in obj.image_variants:
+            return '-'
+        return format_html('<img src="{}" alt="{}">', static(obj.image_variants['admin']), obj.name)
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'progress', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind')
+    readonly_fields = ('payload', 'result', 'error', 'started_at', 'finished_at')
+    actions = ['cancel_jobs', 'retry_jobs']
+
+    @admin.action(description='Cancelar las tareas seleccionadas')
+    def cancel_jobs(self, request, queryset):
+        for job_id in queryset.values_list('id', flat=True):
+            cancel(job_id)
+
+    @admin.action(description='Reintentar las tareas fallidas o canceladas')
+    def retry_jobs(self, request, queryset):
+        queryset.filter(status__in=[Job.FAILED, Job.CANCELLED]).update(
+            status=Job.PENDING, attempts=0, cancel_requested=False, run_after=timezone.now(),
+            progress=0, message='', error='', finished_at=None,
+        )
+
+
+class SupplierDeliveryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'supplier', 'store', 'product', 'quantity', 'delivery_date', 'approved')
+    list_filter = ('approved',)
+    list_select_related = ('supplier', 'store', 'product')
+    actions = ['approve_selected']
+
+    @admin.action(description='Aprobar las entregas seleccionadas')
+    def approve_selected(self, request, queryset):
+        try:
+            approved = approve_deliveries(list(queryset.filter(approved=False).values_list('id', flat=True)))
+        except ConcurrentApproval as exc:
+            self.message_user(request, str(exc), messages.ERROR)
+        else:
+            self.message_user(request, f'{approved} entregas aprobadas.')
+
+class MovementArchiveAdmin(admin.ModelAdmin):
+    list_display = ('month', 'database', 'rows', 'first_id', 'last_id', 'created_at')
+    list_filter = ('database',)
+
+    # Los registros los crea archive_movements; editarlos desincronizaría los ficheros
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 # Registro de los demás modelos
 admin.site.register(Customer, CustomerAdmin)
@@ -28,8 +89,11 @@ admin.site.register(Store, StoreAdmin)
 admin.site.register(Product, ProductAdmin)
 admin.site.register(Purchase)
 admin.site.register(PurchaseDetail)
-admin.site.register(SupplierDelivery)
+admin.site.register(SupplierDelivery, SupplierDeliveryAdmin)
 admin.site.register(Stock)
 admin.site.register(StockMovement)
 admin.site.register(Cart)
-
+admin.site.register(ProductAvailability)
+admin.site.register(ImageManifest)
+admin.site.register(Job, JobAdmin)
+admin.site.register(MovementArchive, MovementArchiveAdmin)
@@ -0,0 +1,51 @@
+"""Gráficos de los informes con matplotlib/seaborn.
+
+Este módulo es pesado de importar: solo se carga (desde ``core.reports``)
+cuando hay que renderizar un gráfico que no está en caché.
+"""
+import base64
+import io
+
+import matplotlib
+
+matplotlib.use("Agg")  # Evita intentos de GUI en un entorno de servidor
+
+import matplotlib.pyplot as plt  # noqa: E402
+import seaborn as sns  # noqa: E402
+
+
+def figure_to_base64(fig):
+    """Convierte una figura a PNG en base64 y libera su memoria"""
+    buffer = io.BytesIO()
+    try:
+        fig.savefig(buffer, format="png")
+        return base64.b64encode(buffer.getvalue()).decode("utf-8")
+    finally:
+        buffer.close()
+        plt.close(fig)  # Sin esto las figuras se acumulan en el proceso
+
+
+def render_delivery_charts(deliveries):
+    """Gráficos de barras y de pastel de las entregas agrupadas por tienda y producto"""
+    stores = [d["store__name"] for d in deliveries]
+    products = [d["product__name"] for d in deliveries]
+    quantities = [d["total_quantity"] for d in deliveries]
+
+    # Crear gráfico de barras con los 10 primeros productos
+    fig, ax = plt.subplots(figsize=(12, 6))
+    sns.barplot(x=products, y=quantities, hue=stores, ax=ax)
+    ax.tick_params(axis="x", labelsize=10)
+    plt.setp(ax.get_xticklabels(), rotation=45, ha="right")
+    ax.set_xlabel("Producto")
+    ax.set_ylabel("Cantidad entregada")
+    ax.set_title("Top 10 Productos más entregados por tienda")
+    fig.tight_layout()
+    bar_chart = figure_to_base64(fig)
+
+    # Crear gráfico de pastel
+    fig, ax = plt.subplots(figsize=(7, 7))
+    ax.pie(quantities, labels=products, autopct="%1.2f%%", colors=sns.color_palette("pastel"))
+    ax.set_title("Distribución de productos entregados")
+    pie_chart = figure_to_base64(fig)
+
+    return {"bar_chart": bar_chart, "pie_chart": pie_chart}
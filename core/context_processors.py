@@ -0,0 +1,8 @@
+from django.utils.functional import SimpleLazyObject
+
+from .roles import primary_role
+
+
+def role(request):
+    """Primer grupo del usuario (``role``) para el menú; solo se lee de la caché de roles si la plantilla lo usa"""
+    return {'role': SimpleLazyObject(lambda: primary_role(request.user))}
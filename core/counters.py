@@ -0,0 +1,98 @@
+from collections import Counter
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Customer, Purchase, PurchaseDetail, Stock, Store, Supplier, SupplierDelivery
+from .sharding import across_shards, is_sharded, stores_by_shard
+
+BULK_UPDATE_BATCH = 500
+
+
+def _aggregate(model, fk, aggregate, default):
+    """Subconsulta correlacionada con el agregado de ``model`` por ``fk``"""
+    rows = model.objects.filter(**{fk: OuterRef("pk")}).values(fk).annotate(value=aggregate).values("value")
+    return Coalesce(Subquery(rows), default)
+
+
+def counter_definitions():
+    """(modelo, campo guardado, modelo agregado, fk, agregado, valor por defecto)"""
+    return [
+        (Store, "stock_total", Stock, "store", Sum("quantity"), Value(0)),
+        (Supplier, "delivered_units", SupplierDelivery, "supplier", Sum("quantity"), Value(0)),
+        (Customer, "purchase_count", Purchase, "customer", Count("id"), Value(0)),
+        (Purchase, "amount", PurchaseDetail, "purchase", Sum(F("unit_price") * F("quantity")), Value(Decimal("0"))),
+    ]
+
+
+def _across_databases(model, source):
+    """El contador y sus filas de origen están en bases de datos distintas (shards)"""
+    return is_sharded(source) and not is_sharded(model)
+
+
+def _sharded_totals(source, fk, aggregate, filters=None):
+    """``{fk_id: valor}`` sumando el agregado de cada shard (vale para sumas y recuentos)"""
+    totals = Counter()
+    for queryset in across_shards(source.objects.filter(**(filters or {}))):
+        totals.update(dict(queryset.values(fk).annotate(value=aggregate).values_list(fk, "value")))
+    return totals
+
+
+def verify_counters():
+    """Devuelve las filas cuyo contador guardado no coincide con el real"""
+    mismatches = []
+    for model, field, source, fk, aggregate, default in counter_definitions():
+        if _across_databases(model, source):
+            totals = _sharded_totals(source, fk, aggregate)
+            rows = ((pk, stored, totals.get(pk, default.value))
+                    for pk, stored in model.objects.values_list("pk", field).iterator())
+            mismatches.extend((model.__name__, pk, field, stored, expected)
+                              for pk, stored, expected in rows if stored != expected)
+            continue
+        for queryset in across_shards(model.objects.all()):
+            rows = queryset.annotate(expected=_aggregate(source, fk, aggregate, default)) \
+                .exclude(**{field: F("expected")})
+            for pk, stored, expected in rows.values_list("pk", field, "expected"):
+                mismatches.append((model.__name__, pk, field, stored, expected))
+    return mismatches
+
+
+def _set_counters(model, field, values, default):
+    """Guarda ``{pk: valor}`` (y ``default`` en el resto) con actualizaciones en bloque"""
+    objs = [model(pk=pk, **{field: values.get(pk, default)}) for pk in model.objects.values_list("pk", flat=True)]
+    model.objects.bulk_update(objs, [field], batch_size=BULK_UPDATE_BATCH)
+    return len(objs)
+
+
+def recompute_counters():
+    """Recalcula todos los contadores (un UPDATE por modelo, o en bloque si el origen está en los shards)"""
+    updated = {}
+    with transaction.atomic():
+        for model, field, source, fk, aggregate, default in counter_definitions():
+            if _across_databases(model, source):
+                updated[model.__name__] = _set_counters(model, field, _sharded_totals(source, fk, aggregate),
+                                                        default.value)
+                continue
+            updated[model.__name__] = sum(
+                queryset.update(**{field: _aggregate(source, fk, aggregate, default)})
+                for queryset in across_shards(model.objects.all())
+            )
+    return updated
+
+
+def refresh_store_totals(store_ids):
+    """Recalcula el stock total guardado de las tiendas indicadas"""
+    if not is_sharded(Stock):
+        Store.objects.filter(pk__in=store_ids).update(
+            stock_total=_aggregate(Stock, "store", Sum("quantity"), Value(0))
+        )
+        return
+
+    totals = Counter()
+    for shard_store_ids in stores_by_shard(store_ids).values():
+        totals.update(dict(Stock.objects.for_store(shard_store_ids[0]).filter(store_id__in=shard_store_ids)
+                           .values("store").annotate(value=Sum("quantity")).values_list("store", "value")))
+    Store.objects.bulk_update([Store(pk=store_id, stock_total=totals.get(store_id, 0)) for store_id in store_ids],
+                              ["stock_total"], batch_size=BULK_UPDATE_BATCH)
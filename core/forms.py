@@ -1,9 +1,25 @@
 from django import forms
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.models import User
+from django.forms.utils import flatatt
+from django.utils.html import format_html, format_html_join
 from .models import Customer, Supplier, Product, Store, SupplierDelivery
 
 
+class CatalogSelect(forms.Select):
+    """Select para listas largas (miles de tiendas o productos): genera las opciones
+    directamente en lugar de renderizar una plantilla por opción"""
+
+    def render(self, name, value, attrs=None, renderer=None):
+        widget = self.get_context(name, value, attrs)['widget']
+        options = format_html_join(
+            '', '<option value="{}"{}>{}</option>',
+            ((option['value'], ' selected' if option['selected'] else '', option['label'])
+             for _, group, _ in widget['optgroups'] for option in group)
+        )
+        return format_html('<select name="{}"{}>{}</select>', widget['name'], flatatt(widget['attrs']), options)
+
+
 class CustomUserCreationForm(forms.ModelForm):
     class Meta:
         model = User
@@ -78,17 +94,17 @@ class TransferProductForm(forms.Form):
     product = forms.ModelChoiceField(
         queryset=Product.objects.all(),
         label="Product",
-        widget=forms.Select(attrs={'class': 'form-control'})
+        widget=CatalogSelect(attrs={'class': 'form-control'})
     )
     from_store = forms.ModelChoiceField(
         queryset=Store.objects.all(),
         label="Origin Store",
-        widget=forms.Select(attrs={'class': 'form-control'})
+        widget=CatalogSelect(attrs={'class': 'form-control'})
     )
     to_store = forms.ModelChoiceField(
         queryset=Store.objects.all(),
         label="Destination Stores",
-        widget=forms.Select(attrs={'class': 'form-control'})
+        widget=CatalogSelect(attrs={'class': 'form-control'})
     )
     quantity = forms.IntegerField(
         min_value=1,
@@ -101,7 +117,7 @@ class SupplierDeliveryForm(forms.ModelForm):
         model = SupplierDelivery
         fields = ["store", "product", "quantity"]
         widgets = {
-            'store': forms.Select(attrs={'class': 'form-control'}),
-            'product': forms.Select(attrs={'class': 'form-control'}),
+            'store': CatalogSelect(attrs={'class': 'form-control'}),
+            'product': CatalogSelect(attrs={'class': 'form-control'}),
             'quantity': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Quantity'}),
         }
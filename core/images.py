@@ -0,0 +1,73 @@
+import os
+
+from django.conf import settings
+from django.templatetags.static import static
+from PIL import Image
+
+from .models import ImageManifest, Product, Store
+
+FALLBACK_IMAGE = "img/sin-imagen.jpg"
+
+
+def inspect_image(name):
+    """Comprueba en disco si existe la imagen y devuelve sus dimensiones"""
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    if not os.path.exists(path):
+        return False, None, None
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+    except OSError:
+        return False, None, None
+    return True, width, height
+
+
+def refresh_image(name):
+    """Actualiza la entrada del manifiesto para una imagen"""
+    exists, width, height = inspect_image(name)
+    entry, _ = ImageManifest.objects.update_or_create(
+        name=name,
+        defaults={
+            "exists": exists,
+            "url": static(name if exists else FALLBACK_IMAGE),
+            "width": width,
+            "height": height,
+        },
+    )
+    return entry
+
+
+def resolve_images(names):
+    """Devuelve {nombre: entrada} con una sola consulta; solo inspecciona el disco
+    la primera vez que se ve una imagen"""
+    names = {name for name in names if name}
+    entries = {entry.name: entry for entry in ImageManifest.objects.filter(name__in=names)}
+    for name in names - entries.keys():
+        entries[name] = refresh_image(name)
+    return entries
+
+
+def image_url(entries, name):
+    """URL de la imagen según el manifiesto, o la imagen por defecto"""
+    entry = entries.get(name)
+    return entry.url if entry else static(FALLBACK_IMAGE)
+
+
+def product_image_urls(entries, product, size="card"):
+    """URLs (jpg, webp) de la imagen del producto en el tamaño pedido; usa la
+    original (o la imagen por defecto) si aún no hay variantes"""
+    entry = entries.get(product.image.name)
+    variants = product.image_variants or {}
+    if entry and entry.exists and size in variants:
+        return static(variants[size]), static(variants[size + "_webp"])
+    return image_url(entries, product.image.name), None
+
+
+def rebuild_manifest():
+    """Reconstruye el manifiesto completo a partir de productos y tiendas"""
+    names = set(Product.objects.exclude(image="").exclude(image=None).values_list("image", flat=True))
+    names |= set(Store.objects.exclude(image="").exclude(image=None).values_list("image", flat=True))
+    for name in names:
+        refresh_image(name)
+    removed, _ = ImageManifest.objects.exclude(name__in=names).delete()
+    return len(names), removed
@@ -0,0 +1,281 @@
+import csv
+import hashlib
+import os
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+
+from .counters import refresh_store_totals
+from .models import ImportFingerprint, Product, ProductAvailability, Stock, Store
+from .sharding import across_shards, atomic_for_stores, stores_by_shard, sync_catalog
+
+CATALOG_DIR = "static/img/product_images"
+FEEDS = {
+    "stores": "stores.csv",
+    "products": "products.csv",
+    "stock": "stock.csv",
+}
+BATCH_SIZE = 2000
+
+
+class RejectedRow(ValueError):
+    """Fila del CSV que no se puede importar"""
+
+
+class ImportReport:
+    """Resumen de una importación: altas, modificaciones, bajas y filas rechazadas"""
+
+    def __init__(self):
+        self.created = {feed: 0 for feed in FEEDS}
+        self.updated = {feed: 0 for feed in FEEDS}
+        self.unchanged = {feed: 0 for feed in FEEDS}
+        self.deleted = {feed: 0 for feed in FEEDS}
+        self.rejected = []  # (feed, línea, motivo)
+
+    def reject(self, feed, line, reason):
+        self.rejected.append((feed, line, reason))
+
+    def lines(self):
+        for feed in FEEDS:
+            yield (f"✅ {feed}: {self.created[feed]} creados, {self.updated[feed]} actualizados, "
+                   f"{self.unchanged[feed]} sin cambios, {self.deleted[feed]} eliminados.")
+        for feed, line, reason in self.rejected:
+            yield f"❌ {feed} línea {line}: {reason}"
+
+
+def read_rows(path):
+    """Recorre el CSV en streaming como (número de línea, fila)"""
+    with open(path, newline="", encoding="utf-8") as csvfile:
+        yield from enumerate(csv.DictReader(csvfile), start=2)
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def row_checksum(row):
+    """Huella de una fila, independiente del orden de las columnas"""
+    content = "\x1f".join(f"{column}={(value or '').strip()}" for column, value in sorted(row.items())
+                          if column is not None)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def _text(row, column, required=True):
+    value = (row.get(column) or "").strip()
+    if required and not value:
+        raise RejectedRow(f"falta '{column}'")
+    return value
+
+
+def _stock_key(row):
+    return f"{(row.get('store_name') or '').strip()}|{(row.get('product_name') or '').strip()}"
+
+
+class CatalogImporter:
+    """Importa tiendas, productos y stock desde CSV en bloques.
+
+    Los nombres se resuelven con diccionarios nombre→id cargados una sola vez
+    y cada bloque se guarda con ``bulk_create``/``bulk_update`` en su propia
+    transacción. Las tiendas y productos se identifican por nombre, así que
+    volver a importar los mismos ficheros actualiza en lugar de duplicar.
+
+    Cada fila aplicada guarda su huella en ``ImportFingerprint``. Con
+    ``delta=True`` se saltan las filas cuya huella no ha cambiado desde la
+    última importación, y con ``delete_missing=True`` se eliminan las tiendas,
+    productos o stock que ya no aparecen en el CSV.
+    """
+
+    def __init__(self, directory=CATALOG_DIR, batch_size=BATCH_SIZE, delta=False, delete_missing=False,
+                 progress=None):
+        self.directory = directory
+        self.progress = progress  # progress(feeds terminados, total de feeds, feed)
+        self.batch_size = batch_size
+        self.delta = delta
+        self.delete_missing = delete_missing
+        self.report = ImportReport()
+
+    def run(self):
+        for done, (feed, filename) in enumerate(FEEDS.items(), start=1):
+            path = os.path.join(self.directory, filename)
+            if os.path.exists(path):
+                getattr(self, f"import_{feed}")(read_rows(path))
+            else:
+                self.report.reject(feed, 0, f"el archivo {path} no existe")
+            if self.progress:
+                self.progress(done, len(FEEDS), feed)
+        return self.report
+
+    def _changed_rows(self, feed, batch, known, seen, key_for, exists):
+        """Filtra las filas del bloque que hay que aplicar, como (línea, fila, clave, huella).
+
+        Una fila con la misma huella solo se salta si su registro sigue existiendo: pudo
+        borrarse después de importarla (en cascada con su tienda o producto, o en el admin).
+        """
+        for line, row in batch:
+            key, checksum = key_for(row), row_checksum(row)
+            seen.add(key)
+            if self.delta and known.get(key) == checksum and exists(row):
+                self.report.unchanged[feed] += 1
+                continue
+            yield line, row, key, checksum
+
+    def _save_fingerprints(self, feed, fingerprints):
+        ImportFingerprint.objects.bulk_create(
+            [ImportFingerprint(feed=feed, key=key, checksum=checksum) for key, checksum in fingerprints.items()],
+            update_conflicts=True, unique_fields=["feed", "key"], update_fields=["checksum"],
+        )
+
+    def _remove_missing(self, feed, known, seen, delete):
+        """Elimina (si se pidió) lo que ya no viene en el CSV y olvida sus huellas"""
+        missing = list(known.keys() - seen)
+        if not self.delete_missing or not missing:
+            return
+        for keys in batched(missing, self.batch_size):
+            with transaction.atomic():
+                self.report.deleted[feed] += delete(keys)
+                ImportFingerprint.objects.filter(feed=feed, key__in=keys).delete()
+
+    def _forget_stock(self, store_names=(), product_names=()):
+        """Olvida las huellas del stock borrado en cascada con sus tiendas o productos"""
+        store_names, product_names = set(store_names), set(product_names)
+        keys = [key for key in ImportFingerprint.objects.filter(feed="stock").values_list("key", flat=True)
+                if key.partition("|")[0] in store_names or key.partition("|")[2] in product_names]
+        for batch in batched(keys, self.batch_size):
+            ImportFingerprint.objects.filter(feed="stock", key__in=batch).delete()
+
+    def _upsert(self, feed, model, rows, parse, fields):
+        """Alta o modificación por nombre de tiendas/productos"""
+        ids = dict(model.objects.values_list("name", "id"))
+        known = dict(ImportFingerprint.objects.filter(feed=feed).values_list("key", "checksum"))
+        seen = set()
+        for batch in batched(rows, self.batch_size):
+            pending = {}  # nombre -> objeto, para que los repetidos en el bloque se fusionen
+            fingerprints = {}
+            for line, row, key, checksum in self._changed_rows(
+                    feed, batch, known, seen, lambda row: _text(row, "name", required=False),
+                    lambda row: _text(row, "name", required=False) in ids):
+                try:
+                    values = parse(row)
+                except RejectedRow as exc:
+                    self.report.reject(feed, line, str(exc))
+                    continue
+                pending[values["name"]] = model(id=ids.get(values["name"]), **values)
+                fingerprints[key] = checksum
+
+            to_create = [obj for obj in pending.values() if obj.id is None]
+            to_update = [obj for obj in pending.values() if obj.id is not None]
+            with transaction.atomic():
+                model.objects.bulk_create(to_create)
+                model.objects.bulk_update(to_update, fields)
+                self._save_fingerprints(feed, fingerprints)
+            sync_catalog(model, [obj.id for obj in pending.values()])  # Copia del catálogo en los shards
+            ids.update((obj.name, obj.id) for obj in to_create)
+            self.report.created[feed] += len(to_create)
+            self.report.updated[feed] += len(to_update)
+
+        def delete(names):
+            for name in names:
+                ids.pop(name, None)
+            self._forget_stock(**{f"{model._meta.model_name}_names": names})
+            return model.objects.filter(name__in=names).delete()[1].get(model._meta.label, 0)
+
+        self._remove_missing(feed, known, seen, delete)
+        return ids
+
+    def import_stores(self, rows):
+        def parse(row):
+            return {"name": _text(row, "name"), "street": _text(row, "street"),
+                    "phone": _text(row, "phone", required=False) or None}
+
+        self.store_ids = self._upsert("stores", Store, rows, parse, ["street", "phone"])
+
+    def import_products(self, rows):
+        def parse(row):
+            try:
+                price = Decimal(_text(row, "price"))
+            except InvalidOperation:
+                raise RejectedRow(f"precio no válido '{row['price']}'")
+            return {"name": _text(row, "name"), "description": _text(row, "description", required=False),
+                    "price": price}
+
+        self.product_ids = self._upsert("products", Product, rows, parse, ["description", "price"])
+
+    def import_stock(self, rows):
+        store_ids = getattr(self, "store_ids", None) or dict(Store.objects.values_list("name", "id"))
+        product_ids = getattr(self, "product_ids", None) or dict(Product.objects.values_list("name", "id"))
+        existing = {
+            (store_id, product_id): stock_id
+            for stock in across_shards(Stock.objects.all())
+            for stock_id, store_id, product_id in stock.values_list("id", "store_id", "product_id")
+        }
+        known = dict(ImportFingerprint.objects.filter(feed="stock").values_list("key", "checksum"))
+        seen = set()
+        touched_stores = set()
+
+        for batch in batched(rows, self.batch_size):
+            pending = {}
+            fingerprints = {}
+            for line, row, key, checksum in self._changed_rows(
+                    "stock", batch, known, seen, _stock_key,
+                    lambda row: (store_ids.get(_text(row, "store_name", required=False)),
+                                 product_ids.get(_text(row, "product_name", required=False))) in existing):
+                try:
+                    store_id = store_ids.get(_text(row, "store_name"))
+                    product_id = product_ids.get(_text(row, "product_name"))
+                    if not store_id or not product_id:
+                        raise RejectedRow(f"no se encontró la tienda/producto "
+                                          f"{row['store_name']} - {row['product_name']}")
+                    quantity = int(_text(row, "quantity"))
+                    if quantity < 0:
+                        raise ValueError
+                except RejectedRow as exc:
+                    self.report.reject("stock", line, str(exc))
+                    continue
+                except ValueError:
+                    self.report.reject("stock", line, f"cantidad no válida '{row['quantity']}'")
+                    continue
+                pending[(store_id, product_id)] = Stock(id=existing.get((store_id, product_id)),
+                                                        store_id=store_id, product_id=product_id,
+                                                        quantity=quantity)
+                fingerprints[key] = checksum
+
+            to_create = [stock for stock in pending.values() if stock.id is None]
+            to_update = [stock for stock in pending.values() if stock.id is not None]
+            batch_stores = {store_id for store_id, _ in pending}
+            with atomic_for_stores(*batch_stores):
+                for shard_store_ids in stores_by_shard(batch_stores).values():
+                    stock = Stock.objects.for_store(shard_store_ids[0])
+                    stock.bulk_create([obj for obj in to_create if obj.store_id in shard_store_ids])
+                    stock.bulk_update([obj for obj in to_update if obj.store_id in shard_store_ids], ["quantity"])
+                self._save_fingerprints("stock", fingerprints)
+            existing.update(((stock.store_id, stock.product_id), stock.id) for stock in to_create)
+            touched_stores.update(store_id for store_id, _ in pending)
+            self.report.created["stock"] += len(to_create)
+            self.report.updated["stock"] += len(to_update)
+
+        def delete(keys):
+            stock_ids = {}  # {store_id: [stock_id, ...]}
+            for key in keys:
+                store_name, _, product_name = key.partition("|")
+                store_id = store_ids.get(store_name)
+                stock_id = existing.get((store_id, product_ids.get(product_name)))
+                if stock_id:
+                    stock_ids.setdefault(store_id, []).append(stock_id)
+            touched_stores.update(stock_ids)
+            deleted = 0
+            for shard_store_ids in stores_by_shard(stock_ids).values():
+                ids = [stock_id for store_id in shard_store_ids for stock_id in stock_ids[store_id]]
+                stocks = Stock.objects.for_store(shard_store_ids[0]).filter(id__in=ids)
+                deleted += stocks.delete()[1].get(Stock._meta.label, 0)
+            return deleted
+
+        self._remove_missing("stock", known, seen, delete)
+
+        # bulk_create/bulk_update no pasan por Stock.save: se recalculan índice y totales
+        if touched_stores:
+            with transaction.atomic():
+                ProductAvailability.rebuild(touched_stores)
+                refresh_store_totals(touched_stores)
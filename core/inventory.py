@@ -0,0 +1,152 @@
+from collections import defaultdict
+
+from django.db.models import Case, F, Q, Value, When
+
+from .models import InsufficientStock, ProductAvailability, Purchase, PurchaseDetail, Stock, StockMovement, \
+    Store, SupplierDelivery
+from .sharding import atomic_for_stores, stores_by_shard
+
+GROUPS_PER_STATEMENT = 300  # Límite de grupos (tienda, producto) por UPDATE con CASE
+
+
+def decrement_stock(store_id, quantities):
+    """Descuenta ``{product_id: cantidad}`` del stock de una tienda en una sola
+    sentencia UPDATE condicional: o se descuentan todas las líneas o ninguna.
+
+    Debe llamarse dentro de una transacción (``atomic_for_stores``).
+    """
+    enough_stock = Q()
+    for product_id, quantity in quantities.items():
+        enough_stock |= Q(product_id=product_id, quantity__gte=quantity)
+
+    updated = Stock.objects.for_store(store_id).filter(store_id=store_id).filter(enough_stock).update(
+        quantity=F("quantity") - Case(
+            *[When(product_id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+            default=Value(0),
+        )
+    )
+    if updated != len(quantities):
+        raise InsufficientStock("No hay suficiente stock disponible.")
+    Store.objects.filter(pk=store_id).update(stock_total=F("stock_total") - sum(quantities.values()))
+
+    # Los productos agotados salen del índice de disponibilidad del catálogo
+    sold_out = list(Stock.objects.for_store(store_id).filter(store_id=store_id, product_id__in=quantities, quantity=0)
+                    .values_list("product_id", flat=True))
+    ProductAvailability.objects.filter(store_id=store_id, product_id__in=sold_out).delete()
+
+
+def confirm_cart(cart, customer):
+    """Convierte el carrito en una compra de forma atómica.
+
+    El número de consultas no depende del tamaño del carrito: un UPDATE de
+    stock por tienda y inserciones en bloque para detalles y movimientos.
+    Devuelve la compra, o ``None`` si el carrito está vacío. Lanza
+    ``InsufficientStock`` (sin modificar nada) si alguna línea no tiene stock.
+    """
+    items = list(cart.items.all())
+    if not items:
+        return None
+
+    demand = defaultdict(lambda: defaultdict(int))  # {store_id: {product_id: cantidad}}
+    for item in items:
+        demand[item.store_id][item.product_id] += item.quantity
+
+    purchase_store_id = items[0].store_id
+    with atomic_for_stores(*demand):
+        for store_id, quantities in demand.items():
+            decrement_stock(store_id, quantities)
+
+        purchase = Purchase.objects.for_store(purchase_store_id).create(
+            customer=customer, store_id=purchase_store_id, amount=sum(item.total_price() for item in items)
+        )
+        PurchaseDetail.objects.for_store(purchase_store_id).bulk_create([
+            PurchaseDetail(purchase=purchase, product_id=item.product_id, quantity=item.quantity,
+                           unit_price=item.unit_price)
+            for item in items
+        ])
+        for store_ids in stores_by_shard(demand).values():
+            StockMovement.objects.for_store(store_ids[0]).bulk_create([
+                StockMovement(product_id=product_id, store_id=store_id, quantity=quantity,
+                              movement_type=StockMovement.DECREASE)
+                for store_id in store_ids
+                for product_id, quantity in demand[store_id].items()
+            ])
+        cart.items.all().delete()
+
+    return purchase
+
+
+class ConcurrentApproval(RuntimeError):
+    """Otra petición aprobó alguna de las entregas a la vez; no se ha aplicado nada"""
+
+
+def approve_deliveries(delivery_ids):
+    """Aprueba en bloque las entregas pendientes indicadas, en una sola transacción.
+
+    Las entregas se agrupan por (tienda, producto): el stock recibe un único
+    incremento por grupo y los movimientos se insertan en bloque (uno por
+    entrega, como al aprobarlas de una en una). Devuelve cuántas se aprobaron.
+    """
+    with atomic_for_stores():
+        deliveries = list(SupplierDelivery.objects.select_for_update()
+                          .filter(pk__in=delivery_ids, approved=False)
+                          .only("id", "store_id", "product_id", "quantity"))
+        if not deliveries:
+            return 0
+
+        approved = SupplierDelivery.objects.filter(pk__in=[d.pk for d in deliveries], approved=False) \
+            .update(approved=True)
+        if approved != len(deliveries):
+            raise ConcurrentApproval("Algunas entregas ya se habían aprobado; inténtalo de nuevo.")
+
+        totals = defaultdict(int)  # {(store_id, product_id): cantidad}
+        for delivery in deliveries:
+            totals[(delivery.store_id, delivery.product_id)] += delivery.quantity
+        groups = list(totals.items())
+
+        # Las transacciones de los shards quedan abiertas hasta confirmar también default
+        with atomic_for_stores(*{store_id for store_id, _ in totals}):
+            for store_ids in stores_by_shard({store_id for store_id, _ in totals}).values():
+                _increment_stock([group for group in groups if group[0][0] in store_ids])
+                StockMovement.objects.for_store(store_ids[0]).bulk_create([
+                    StockMovement(store_id=delivery.store_id, product_id=delivery.product_id,
+                                  quantity=delivery.quantity, movement_type=StockMovement.INCREASE)
+                    for delivery in deliveries if delivery.store_id in store_ids
+                ])
+
+            store_totals = defaultdict(int)
+            for (store_id, _), quantity in groups:
+                store_totals[store_id] += quantity
+            Store.objects.filter(pk__in=store_totals).update(stock_total=F("stock_total") + Case(
+                *[When(pk=store_id, then=Value(quantity)) for store_id, quantity in store_totals.items()],
+                default=Value(0),
+            ))
+
+            ProductAvailability.objects.bulk_create(
+                [ProductAvailability(store_id=store_id, product_id=product_id)
+                 for (store_id, product_id), quantity in groups if quantity > 0],
+                ignore_conflicts=True,
+            )
+
+    return len(deliveries)
+
+
+def _increment_stock(groups):
+    """Suma ``[((store_id, product_id), cantidad), ...]`` al stock, con un UPDATE por bloque de grupos.
+
+    Todas las tiendas deben pertenecer al mismo shard.
+    """
+    shard_store_id = groups[0][0][0]
+    stock = Stock.objects.for_store(shard_store_id)
+    # Registros de stock que aún no existen, con cantidad 0
+    stock.bulk_create([Stock(store_id=store_id, product_id=product_id) for (store_id, product_id), _ in groups],
+                      ignore_conflicts=True)
+
+    for start in range(0, len(groups), GROUPS_PER_STATEMENT):
+        chunk = groups[start:start + GROUPS_PER_STATEMENT]
+        pairs = Q()
+        increments = []
+        for (store_id, product_id), quantity in chunk:
+            pairs |= Q(store_id=store_id, product_id=product_id)
+            increments.append(When(store_id=store_id, product_id=product_id, then=Value(quantity)))
+        stock.filter(pairs).update(quantity=F("quantity") + Case(*increments, default=Value(0)))
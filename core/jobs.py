@@ -0,0 +1,182 @@
+import os
+import threading
+import traceback
+from datetime import timedelta
+
+from django.db import connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+RETRY_DELAY_SECONDS = 30  # Se duplica en cada intento
+HEARTBEAT_SECONDS = 15  # Cada cuánto marca heartbeat_at el proceso que ejecuta una tarea
+
+HANDLERS = {}
+
+
+class JobCancelled(Exception):
+    """La tarea se canceló mientras se ejecutaba"""
+
+
+def register(kind):
+    """Registra la función que ejecuta las tareas de tipo ``kind``"""
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+class JobContext:
+    """Lo que recibe cada tarea para informar de su progreso y atender cancelaciones"""
+
+    def __init__(self, job):
+        self.job = job
+        self.payload = job.payload
+
+    def progress(self, percent, message=""):
+        """Guarda el progreso; lanza ``JobCancelled`` si se pidió cancelar la tarea"""
+        Job.objects.filter(pk=self.job.pk).update(progress=max(0, min(100, int(percent))), message=message[:255],
+                                                  heartbeat_at=timezone.now())
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if Job.objects.filter(pk=self.job.pk, cancel_requested=True).exists():
+            raise JobCancelled()
+
+
+def enqueue(kind, payload=None, user=None, max_attempts=3):
+    """Crea una tarea pendiente para el worker"""
+    if kind not in HANDLERS:
+        raise ValueError(f"Tipo de tarea desconocido: {kind}")
+    return Job.objects.create(kind=kind, payload=payload or {}, created_by=user, max_attempts=max_attempts)
+
+
+def cancel(job_id):
+    """Cancela una tarea: si está pendiente al momento, si se está ejecutando en su próximo aviso de progreso"""
+    if Job.objects.filter(pk=job_id, status=Job.PENDING).update(status=Job.CANCELLED, finished_at=timezone.now()):
+        return True
+    return bool(Job.objects.filter(pk=job_id, status=Job.RUNNING).update(cancel_requested=True))
+
+
+def claim_next():
+    """Reserva la siguiente tarea pendiente (UPDATE condicional: dos workers no cogen la misma)"""
+    now = timezone.now()
+    candidates = Job.objects.filter(status=Job.PENDING, run_after__lte=now).order_by('run_after', 'id')
+    for job_id in candidates.values_list('id', flat=True)[:10]:
+        claimed = Job.objects.filter(pk=job_id, status=Job.PENDING).update(
+            status=Job.RUNNING, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1, progress=0, error=''
+        )
+        if claimed:
+            return job_id
+    return None
+
+
+def release(job_ids, error):
+    """Tareas 'running' cuyo proceso murió: vuelven a la cola o, sin intentos, quedan fallidas.
+
+    Devuelve ``(devueltas a la cola, fallidas)``.
+    """
+    now = timezone.now()
+    jobs = Job.objects.filter(pk__in=job_ids, status=Job.RUNNING)
+    failed = jobs.filter(attempts__gte=F('max_attempts')).update(status=Job.FAILED, error=error, finished_at=now)
+    retried = jobs.filter(attempts__lt=F('max_attempts')).update(status=Job.PENDING, error=error, run_after=now)
+    return retried, failed
+
+
+def requeue_stale(older_than):
+    """Libera (``release``) las tareas 'running' cuyo proceso no da señales de vida desde hace ``older_than``"""
+    limit = timezone.now() - older_than
+    stale = list(Job.objects.filter(status=Job.RUNNING)
+                 .filter(Q(heartbeat_at__lt=limit) | Q(heartbeat_at=None, started_at__lt=limit))
+                 .values_list('id', flat=True))
+    return release(stale, f"Sin señales de vida del worker durante {older_than}") if stale else (0, 0)
+
+
+def _heartbeat(job_id, stop):
+    """Hilo del proceso del pool: marca la tarea como viva mientras se ejecuta"""
+    try:
+        while not stop.wait(HEARTBEAT_SECONDS):
+            Job.objects.filter(pk=job_id, status=Job.RUNNING).update(heartbeat_at=timezone.now())
+    finally:
+        connections.close_all()  # Solo las de este hilo
+
+
+def init_worker():
+    """Inicializa cada proceso del pool: Django listo y sin conexiones heredadas"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'supply_management.settings')
+    import django
+    django.setup()
+    connections.close_all()
+
+
+def run_job(job_id):
+    """Ejecuta una tarea ya reservada y guarda su resultado. Corre en el pool de procesos."""
+    job = Job.objects.get(pk=job_id)
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job_id, stop), daemon=True)
+    heartbeat.start()
+    try:
+        result = HANDLERS[job.kind](JobContext(job))
+    except JobCancelled:
+        Job.objects.filter(pk=job_id).update(status=Job.CANCELLED, finished_at=timezone.now())
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            delay = timedelta(seconds=RETRY_DELAY_SECONDS * 2 ** (job.attempts - 1))
+            Job.objects.filter(pk=job_id).update(status=Job.PENDING, error=error, run_after=timezone.now() + delay)
+        else:
+            Job.objects.filter(pk=job_id).update(status=Job.FAILED, error=error, finished_at=timezone.now())
+    else:
+        Job.objects.filter(pk=job_id).update(status=Job.SUCCEEDED, progress=100, result=result,
+                                             finished_at=timezone.now())
+    finally:
+        stop.set()
+        heartbeat.join()
+        connections.close_all()
+
+
+# --- Tareas disponibles ---
+
+@register('import_catalog')
+def import_catalog(ctx):
+    from .importer import CatalogImporter
+
+    options = {key: ctx.payload[key] for key in ('directory', 'delta', 'delete_missing') if key in ctx.payload}
+    importer = CatalogImporter(progress=lambda done, total, feed: ctx.progress(100 * done / total, feed), **options)
+    report = importer.run()
+    return {'lines': list(report.lines()), 'rejected': len(report.rejected)}
+
+
+@register('render_delivery_report')
+def render_delivery_report(ctx):
+    from .reports import delivery_charts
+    from .routers import track_writes, use_replica
+
+    ctx.progress(10, 'rendering')
+    with track_writes(), use_replica():  # El progreso ya escrito no obliga a leer de default
+        delivery_charts()
+    return {'rendered': True}
+
+
+@register('approve_deliveries')
+def approve_deliveries(ctx):
+    from .inventory import approve_deliveries as approve
+
+    ctx.progress(10, 'approving')
+    return {'approved': approve(ctx.payload['delivery_ids'])}
+
+
+@register('render_variants')
+def render_variants(ctx):
+    from django.conf import settings
+
+    from .thumbnails import render_variants as render, save_variants
+
+    payload = ctx.payload
+    ctx.progress(10, 'rendering')
+    digest, variants = render(str(settings.MEDIA_ROOT), payload['name'], payload['previous_hash'])
+    if variants is None:  # Mismo contenido que la imagen anterior: sus variantes siguen valiendo
+        variants = payload['previous_variants']
+    save_variants(payload['product_id'], payload['name'], digest, variants)
+    return {'hash': digest, 'variants': len(variants)}
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.movements import archive_cutoff, archive_movements, verify_archives
+
+
+class Command(BaseCommand):
+    help = ("Archiva en CSV comprimidos los movimientos de stock de los meses cerrados "
+            "(o comprueba los archivos existentes con --verify)")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hot-months", type=int, default=None,
+                            help="Meses recientes que se mantienen en la tabla (por defecto MOVEMENT_HOT_MONTHS)")
+        parser.add_argument("--verify", action="store_true", help="Solo comprobar los archivos, sin archivar")
+
+    def handle(self, *args, **options):
+        if options["verify"]:
+            errors = verify_archives()
+            for error in errors:
+                self.stdout.write(f"❌ {error}")
+            if errors:
+                raise CommandError(f"{len(errors)} archivos no coinciden con su registro.")
+            self.stdout.write(self.style.SUCCESS("Todos los archivos son correctos."))
+            return
+
+        if options["hot_months"] is not None and options["hot_months"] < 0:
+            raise CommandError("--hot-months no puede ser negativo.")
+        cutoff = archive_cutoff(options["hot_months"])
+        archives = archive_movements(options["hot_months"])
+        for archive in archives:
+            self.stdout.write(f"📦 {archive}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(archives)} meses archivados (movimientos anteriores a {cutoff:%Y-%m-%d})."
+        ))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from core.thumbnails import generate_all
+
+
+class Command(BaseCommand):
+    help = "Genera las variantes (tamaños y WebP) de las imágenes de producto"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Regenerar aunque la imagen no haya cambiado")
+
+    def handle(self, *args, **options):
+        generated, failed = generate_all(force=options["force"])
+        for product_id, exc in failed:
+            self.stderr.write(f"❌ Producto {product_id}: {exc}")
+        self.stdout.write(self.style.SUCCESS(f"Variantes generadas para {generated} productos."))
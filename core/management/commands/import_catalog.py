@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core.importer import BATCH_SIZE, CATALOG_DIR, CatalogImporter
+
+
+class Command(BaseCommand):
+    help = "Importa tiendas, productos y stock desde stores.csv, products.csv y stock.csv"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", default=CATALOG_DIR, help="Directorio con los CSV")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--delta", action="store_true",
+                            help="Aplicar solo las filas que cambiaron desde la última importación")
+        parser.add_argument("--delete-missing", action="store_true",
+                            help="Eliminar tiendas, productos y stock que ya no aparecen en los CSV")
+
+    def handle(self, *args, **options):
+        report = CatalogImporter(options["dir"], batch_size=options["batch_size"], delta=options["delta"],
+                                 delete_missing=options["delete_missing"]).run()
+        for line in report.lines():
+            self.stdout.write(line)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from core.images import rebuild_manifest
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el manifiesto de imágenes de productos y tiendas"
+
+    def handle(self, *args, **options):
+        refreshed, removed = rebuild_manifest()
+        self.stdout.write(self.style.SUCCESS(
+            f"Manifiesto actualizado: {refreshed} imágenes, {removed} entradas obsoletas eliminadas."
+        ))
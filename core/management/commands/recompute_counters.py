@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.counters import recompute_counters, verify_counters
+
+
+class Command(BaseCommand):
+    help = "Recalcula (o verifica con --check) los totales guardados de tiendas, proveedores, clientes y compras"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="Solo verificar, sin modificar nada")
+
+    def handle(self, *args, **options):
+        mismatches = verify_counters()
+        for model, pk, field, stored, expected in mismatches:
+            self.stdout.write(f"❌ {model} {pk}: {field}={stored}, esperado {expected}")
+
+        if options["check"]:
+            if mismatches:
+                raise CommandError(f"{len(mismatches)} contadores desincronizados.")
+            self.stdout.write(self.style.SUCCESS("Todos los contadores son correctos."))
+            return
+
+        updated = recompute_counters()
+        summary = ", ".join(f"{model}: {count}" for model, count in updated.items())
+        self.stdout.write(self.style.SUCCESS(f"Contadores recalculados ({summary})."))
@@ -0,0 +1,87 @@
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.jobs import HEARTBEAT_SECONDS, claim_next, init_worker, release, requeue_stale, run_job
+
+
+class Command(BaseCommand):
+    help = "Worker de tareas: ejecuta las tareas pendientes de la tabla Job en un pool de procesos"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.JOB_WORKERS)
+        parser.add_argument("--poll", type=float, default=2.0, help="Segundos entre consultas a la cola")
+        parser.add_argument("--once", action="store_true", help="Vaciar la cola y terminar")
+        parser.add_argument("--stale-after", type=int, default=HEARTBEAT_SECONDS * 8,
+                            help="Segundos sin señales de vida tras los que una tarea 'running' se considera "
+                                 "abandonada (se comprueba periódicamente)")
+
+    def handle(self, *args, **options):
+        stale_after = timedelta(seconds=options["stale_after"])
+        self.sweep(stale_after)
+        next_sweep = time.monotonic() + options["stale_after"] / 2
+
+        running = {}  # {future: job_id}
+        pool = self.new_pool(options["workers"])
+        try:
+            while True:
+                if self.reap(running):
+                    self.stdout.write("⚠️ Un proceso del pool murió; se crea un pool nuevo.")
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = self.new_pool(options["workers"])
+                if time.monotonic() >= next_sweep:
+                    self.sweep(stale_after)
+                    next_sweep = time.monotonic() + options["stale_after"] / 2
+
+                job_id = claim_next() if len(running) < options["workers"] else None
+                if job_id is not None:
+                    self.stdout.write(f"▶️ Ejecutando tarea {job_id}")
+                    try:
+                        running[pool.submit(run_job, job_id)] = job_id
+                    except BrokenProcessPool as exc:  # Se reconstruye en la siguiente vuelta
+                        running[self.failed_future(exc)] = job_id
+                    continue
+                if options["once"] and not running:
+                    break
+                time.sleep(options["poll"])
+        except KeyboardInterrupt:
+            self.stdout.write("Deteniendo el worker; las tareas en curso terminan antes de salir.")
+        finally:
+            pool.shutdown(wait=True)
+
+    def new_pool(self, workers):
+        connections.close_all()  # Los procesos hijos no deben heredar la conexión
+        return ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+
+    def reap(self, running):
+        """Quita de ``running`` las tareas terminadas y libera las que no acabaron por un fallo del pool.
+
+        Devuelve si el pool quedó roto (``BrokenProcessPool``: un hijo murió por falta de memoria,
+        una señal...); en ese caso todas las tareas del pool fallan con esa excepción.
+        """
+        broken = False
+        for future in [future for future in running if future.done()]:
+            job_id = running.pop(future)
+            exc = future.exception()
+            if exc is None:
+                continue  # run_job ya guardó el resultado o el error de la tarea
+            broken = broken or isinstance(exc, BrokenProcessPool)
+            retried, failed = release([job_id], f"{type(exc).__name__}: {exc}")
+            self.stdout.write(f"❌ Tarea {job_id}: {exc} ({'reintento' if retried else 'fallida'})")
+        return broken
+
+    def sweep(self, stale_after):
+        retried, failed = requeue_stale(stale_after)
+        if retried or failed:
+            self.stdout.write(f"↩️ Tareas abandonadas: {retried} devueltas a la cola, {failed} fallidas.")
+
+    @staticmethod
+    def failed_future(exc):
+        future = Future()
+        future.set_exception(exc)
+        return future
@@ -0,0 +1,92 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+
+from core.models import Product, Purchase, PurchaseDetail, Stock, StockMovement, Store
+from core.sharding import store_shards, stores_by_shard, sync_catalog
+
+SHARD_ID_BLOCK = 10 ** 12  # Cada shard numera sus filas a partir de índice × bloque: ids únicos entre shards
+BATCH_SIZE = 2000
+
+# Orden de copia: las compras antes que sus detalles
+SHARDED = [
+    (Stock, "store_id"),
+    (StockMovement, "store_id"),
+    (Purchase, "store_id"),
+    (PurchaseDetail, "purchase__store_id"),
+]
+
+
+def reserve_ids(alias, index, legacy_max):
+    """Hace que las tablas del shard numeren a partir de su bloque de ids y por encima
+    de los ids que ya existían en ``default`` (solo SQLite)"""
+    if connections[alias].vendor != "sqlite":
+        return
+    with connections[alias].cursor() as cursor:
+        for model, _ in SHARDED:
+            table = model._meta.db_table
+            start = max(index * SHARD_ID_BLOCK, legacy_max[model])
+            cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s", [start, table])
+            cursor.execute(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                [table, start, table],
+            )
+
+
+def move_rows(alias, store_ids, delete):
+    """Copia a ``alias`` las filas de ``default`` de esas tiendas y, si se pide, las borra de ``default``"""
+    moved = {}
+    for model, store_field in SHARDED:
+        rows = model.objects.using(DEFAULT_DB_ALIAS).filter(**{f"{store_field}__in": store_ids}).order_by("pk")
+        count = 0
+        batch = []
+        for obj in rows.iterator(chunk_size=BATCH_SIZE):
+            batch.append(obj)
+            if len(batch) == BATCH_SIZE:
+                model.objects.using(alias).bulk_create(batch, ignore_conflicts=True)
+                count, batch = count + len(batch), []
+        model.objects.using(alias).bulk_create(batch, ignore_conflicts=True)
+        moved[model.__name__] = count + len(batch)
+    if delete:
+        # Borrado directo, sin señales: los contadores y la disponibilidad no cambian al mover filas
+        for model, store_field in reversed(SHARDED):
+            model.objects.using(DEFAULT_DB_ALIAS).filter(**{f"{store_field}__in": store_ids})._raw_delete(
+                DEFAULT_DB_ALIAS
+            )
+    return moved
+
+
+class Command(BaseCommand):
+    help = ("Prepara los shards por tienda (STORE_SHARD_COUNT): aplica migraciones, copia el catálogo "
+            "y mueve el stock, los movimientos y las compras de cada tienda a su shard")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep", action="store_true",
+                            help="Copiar sin borrar las filas de default (por defecto se mueven)")
+
+    def handle(self, *args, **options):
+        shards = store_shards()
+        if not shards:
+            raise CommandError("No hay shards configurados; define STORE_SHARD_COUNT.")
+
+        legacy_max = {
+            model: model.objects.using(DEFAULT_DB_ALIAS).aggregate(last=Max("pk"))["last"] or 0
+            for model, _ in SHARDED
+        }
+        for index, alias in enumerate(shards):
+            call_command("migrate", database=alias, verbosity=0)
+            # migrate deja activadas las claves ajenas en su conexión; la nueva aplica el perfil del shard
+            connections[alias].close()
+            reserve_ids(alias, index, legacy_max)
+        sync_catalog(Store)
+        sync_catalog(Product)
+        self.stdout.write(f"📌 Catálogo copiado en {len(shards)} shards.")
+
+        store_ids = list(Store.objects.values_list("id", flat=True))
+        for alias, shard_store_ids in stores_by_shard(store_ids).items():
+            with transaction.atomic(), transaction.atomic(using=alias):
+                moved = move_rows(alias, shard_store_ids, delete=not options["keep"])
+            summary = ", ".join(f"{name}: {count}" for name, count in moved.items())
+            self.stdout.write(f"✅ {alias} ({len(shard_store_ids)} tiendas) — {summary}")
@@ -0,0 +1,139 @@
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.models import Product, Stock, StockMovement
+from supply_management.sqlite_profile import BUSY_TIMEOUT_MS, FILE_PRAGMAS, PRAGMAS
+
+# Configuración por defecto de Django frente al perfil de producción
+PROFILES = {
+    "default": {"pragmas": {}, "transaction_mode": "DEFERRED", "persistent": False, "timeout": 5.0},
+    "production": {"pragmas": {**FILE_PRAGMAS, **PRAGMAS}, "transaction_mode": "IMMEDIATE", "persistent": True,
+                   "timeout": BUSY_TIMEOUT_MS / 1000},
+}
+
+# Listado de stock de una tienda (lectura) y venta de una unidad con su movimiento (escritura)
+READ_SQL = (
+    f'SELECT s.id, s.quantity, p.name FROM "{Stock._meta.db_table}" s '
+    f'JOIN "{Product._meta.db_table}" p ON p.id = s.product_id '
+    f'WHERE s.store_id = ? ORDER BY p.name LIMIT 50'
+)
+SELECT_SQL = f'SELECT quantity FROM "{Stock._meta.db_table}" WHERE id = ?'
+UPDATE_SQL = f'UPDATE "{Stock._meta.db_table}" SET quantity = quantity + ? WHERE id = ? AND quantity + ? >= 0'
+MOVEMENT_SQL = (
+    f'INSERT INTO "{StockMovement._meta.db_table}" (store_id, product_id, quantity, movement_type, date) '
+    f"VALUES (?, ?, 1, ?, datetime('now'))"
+)
+
+
+def connect(path, profile):
+    conn = sqlite3.connect(path, timeout=profile["timeout"], isolation_level=None, check_same_thread=False)
+    for name, value in profile["pragmas"].items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+def run_workload(path, profile, threads, seconds, write_ratio, stock_rows):
+    """Lanza ``threads`` clientes durante ``seconds`` segundos y devuelve las estadísticas agregadas"""
+    stats = {"reads": 0, "writes": 0, "errors": 0, "latencies": []}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client(seed):
+        rng = random.Random(seed)
+        conn = connect(path, profile) if profile["persistent"] else None
+        local = {"reads": 0, "writes": 0, "errors": 0, "latencies": []}
+        while time.perf_counter() < deadline:
+            stock_id, store_id, product_id = rng.choice(stock_rows)
+            started = time.perf_counter()
+            db = conn
+            try:
+                db = db or connect(path, profile)  # Sin conexiones persistentes: una por petición
+                if rng.random() < write_ratio:
+                    delta = rng.choice((1, -1))
+                    db.execute(f"BEGIN {profile['transaction_mode']}")
+                    try:
+                        db.execute(SELECT_SQL, [stock_id]).fetchone()
+                        db.execute(UPDATE_SQL, [delta, stock_id, delta])
+                        db.execute(MOVEMENT_SQL, [store_id, product_id, "IN" if delta > 0 else "OUT"])
+                        db.execute("COMMIT")
+                    except sqlite3.Error:
+                        db.execute("ROLLBACK")
+                        raise
+                    local["writes"] += 1
+                else:
+                    db.execute(READ_SQL, [store_id]).fetchall()
+                    local["reads"] += 1
+                local["latencies"].append(time.perf_counter() - started)
+            except sqlite3.OperationalError:  # "database is locked"
+                local["errors"] += 1
+            finally:
+                if db is not None and db is not conn:
+                    db.close()
+        if conn:
+            conn.close()
+        with lock:
+            for key in ("reads", "writes", "errors"):
+                stats[key] += local[key]
+            stats["latencies"].extend(local["latencies"])
+
+    workers = [threading.Thread(target=client, args=(seed,)) for seed in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    stats["elapsed"] = time.perf_counter() - started
+    return stats
+
+
+def summary(stats):
+    latencies = sorted(stats["latencies"]) or [0]
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    ops = stats["reads"] + stats["writes"]
+    return (f"{ops / stats['elapsed']:8.1f} ops/s  lecturas {stats['reads']:6}  escrituras {stats['writes']:6}  "
+            f"errores {stats['errors']:4}  p95 {p95 * 1000:7.1f} ms")
+
+
+class Command(BaseCommand):
+    help = ("Compara el rendimiento de la configuración por defecto de SQLite con el perfil de producción "
+            "bajo lecturas y escrituras concurrentes, sobre copias de la base de datos")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default", help="Alias de la base de datos a copiar")
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--seconds", type=float, default=5.0)
+        parser.add_argument("--write-ratio", type=float, default=0.2, help="Fracción de operaciones de escritura")
+        parser.add_argument("--profile", choices=sorted(PROFILES), action="append",
+                            help="Perfiles a medir (por defecto, todos)")
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        if connection.vendor != "sqlite":
+            raise CommandError("El benchmark solo aplica a bases de datos SQLite.")
+
+        stock_rows = list(Stock.objects.using(options["database"]).values_list("id", "store_id", "product_id")[:5000])
+        if not stock_rows:
+            raise CommandError("No hay registros de stock; carga datos antes de medir (manage.py import_catalog).")
+
+        with tempfile.TemporaryDirectory() as workdir:
+            for name in options["profile"] or list(PROFILES):
+                # Copia nueva por perfil: el modo WAL queda grabado en el fichero
+                path = str(Path(workdir) / f"{name}.sqlite3")
+                target = sqlite3.connect(path)
+                connection.ensure_connection()
+                connection.connection.backup(target)
+                target.execute(f"PRAGMA journal_mode={PROFILES[name]['pragmas'].get('journal_mode', 'DELETE')}")
+                target.close()
+
+                stats = run_workload(path, PROFILES[name], options["threads"], options["seconds"],
+                                     options["write_ratio"], stock_rows)
+                self.stdout.write(f"{name:>10}: {summary(stats)}")
+                for suffix in ("", "-wal", "-shm"):
+                    Path(path + suffix).unlink(missing_ok=True)
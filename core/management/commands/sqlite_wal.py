@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.routers import replica_alias
+from supply_management.sqlite_profile import FILE_PRAGMAS
+
+
+class Command(BaseCommand):
+    help = ("Activa el modo WAL (o vuelve al diario por defecto con --off) en las bases de datos SQLite. "
+            "Queda grabado en el fichero: basta con ejecutarlo una vez por despliegue")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", action="append",
+                            help="Alias de la base de datos (por defecto, todas las SQLite salvo la réplica)")
+        parser.add_argument("--off", action="store_true", help="Volver a journal_mode=DELETE")
+
+    def handle(self, *args, **options):
+        aliases = options["database"] or [alias for alias in connections
+                                          if connections[alias].vendor == "sqlite" and alias != replica_alias()]
+        mode = "DELETE" if options["off"] else FILE_PRAGMAS["journal_mode"]
+        for alias in aliases:
+            if alias not in connections or connections[alias].vendor != "sqlite":
+                raise CommandError(f"{alias} no es una base de datos SQLite configurada.")
+            with connections[alias].cursor() as cursor:
+                cursor.execute(f"PRAGMA journal_mode={mode}")
+                current = cursor.fetchone()[0]
+            self.stdout.write(f"✅ {alias}: journal_mode={current}")
@@ -0,0 +1,60 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Módulos que no deben cargarse al arrancar ni al resolver URLs
+HEAVY_MODULES = ["matplotlib", "seaborn", "pandas", "numpy"]
+
+# Se ejecuta en un proceso limpio para medir el arranque real de un worker
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+from django.urls import resolve, reverse
+resolve(reverse("home"))
+resolve(reverse("store_products", args=[1]))
+elapsed = time.perf_counter() - started
+try:  # En Linux ru_maxrss incluye el pico del proceso padre antes del exec; VmHWM no
+    with open("/proc/self/status") as status:
+        rss_kb = next(int(line.split()[1]) for line in status if line.startswith("VmHWM:"))
+except (OSError, StopIteration):
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+heavy = sorted({name.split(".")[0] for name in sys.modules} & set(json.loads(sys.argv[1])))
+print(json.dumps({"seconds": elapsed, "rss_mb": rss_kb / 1024, "heavy": heavy}))
+"""
+
+
+def measure_startup():
+    """Tiempo, memoria y módulos pesados tras ``django.setup()`` y resolver URLs"""
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE, json.dumps(HEAVY_MODULES)],
+        capture_output=True, text=True, env=os.environ.copy(), check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+class Command(BaseCommand):
+    help = "Mide el arranque (django.setup() + resolución de URLs) y falla si se cargan librerías pesadas"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-seconds", type=float, default=3.0)
+        parser.add_argument("--max-rss-mb", type=float, default=80.0)
+
+    def handle(self, *args, **options):
+        stats = measure_startup()
+        self.stdout.write(f"Arranque: {stats['seconds']:.3f} s, RSS máximo: {stats['rss_mb']:.1f} MB")
+
+        errors = []
+        if stats["heavy"]:
+            errors.append(f"librerías pesadas cargadas al arrancar: {', '.join(stats['heavy'])}")
+        if stats["seconds"] > options["max_seconds"]:
+            errors.append(f"el arranque supera {options['max_seconds']} s")
+        if stats["rss_mb"] > options["max_rss_mb"]:
+            errors.append(f"la memoria supera {options['max_rss_mb']} MB")
+        if errors:
+            raise CommandError("; ".join(errors))
+        self.stdout.write(self.style.SUCCESS("Arranque dentro del presupuesto."))
@@ -0,0 +1,41 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core.routers import replica_alias
+
+
+def sync(source, replica):
+    """Copia ``source`` sobre la réplica SQLite con la API de backup (consistente aunque haya escrituras)"""
+    connections[replica].close()  # Las conexiones abiertas verán la copia nueva al reconectar
+    target = sqlite3.connect(connections[replica].settings_dict["NAME"], timeout=30)
+    try:
+        connections[source].ensure_connection()
+        connections[source].connection.backup(target, pages=1024)
+    finally:
+        target.close()
+
+
+class Command(BaseCommand):
+    help = "Sincroniza la réplica SQLite local con la base de datos principal (para desarrollo y pruebas)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=0,
+                            help="Repetir la copia cada N segundos (por defecto, una sola vez)")
+
+    def handle(self, *args, **options):
+        replica = replica_alias()
+        if replica is None:
+            raise CommandError("No hay réplica configurada; define REPLICA_DATABASE_PATH.")
+        if connections[replica].vendor != "sqlite" or connections[DEFAULT_DB_ALIAS].vendor != "sqlite":
+            raise CommandError("sync_replica solo copia entre ficheros SQLite; una réplica real se sincroniza sola.")
+
+        while True:
+            started = time.perf_counter()
+            sync(DEFAULT_DB_ALIAS, replica)
+            self.stdout.write(f"✅ Réplica sincronizada en {time.perf_counter() - started:.2f} s")
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
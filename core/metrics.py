@@ -0,0 +1,132 @@
+"""
+Métricas de las peticiones por vista, en formato de texto de Prometheus.
+
+``RequestMetricsMiddleware`` mide cada petición (latencia, número de
+consultas, tiempo en la base de datos y tamaño de la respuesta) y la anota
+con el nombre de su URL. Los valores se acumulan en memoria del proceso, sin
+consultas ni E/S, y se exportan en ``/metrics``; con varios procesos cada uno
+exporta los suyos (la etiqueta ``pid`` permite sumarlos en Prometheus).
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Segundos
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)  # Bytes
+UNMATCHED = "<unmatched>"  # Peticiones que no resuelven a una URL con nombre (404, estáticos, ...)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # El último es +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+
+class ViewMetrics:
+    __slots__ = ("latency", "queries", "size", "db_seconds", "responses")
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.db_seconds = 0.0
+        self.responses = Counter()  # Código de estado → peticiones
+
+
+_lock = threading.Lock()
+_views = {}
+
+
+class QueryTimer:
+    """``execute_wrapper`` que cuenta las consultas y el tiempo pasado en la base de datos"""
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+def view_label(request):
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match and match.url_name else UNMATCHED
+
+
+def observe(view, status, seconds, queries, db_seconds, size=None):
+    """Registra una petición; ``size`` es ``None`` en respuestas en streaming"""
+    with _lock:
+        metrics = _views.get(view)
+        if metrics is None:
+            metrics = _views[view] = ViewMetrics()
+        metrics.latency.observe(seconds)
+        metrics.queries.observe(queries)
+        metrics.db_seconds += db_seconds
+        metrics.responses[status] += 1
+        if size is not None:
+            metrics.size.observe(size)
+
+
+def reset():
+    with _lock:
+        _views.clear()
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render():
+    """Todas las métricas en formato de texto de Prometheus (versión 0.0.4)"""
+    pid = os.getpid()
+    with _lock:
+        views = sorted(_views.items())
+        sections = {
+            "http_requests_total": ("counter", "Peticiones por vista y código de estado", []),
+            "http_request_duration_seconds": ("histogram", "Latencia de las peticiones", []),
+            "http_request_queries": ("histogram", "Consultas SQL por petición", []),
+            "http_request_db_seconds_total": ("counter", "Tiempo total en la base de datos", []),
+            "http_response_size_bytes": ("histogram", "Tamaño de las respuestas (sin streaming)", []),
+        }
+        for view, metrics in views:
+            labels = f'view="{_escape(view)}",pid="{pid}"'
+            for status, count in sorted(metrics.responses.items()):
+                sections["http_requests_total"][2].append(f'http_requests_total{{{labels},status="{status}"}} {count}')
+            sections["http_request_duration_seconds"][2].extend(
+                metrics.latency.lines("http_request_duration_seconds", labels))
+            sections["http_request_queries"][2].extend(metrics.queries.lines("http_request_queries", labels))
+            sections["http_request_db_seconds_total"][2].append(
+                f"http_request_db_seconds_total{{{labels}}} {metrics.db_seconds}")
+            if metrics.size.count:
+                sections["http_response_size_bytes"][2].extend(metrics.size.lines("http_response_size_bytes", labels))
+
+    lines = []
+    for name, (kind, help_text, samples) in sections.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", *samples]
+    return "\n".join(lines) + "\n"
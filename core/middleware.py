@@ -0,0 +1,94 @@
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from . import profiling
+from .metrics import QueryTimer, observe, view_label
+from .routers import replica_alias, stick_to_default, track_writes
+from .slow_queries import current_view
+
+
+class RequestMetricsMiddleware:
+    """Mide latencia, consultas, tiempo de base de datos y tamaño de cada respuesta (ver core.metrics).
+
+    Va la primera en MIDDLEWARE para incluir también las consultas de sesión y autenticación.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(timer))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        size = None if response.streaming else len(response.content)
+        observe(view_label(request), response.status_code, elapsed, timer.count, timer.seconds, size)
+        return response
+
+
+class ReplicaStickinessMiddleware:
+    """Fija la sesión a ``default`` durante un tiempo después de que una petición escriba"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replica_alias():
+            return self.get_response(request)
+
+        with track_writes() as wrote:
+            response = self.get_response(request)
+            if wrote() and hasattr(request, 'session'):
+                stick_to_default(request)
+        return response
+
+
+class SlowQueryViewMiddleware:
+    """Anota las consultas lentas (core.slow_queries) con la vista que las lanzó"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = current_view.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            current_view.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        current_view.set(view_label(request))
+
+
+class SamplingProfilerMiddleware:
+    """Perfila la petición si la pide un usuario staff o le toca por muestreo (ver core.profiling).
+
+    Va después de AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not profiling.should_profile(request):
+            return self.get_response(request)
+
+        trigger = 'request' if profiling.requested(request) else 'sample'
+        started = time.perf_counter()
+        sampler = profiling.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            stacks = sampler.stop()
+        elapsed = time.perf_counter() - started
+
+        name = profiling.save_profile(stacks, profiling.profile_meta(request, response, elapsed, trigger))
+        if trigger == 'request':
+            response['X-Profile-Id'] = name
+        return response
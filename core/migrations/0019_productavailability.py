@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_availability(apps, schema_editor):
+    """Construye el índice inicial a partir del stock existente"""
+    Stock = apps.get_model('core', 'Stock')
+    ProductAvailability = apps.get_model('core', 'ProductAvailability')
+    pairs = Stock.objects.filter(quantity__gt=0).values_list('store_id', 'product_id').distinct()
+    ProductAvailability.objects.bulk_create(
+        [ProductAvailability(store_id=store_id, product_id=product_id) for store_id, product_id in pairs],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_product_iva_delete_supplierstorerelation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability', to='core.product')),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability', to='core.store')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('store', 'product'), name='unique_availability_store_product')],
+            },
+        ),
+        migrations.RunPython(populate_availability, migrations.RunPython.noop),
+    ]
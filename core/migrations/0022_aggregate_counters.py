@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:18
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def compute_counters(apps, schema_editor):
+    """Calcula los totales iniciales a partir de los datos existentes"""
+    def aggregate(model, fk, expression, default):
+        rows = model.objects.filter(**{fk: OuterRef('pk')}).values(fk).annotate(value=expression).values('value')
+        return Coalesce(Subquery(rows), default)
+
+    Stock = apps.get_model('core', 'Stock')
+    SupplierDelivery = apps.get_model('core', 'SupplierDelivery')
+    Purchase = apps.get_model('core', 'Purchase')
+    PurchaseDetail = apps.get_model('core', 'PurchaseDetail')
+    apps.get_model('core', 'Store').objects.update(
+        stock_total=aggregate(Stock, 'store', Sum('quantity'), Value(0)))
+    apps.get_model('core', 'Supplier').objects.update(
+        delivered_units=aggregate(SupplierDelivery, 'supplier', Sum('quantity'), Value(0)))
+    apps.get_model('core', 'Customer').objects.update(
+        purchase_count=aggregate(Purchase, 'customer', Count('id'), Value(0)))
+    Purchase.objects.update(
+        amount=aggregate(PurchaseDetail, 'purchase', Sum(F('unit_price') * F('quantity')), Value(Decimal('0'))))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_product_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='purchase_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='stock_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='supplier',
+            name='delivered_units',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(compute_counters, migrations.RunPython.noop),
+    ]
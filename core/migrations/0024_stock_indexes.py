@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:21
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicate_stock(apps, schema_editor):
+    """Fusiona los registros de stock repetidos (misma tienda y producto) antes de la restricción única"""
+    Stock = apps.get_model('core', 'Stock')
+    duplicates = (Stock.objects.values('store_id', 'product_id')
+                  .annotate(rows=Count('id'), total=Sum('quantity')).filter(rows__gt=1))
+    for duplicate in list(duplicates):
+        entries = Stock.objects.filter(store_id=duplicate['store_id'], product_id=duplicate['product_id'])
+        keep = entries.order_by('id').first()
+        entries.exclude(pk=keep.pk).delete()
+        entries.filter(pk=keep.pk).update(quantity=duplicate['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_importfingerprint'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_stock, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['customer', 'date'], name='purchase_customer_date'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['store', 'product', 'date'], name='movement_store_product_date'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['date'], name='movement_date'),
+        ),
+        migrations.AddIndex(
+            model_name='supplierdelivery',
+            index=models.Index(condition=models.Q(('approved', False)), fields=['delivery_date'], name='delivery_pending_date'),
+        ),
+        migrations.AddIndex(
+            model_name='supplierdelivery',
+            index=models.Index(fields=['supplier', 'delivery_date'], name='delivery_supplier_date'),
+        ),
+        migrations.AddConstraint(
+            model_name='stock',
+            constraint=models.UniqueConstraint(fields=('store', 'product'), name='unique_stock_store_product'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_product_name_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['date'], name='purchase_date'),
+        ),
+        migrations.AddIndex(
+            model_name='supplierdelivery',
+            index=models.Index(condition=models.Q(('approved', True)), fields=['delivery_date'], name='delivery_approved_date'),
+        ),
+    ]
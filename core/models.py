@@ -1,9 +1,19 @@
+from decimal import Decimal
+
 from django.contrib.auth.models import Group, Permission
 from django.contrib.auth.models import User
 from django.core.validators import FileExtensionValidator, MinValueValidator
 from django.db import models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.contrib.contenttypes.models import ContentType
-from PIL import Image
+
+from .sharding import ShardedQuerySet, atomic_for_stores, stores_by_shard
+
+
+class InsufficientStock(ValueError):
+    """No hay stock suficiente para completar la operación"""
 
 
 class Customer(models.Model):
@@ -14,10 +24,11 @@ class Customer(models.Model):
     street = models.CharField(max_length=250, blank=True, null=True)
     nif = models.CharField(max_length=20, unique=True)  # Tax ID
     registration_date = models.DateTimeField(auto_now_add=True)
+    purchase_count = models.PositiveIntegerField(default=0, editable=False)  # Mantenido por Purchase.save
 
     def total_purchases(self):
         """Devuelve el número total de compras de este cliente"""
-        return self.purchases.count()
+        return self.purchase_count
 
     def __str__(self):
         return f"{self.name} (Compras: {self.total_purchases()})"
@@ -31,16 +42,40 @@ class Supplier(models.Model):
     email = models.EmailField(unique=True)
     street = models.CharField(max_length=250, blank=True, null=True)
     nif = models.CharField(max_length=20, unique=True)  # Tax ID
+    delivered_units = models.PositiveIntegerField(default=0, editable=False)  # Mantenido por SupplierDelivery.save
 
     def total_deliveries(self):
         """Cantidad total de productos entregados por este proveedor"""
-        return sum(delivery.quantity for delivery in self.supplierdelivery_set.all())
+        return self.delivered_units
 
     def __str__(self):
         return f"{self.name} (Entregas totales: {self.total_deliveries()} unidades)"
 
 
-class Store(models.Model):
+class SavedImageMixin:
+    """Recuerda el nombre de la imagen guardada para saber si un ``save`` la cambia"""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'image' in field_names:  # Nombre guardado, para detectar imágenes nuevas
+            instance._saved_image = values[field_names.index('image')] or ""
+        return instance
+
+    def image_changed(self):
+        """Si la imagen actual no es la que hay guardada (subida nueva u otro nombre)"""
+        name = self.image.name or ""
+        if self._state.adding or (self.image and not self.image._committed):
+            return bool(name)
+        return name != getattr(self, '_saved_image', name)
+
+    def save(self, *args, **kwargs):
+        self._image_changed = self.image_changed()  # Lo consultan las señales post_save
+        super().save(*args, **kwargs)
+        self._saved_image = self.image.name or ""
+
+
+class Store(SavedImageMixin, models.Model):
     name = models.CharField(max_length=100)
     street = models.CharField(max_length=250)
     phone = models.CharField(max_length=15, blank=True, null=True)
@@ -51,18 +86,19 @@ class Store(models.Model):
         default="img/sin-imagen.jpg",
         validators=[FileExtensionValidator(["jpg", "png", "jpeg"])]
     )
+    stock_total = models.PositiveIntegerField(default=0, editable=False)  # Mantenido por Stock
 
     def total_stock(self):
         """Calcula el stock total de todos los productos en la tienda"""
-        return sum(stock_entry.quantity for stock_entry in self.stock_entries.all())
+        return self.stock_total
 
     def __str__(self):
         # return f"{self.name} (Stock total: {self.total_stock()})"
         return f"{self.name} ({self.street})"
 
 
-class Product(models.Model):
-    name = models.CharField(max_length=100)
+class Product(SavedImageMixin, models.Model):
+    name = models.CharField(max_length=100, db_index=True)
     description = models.TextField(blank=True, null=True)
     cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -75,40 +111,104 @@ class Product(models.Model):
         validators=[FileExtensionValidator(["jpg", "png", "jpeg"])]
     )
 
+    image_hash = models.CharField(max_length=64, blank=True, default="")
+    image_variants = models.JSONField(blank=True, default=dict)  # {"card": ..., "card_webp": ..., ...}
+
     def save(self, *args, **kwargs):
-        """Redimensiona la imagen antes de guardarla"""
+        """Guarda el producto y, si cambió la imagen, encola sus miniaturas"""
+        image_changed = self.image_changed()
+        previous_hash, previous_variants = self.image_hash, self.image_variants
+        if image_changed or not self.image:  # Las variantes de la imagen anterior ya no sirven
+            self.image_hash, self.image_variants = "", {}
+
         super().save(*args, **kwargs)  # Guarda primero el producto
 
-        if self.image:  # Si hay una imagen, redimensionarla
-            image_path = self.image.path
-            img = Image.open(image_path)
-            img.thumbnail((500, 500))  # Ajusta a 500x500px
-            img.save(image_path)
+        if image_changed and self.image:  # Las variantes se generan en el worker de tareas
+            from .thumbnails import schedule_variants
+            schedule_variants(self, previous_hash, previous_variants)
 
     def __str__(self):
         return self.name
 
 
+class ImageManifest(models.Model):
+    """Imágenes de productos y tiendas ya resueltas: existencia, URL y dimensiones"""
+    name = models.CharField(max_length=255, unique=True)
+    exists = models.BooleanField(default=False)
+    url = models.CharField(max_length=255)
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} ({'ok' if self.exists else 'no existe'})"
+
+
 class Stock(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_entries')
     store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='stock_entries')
     quantity = models.PositiveIntegerField(default=0, validators=[MinValueValidator(0)])
 
-    def update_stock(self, amount, movement_type):
-        """Actualizar stock y registrar el movimiento"""
-        if movement_type == 'OUT' and self.quantity < amount:
-            raise ValueError("No hay suficiente stock disponible.")
+    objects = ShardedQuerySet.as_manager()
 
-        self.quantity += amount if movement_type == 'IN' else -amount
-        self.save()
+    class Meta:
+        constraints = [
+            # Un único registro de stock por tienda y producto (también sirve de índice por tienda)
+            models.UniqueConstraint(fields=['store', 'product'], name='unique_stock_store_product'),
+        ]
 
-        # Registrar movimiento
-        StockMovement.objects.create(
-            product=self.product,
-            store=self.store,
-            quantity=amount,
-            movement_type=movement_type
-        )
+    def update_stock(self, amount, movement_type):
+        """Actualizar stock y registrar el movimiento.
+
+        El ajuste es un contador atómico en la base de datos
+        (``UPDATE ... SET quantity = quantity ± n WHERE quantity >= n``), así
+        que las actualizaciones concurrentes no se pierden. Lanza
+        ``InsufficientStock`` si no hay stock suficiente para una salida.
+        """
+        rows = Stock.objects.for_store(self.store_id).filter(pk=self.pk)
+        if movement_type == StockMovement.DECREASE:
+            rows = rows.filter(quantity__gte=amount)
+        delta = amount if movement_type == StockMovement.INCREASE else -amount
+
+        with atomic_for_stores(self.store_id):
+            if not rows.update(quantity=F('quantity') + delta):
+                raise InsufficientStock("No hay suficiente stock disponible.")
+            Store.objects.filter(pk=self.store_id).update(stock_total=F('stock_total') + delta)
+            self.refresh_from_db(fields=['quantity'])
+            self._saved_quantity = self.quantity
+
+            # Registrar movimiento
+            StockMovement.objects.for_store(self.store_id).create(
+                product_id=self.product_id,
+                store_id=self.store_id,
+                quantity=amount,
+                movement_type=movement_type
+            )
+            ProductAvailability.refresh(self.store_id, self.product_id, self.quantity)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        if 'quantity' in loaded and 'store_id' in loaded:  # Valores guardados, para calcular diferencias
+            instance._saved_quantity, instance._saved_store_id = loaded['quantity'], loaded['store_id']
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Guarda el stock y mantiene el índice de disponibilidad y el total de la tienda"""
+        saved_quantity = getattr(self, '_saved_quantity', 0)
+        saved_store_id = getattr(self, '_saved_store_id', self.store_id)
+        with atomic_for_stores(self.store_id):
+            super().save(*args, **kwargs)
+            if saved_store_id != self.store_id:
+                Store.objects.filter(pk=saved_store_id).update(stock_total=F('stock_total') - saved_quantity)
+                saved_quantity = 0
+            if self.quantity != saved_quantity:
+                Store.objects.filter(pk=self.store_id).update(
+                    stock_total=F('stock_total') + (self.quantity - saved_quantity)
+                )
+            ProductAvailability.refresh(self.store_id, self.product_id, self.quantity)
+        self._saved_quantity, self._saved_store_id = self.quantity, self.store_id
 
     def is_low_stock(self):
         """Verifica si el stock está por debajo del 90% de la provisión"""
@@ -119,6 +219,58 @@ class Stock(models.Model):
         return f"{self.product.name} - {self.store.name}: {self.quantity} unidades"
 
 
+class ProductAvailability(models.Model):
+    """Índice tienda×producto con los productos que tienen stock disponible.
+
+    Lo mantiene ``Stock.save`` (y por tanto ``update_stock`` y la aprobación de
+    entregas), de modo que el catálogo de una tienda se resuelve con una única
+    consulta indexada en lugar de un join con ``distinct()`` sobre ``Stock``.
+    """
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='availability')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='availability')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'product'], name='unique_availability_store_product'),
+        ]
+
+    @classmethod
+    def refresh(cls, store_id, product_id, quantity):
+        """Añade o elimina la entrada según haya o no stock disponible"""
+        if quantity > 0:
+            cls.objects.get_or_create(store_id=store_id, product_id=product_id)
+        else:
+            cls.objects.filter(store_id=store_id, product_id=product_id).delete()
+
+    @classmethod
+    def rebuild(cls, store_ids):
+        """Reconstruye el índice de las tiendas indicadas a partir de su stock"""
+        cls.objects.filter(store_id__in=store_ids).delete()
+        for alias, shard_store_ids in stores_by_shard(store_ids).items():
+            pairs = Stock.objects.using(alias).filter(store_id__in=shard_store_ids, quantity__gt=0) \
+                .values_list('store_id', 'product_id')
+            cls.objects.bulk_create([cls(store_id=store_id, product_id=product_id) for store_id, product_id in pairs],
+                                    ignore_conflicts=True)
+
+    def __str__(self):
+        return f"{self.product.name} disponible en {self.store.name}"
+
+
+class ImportFingerprint(models.Model):
+    """Huella de la última versión importada de cada fila de los CSV del catálogo"""
+    feed = models.CharField(max_length=20)  # stores, products o stock
+    key = models.CharField(max_length=255)
+    checksum = models.CharField(max_length=40)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['feed', 'key'], name='unique_import_fingerprint'),
+        ]
+
+    def __str__(self):
+        return f"{self.feed}: {self.key}"
+
+
 class StockMovement(models.Model):
     INCREASE = 'IN'
     DECREASE = 'OUT'
@@ -133,18 +285,76 @@ class StockMovement(models.Model):
     movement_type = models.CharField(max_length=3, choices=MOVEMENT_CHOICES)
     date = models.DateTimeField(auto_now_add=True)
 
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['store', 'product', 'date'], name='movement_store_product_date'),
+            models.Index(fields=['date'], name='movement_date'),
+        ]
+
     def __str__(self):
         return f"{self.movement_type} {self.quantity} of {self.product.name} at {self.store.name}"
 
 
+class MovementArchive(models.Model):
+    """Mes de movimientos de stock exportado a un CSV comprimido (ver core.movements)"""
+    month = models.DateField()  # Primer día del mes
+    database = models.CharField(max_length=50, default='default')  # Base de datos (o shard) de origen
+    path = models.CharField(max_length=255)  # Relativa a settings.MOVEMENT_ARCHIVE_DIR
+    rows = models.PositiveIntegerField()
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    checksum = models.CharField(max_length=64)  # SHA-256 del fichero
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['month', 'database'], name='unique_movement_archive'),
+        ]
+
+    def __str__(self):
+        return f"Movimientos {self.month:%Y-%m} ({self.database}): {self.rows} filas"
+
+
 class Purchase(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='purchases')
     store = models.ForeignKey(Store, on_delete=models.CASCADE)
     date = models.DateTimeField(auto_now_add=True)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)  # Suma de los detalles
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'date'], name='purchase_customer_date'),
+            models.Index(fields=['date'], name='purchase_date'),
+        ]
 
     def total_amount(self):
         """Calcula el total de la compra sumando los detalles"""
-        return sum(detail.total_price() for detail in self.details.all())
+        return self.amount
+
+    def save(self, *args, **kwargs):
+        """Guarda la compra y cuenta la compra en el cliente"""
+        adding = self._state.adding
+        with atomic_for_stores(self.store_id):
+            super().save(*args, **kwargs)
+            if adding:
+                Customer.objects.filter(pk=self.customer_id).update(purchase_count=F('purchase_count') + 1)
+
+    def refresh_amount(self):
+        """Recalcula el total guardado a partir de los detalles"""
+        Purchase.refresh_amounts([self.pk], self._state.db)
+
+    @staticmethod
+    def refresh_amounts(purchase_ids, using):
+        """Recalcula con un solo UPDATE el total guardado de esas compras"""
+        Purchase.objects.using(using).filter(pk__in=purchase_ids).update(amount=Coalesce(
+            Subquery(PurchaseDetail.objects.filter(purchase=OuterRef('pk')).values('purchase')
+                     .annotate(total=Sum(F('unit_price') * F('quantity'))).values('total')),
+            Value(Decimal('0')),
+        ))
 
     def __str__(self):
         return f"Compra {self.id} - {self.customer.name} (Total: {self.total_amount()}€)"
@@ -156,6 +366,8 @@ class PurchaseDetail(models.Model):
     quantity = models.PositiveIntegerField()
     unit_price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)  # Guardar precio unitario
 
+    objects = ShardedQuerySet.as_manager()
+
     def total_price(self):
         """Calcula el total basado en cantidad y precio unitario"""
         return self.unit_price * self.quantity
@@ -172,13 +384,50 @@ class SupplierDelivery(models.Model):
     delivery_date = models.DateTimeField(auto_now_add=True)
     approved = models.BooleanField(default=False)  # Nuevo campo para aprobación
 
+    class Meta:
+        indexes = [
+            # Índice parcial: solo las entregas pendientes de aprobación
+            models.Index(fields=['delivery_date'], condition=models.Q(approved=False), name='delivery_pending_date'),
+            # Índice parcial para los informes, que solo agregan entregas aprobadas
+            models.Index(fields=['delivery_date'], condition=models.Q(approved=True), name='delivery_approved_date'),
+            models.Index(fields=['supplier', 'delivery_date'], name='delivery_supplier_date'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        if 'quantity' in loaded and 'supplier_id' in loaded:  # Valores guardados, para calcular diferencias
+            instance._saved_quantity, instance._saved_supplier_id = loaded['quantity'], loaded['supplier_id']
+        if 'approved' in loaded:
+            instance._saved_approved = loaded['approved']
+        return instance
+
     def save(self, *args, **kwargs):
         """Actualizar stock en la tienda tras la entrega"""
-        super().save(*args, **kwargs)  # Guarda la entrega primero
-
-        if self.approved:
-            stock, created = Stock.objects.get_or_create(product=self.product, store=self.store)
-            stock.update_stock(self.quantity, "IN")  # Usamos la función update_stock()
+        saved_quantity = getattr(self, '_saved_quantity', 0)
+        saved_supplier_id = getattr(self, '_saved_supplier_id', self.supplier_id)
+        newly_approved = self.approved and not getattr(self, '_saved_approved', False)
+        with atomic_for_stores(self.store_id):
+            super().save(*args, **kwargs)  # Guarda la entrega primero
+
+            # Total entregado por el proveedor
+            if saved_supplier_id != self.supplier_id:
+                Supplier.objects.filter(pk=saved_supplier_id).update(
+                    delivered_units=F('delivered_units') - saved_quantity
+                )
+                saved_quantity = 0
+            if self.quantity != saved_quantity:
+                Supplier.objects.filter(pk=self.supplier_id).update(
+                    delivered_units=F('delivered_units') + (self.quantity - saved_quantity)
+                )
+
+            if newly_approved:  # Solo al aprobarse, no en cada guardado posterior
+                stock, created = Stock.objects.for_store(self.store_id).get_or_create(product=self.product,
+                                                                                      store=self.store)
+                stock.update_stock(self.quantity, "IN")  # Usamos la función update_stock()
+        self._saved_quantity, self._saved_supplier_id = self.quantity, self.supplier_id
+        self._saved_approved = self.approved
 
     def __str__(self):
         return f"Entrega {self.supplier.name} -> {self.store.name} ({self.quantity} unidades)"
@@ -215,3 +464,48 @@ class CartItem(models.Model):
 
     def __str__(self):
         return f"{self.quantity} x {self.product.name} en {self.store.name}"
+
+
+class Job(models.Model):
+    """Tarea pesada que se ejecuta fuera de la petición con ``manage.py run_jobs``"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    ]
+    FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    progress = models.PositiveSmallIntegerField(default=0)  # Porcentaje
+    message = models.CharField(max_length=255, blank=True)
+    result = models.JSONField(blank=True, null=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    cancel_requested = models.BooleanField(default=False)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField(default=timezone.now)  # Para reintentos con espera
+    started_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)  # Señal de vida del proceso que la ejecuta
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after'),
+        ]
+
+    def is_finished(self):
+        return self.status in self.FINISHED
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.status}, {self.progress}%)"
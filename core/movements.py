@@ -0,0 +1,221 @@
+"""
+Archivo mensual de ``StockMovement``.
+
+La tabla de movimientos solo crece, así que se reparte por meses: los meses
+cerrados (más antiguos que ``settings.MOVEMENT_HOT_MONTHS``) se exportan a un
+CSV comprimido por mes y base de datos en ``settings.MOVEMENT_ARCHIVE_DIR``,
+se registran en ``MovementArchive`` (filas, rango de ids y SHA-256) y solo
+entonces se borran de la tabla. ``movement_history`` combina de forma
+transparente los meses archivados con las filas vivas.
+"""
+import csv
+import gzip
+import hashlib
+import io
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import MovementArchive, StockMovement
+from .sharding import across_shards, shard_for_store
+
+COLUMNS = ["id", "store_id", "product_id", "quantity", "movement_type", "date"]
+
+
+class ArchiveError(RuntimeError):
+    """El fichero de archivo no coincide con lo registrado"""
+
+
+def month_start(value):
+    """Primer instante (hora local) del mes de ``value``"""
+    local = timezone.localtime(value) if isinstance(value, datetime) else value
+    return timezone.make_aware(datetime(local.year, local.month, 1))
+
+
+def next_month(start):
+    return timezone.make_aware(datetime(start.year + start.month // 12, start.month % 12 + 1, 1))
+
+
+def archive_cutoff(hot_months=None):
+    """Inicio del mes más antiguo que se mantiene en la tabla"""
+    hot_months = settings.MOVEMENT_HOT_MONTHS if hot_months is None else hot_months
+    start = month_start(timezone.now())
+    for _ in range(hot_months):
+        start = month_start(start - timedelta(days=1))
+    return start
+
+
+def archive_path(archive):
+    return Path(settings.MOVEMENT_ARCHIVE_DIR) / archive.path
+
+
+def closed_months(queryset, cutoff):
+    """Meses con movimientos anteriores a ``cutoff``, del más antiguo al más reciente"""
+    first = queryset.filter(date__lt=cutoff).aggregate(first=Min("date"))["first"]
+    months = []
+    start = month_start(first) if first else cutoff
+    while start < cutoff:
+        months.append(start)
+        start = next_month(start)
+    return months
+
+
+def archive_month(queryset, start):
+    """Exporta y borra los movimientos del mes que empieza en ``start``; devuelve el registro o ``None``.
+
+    Si el mes ya estaba archivado (filas que llegaron tarde o durante la exportación
+    anterior), se escribe un fichero nuevo con lo archivado más las filas nuevas y el
+    registro pasa a apuntar a él: el fichero anterior solo se borra tras confirmar.
+    """
+    database = queryset.db
+    rows = queryset.filter(date__gte=start, date__lt=next_month(start))
+    bounds = rows.aggregate(first_id=Min("id"), last_id=Max("id"))
+    if bounds["first_id"] is None:
+        return None
+
+    archive = MovementArchive.objects.filter(month=start.date(), database=database).first()
+    name = f"{start:%Y-%m}.{bounds['last_id']}.csv.gz" if archive else f"{start:%Y-%m}.csv.gz"
+    relative = Path("movements") / database / name
+    target = Path(settings.MOVEMENT_ARCHIVE_DIR) / relative
+    target.parent.mkdir(parents=True, exist_ok=True)
+    partial = target.with_suffix(".partial")
+
+    if archive:
+        partial.write_bytes(_verified_bytes(archive))  # Las filas nuevas van en otro miembro gzip
+    count = 0
+    with gzip.open(partial, "at" if archive else "wt", newline="", encoding="utf-8") as handle:
+        writer = csv.writer(handle)
+        if not archive:
+            writer.writerow(COLUMNS)
+        for row in rows.order_by("id").values_list(*COLUMNS).iterator(chunk_size=5000):
+            writer.writerow([*row[:-1], row[-1].isoformat()])
+            count += 1
+    checksum = hashlib.sha256(partial.read_bytes()).hexdigest()
+    os.replace(partial, target)  # El fichero solo aparece completo
+
+    with transaction.atomic(), transaction.atomic(using=database):
+        if archive:
+            previous = archive_path(archive)
+            archive.path = str(relative)
+            archive.rows += count
+            archive.first_id = min(archive.first_id, bounds["first_id"])
+            archive.last_id = max(archive.last_id, bounds["last_id"])
+            archive.checksum = checksum
+            archive.save()
+            transaction.on_commit(lambda: previous.unlink(missing_ok=True))
+        else:
+            archive = MovementArchive.objects.create(month=start.date(), database=database, path=str(relative),
+                                                     rows=count, checksum=checksum, **bounds)
+        # Solo se borra lo exportado: las filas llegadas durante la exportación siguen vivas
+        deleted, _ = rows.filter(id__lte=bounds["last_id"]).delete()
+        if deleted != count:
+            raise ArchiveError(f"{target}: exportadas {count} filas pero se iban a borrar {deleted}")
+    return archive
+
+
+def archive_movements(hot_months=None):
+    """Archiva todos los meses cerrados de cada base de datos; devuelve los registros creados"""
+    cutoff = archive_cutoff(hot_months)
+    archives = []
+    for queryset in across_shards(StockMovement.objects.using(DEFAULT_DB_ALIAS)):
+        for start in closed_months(queryset, cutoff):
+            archive = archive_month(queryset, start)
+            if archive:
+                archives.append(archive)
+    return archives
+
+
+def _verified_bytes(archive):
+    data = archive_path(archive).read_bytes()
+    if hashlib.sha256(data).hexdigest() != archive.checksum:
+        raise ArchiveError(f"{archive.path}: la suma SHA-256 no coincide")
+    return data
+
+
+def read_archive(archive, verify=True):
+    """Filas de un mes archivado, como diccionarios con los tipos del modelo"""
+    data = _verified_bytes(archive) if verify else archive_path(archive).read_bytes()
+    with gzip.open(io.BytesIO(data), "rt", newline="", encoding="utf-8") as handle:
+        for row in csv.DictReader(handle):
+            yield {
+                "id": int(row["id"]),
+                "store_id": int(row["store_id"]),
+                "product_id": int(row["product_id"]),
+                "quantity": int(row["quantity"]),
+                "movement_type": row["movement_type"],
+                "date": datetime.fromisoformat(row["date"]),
+            }
+
+
+def verify_archives():
+    """Comprueba suma y número de filas de cada archivo; devuelve los errores encontrados"""
+    errors = []
+    for archive in MovementArchive.objects.order_by("month", "database"):
+        try:
+            count = sum(1 for _ in read_archive(archive))
+        except (OSError, ArchiveError) as exc:
+            errors.append(str(exc))
+            continue
+        if count != archive.rows:
+            errors.append(f"{archive.path}: {count} filas, se esperaban {archive.rows}")
+    return errors
+
+
+def movement_history(store_id=None, product_id=None, start=None, end=None, limit=None):
+    """Movimientos (archivados y vivos) en orden cronológico, como diccionarios.
+
+    ``start`` y ``end`` son datetimes; ``end`` es exclusivo. Con ``limit`` se devuelven
+    solo los ``limit`` más recientes: la tabla viva se limita en SQL y los meses
+    archivados se leen del más reciente al más antiguo hasta tener bastantes filas.
+    """
+    def matches(row):
+        return ((store_id is None or row["store_id"] == store_id)
+                and (product_id is None or row["product_id"] == product_id)
+                and (start is None or row["date"] >= start)
+                and (end is None or row["date"] < end))
+
+    def newest_first(rows):
+        rows = sorted(rows, key=lambda row: (row["date"], row["id"]), reverse=True)
+        return rows[:limit] if limit is not None else rows
+
+    live = StockMovement.objects.all()
+    if store_id is not None:
+        live = live.filter(store_id=store_id)
+    if product_id is not None:
+        live = live.filter(product_id=product_id)
+    if start:
+        live = live.filter(date__gte=start)
+    if end:
+        live = live.filter(date__lt=end)
+    querysets = [live.for_store(store_id)] if store_id is not None else across_shards(live)
+    querysets = [queryset.order_by("-date", "-id").values(*COLUMNS) for queryset in querysets]
+    rows = newest_first(row for queryset in querysets
+                        for row in (queryset[:limit] if limit is not None else queryset))
+
+    archives = MovementArchive.objects.order_by("-month")
+    if start:
+        archives = archives.filter(month__gte=month_start(start).date())
+    if end:
+        archives = archives.filter(month__lt=timezone.localtime(end).date())
+    if store_id is not None:
+        archives = archives.filter(database=shard_for_store(store_id) or DEFAULT_DB_ALIAS)
+
+    for month, group in _by_month(archives):
+        month_end = next_month(timezone.make_aware(datetime(month.year, month.month, 1)))
+        if limit is not None and len(rows) >= limit and rows[-1]["date"] >= month_end:
+            break  # Este mes y los anteriores son más antiguos que todo lo ya reunido
+        rows = newest_first([*rows, *(row for archive in group for row in read_archive(archive) if matches(row))])
+    rows.reverse()
+    return rows
+
+
+def _by_month(archives):
+    groups = {}
+    for archive in archives:
+        groups.setdefault(archive.month, []).append(archive)
+    return groups.items()
@@ -0,0 +1,142 @@
+import base64
+import binascii
+import datetime
+import json
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+PER_PAGE = 50
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """Fechas con microsegundos: DjangoJSONEncoder las recorta a milisegundos y el
+    cursor saltaría o repetiría las filas que comparten milisegundo con el límite"""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    data = json.dumps(values, cls=CursorEncoder).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def decode_cursor(cursor, fields):
+    """Valores del cursor convertidos al tipo de cada campo, o ``None`` si no es válido"""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, binascii.Error, UnicodeError):
+        return None
+    if not isinstance(values, list) or len(values) != len(fields) or None in values:
+        return None
+    try:
+        return [field.to_python(value) for field, value in zip(fields, values)]
+    except (ValidationError, TypeError, ValueError):
+        return None
+
+
+def _field(model, path):
+    """Campo del modelo para ``path``, siguiendo relaciones ``a__b``"""
+    *relations, name = path.split("__")
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(name)
+
+
+def _value(obj, field):
+    """Valor de ``field`` en el objeto siguiendo relaciones ``a__b``"""
+    for attr in field.split("__"):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def _after(ordering, values):
+    """Filtro con las filas posteriores al cursor en el orden dado:
+    (a > x) OR (a = x AND b > y) OR ..."""
+    conditions = []
+    for i, field in enumerate(ordering):
+        name = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") else "gt"
+        equal = {other.lstrip("-"): value for other, value in zip(ordering[:i], values[:i])}
+        conditions.append(Q(**equal, **{f"{name}__{lookup}": values[i]}))
+    return reduce(lambda a, b: a | b, conditions)
+
+
+def _reverse(ordering):
+    return [field[1:] if field.startswith("-") else f"-{field}" for field in ordering]
+
+
+def _fetch(querysets, ordering, limit):
+    """Primeras ``limit`` filas en ``ordering`` de uno o varios querysets (p. ej. uno por shard)"""
+    if len(querysets) == 1:
+        return list(querysets[0].order_by(*ordering)[:limit])
+    rows = [row for queryset in querysets for row in queryset.order_by(*ordering)[:limit]]
+    for field in reversed(ordering):  # Ordenación estable, del último campo al primero
+        rows.sort(key=lambda row: _value(row, field.lstrip("-")), reverse=field.startswith("-"))
+    return rows[:limit]
+
+
+class KeysetPage:
+    """Página obtenida por cursor, con enlaces que conservan el resto de filtros de la URL"""
+
+    def __init__(self, request, object_list, ordering, has_previous, has_next):
+        self.object_list = object_list
+        self.has_previous = has_previous and bool(object_list)
+        self.has_next = has_next and bool(object_list)
+        self._request = request
+        self._ordering = ordering
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def _url(self, param, obj):
+        query = self._request.GET.copy()
+        query.pop("after", None)
+        query.pop("before", None)
+        query[param] = encode_cursor([_value(obj, field.lstrip("-")) for field in self._ordering])
+        return f"?{query.urlencode()}"
+
+    @property
+    def next_url(self):
+        return self._url("after", self.object_list[-1]) if self.has_next else None
+
+    @property
+    def previous_url(self):
+        return self._url("before", self.object_list[0]) if self.has_previous else None
+
+
+def keyset_paginate(request, queryset, ordering, per_page=PER_PAGE):
+    """Pagina ``queryset`` por cursor (keyset) en lugar de OFFSET.
+
+    ``ordering`` debe identificar cada fila de forma única (p. ej. terminar en
+    ``id``); las páginas se piden con ``?after=<cursor>`` o ``?before=<cursor>``,
+    así que el coste de una página no depende de su profundidad. ``queryset``
+    también puede ser una lista de querysets (``across_shards``), que se mezclan.
+    """
+    ordering = list(ordering)
+    querysets = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+    fields = [_field(querysets[0].model, field.lstrip("-")) for field in ordering]
+    after = decode_cursor(request.GET.get("after"), fields)  # Un cursor no válido se ignora: primera página
+    before = decode_cursor(request.GET.get("before"), fields)
+
+    if before:
+        rows = _fetch([qs.filter(_after(_reverse(ordering), before)) for qs in querysets], _reverse(ordering),
+                      per_page + 1)
+        has_previous = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        return KeysetPage(request, rows, ordering, has_previous=has_previous, has_next=True)
+
+    if after:
+        querysets = [qs.filter(_after(ordering, after)) for qs in querysets]
+    rows = _fetch(querysets, ordering, per_page + 1)
+    return KeysetPage(request, rows[:per_page], ordering, has_previous=bool(after), has_next=len(rows) > per_page)
@@ -0,0 +1,162 @@
+"""
+Perfilado por muestreo de peticiones reales.
+
+``SamplingProfilerMiddleware`` perfila una petición cuando un usuario staff
+lo pide (``?profile=1`` o cabecera ``X-Profile: 1``; también ``true``, ``yes``
+u ``on``) o, al azar, una fracción ``settings.PROFILE_SAMPLE_RATE`` del
+tráfico. Un hilo toma la pila del hilo de la petición cada
+``settings.PROFILE_INTERVAL_MS`` y acumula las pilas en formato *folded*
+(``raíz;...;hoja cuenta``), el que leen flamegraph.pl y speedscope. Cada
+perfil se guarda en ``settings.PROFILE_DIR`` (``<id>.folded`` y ``<id>.json``
+con los datos de la petición) y se consulta en ``/profiles/``. Sin petición de perfil ni muestreo,
+el middleware solo mira un parámetro y una cabecera.
+"""
+import json
+import random
+import re
+import sys
+import threading
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from .metrics import view_label
+
+PROFILE_PARAM = "profile"
+PROFILE_HEADER = "X-Profile"
+PROFILE_NAME = re.compile(r"^[\w-]+$")
+TRUE_VALUES = {"1", "true", "yes", "on"}
+
+
+class Sampler:
+    """Muestrea la pila de un hilo desde otro hilo hasta que se llama a ``stop``"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[_fold(frame)] += 1
+
+
+def _frame_label(code):
+    path = code.co_filename
+    for marker in ("site-packages/", str(settings.BASE_DIR) + "/"):
+        if marker in path:
+            path = path.split(marker, 1)[1]
+            break
+    return f"{code.co_name} ({path}:{code.co_firstlineno})".replace(";", ",")
+
+
+def _fold(frame):
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def requested(request):
+    """Si el parámetro o la cabecera piden perfilar (``1``, ``true``, ``yes`` u ``on``)"""
+    values = (request.GET.get(PROFILE_PARAM, ""), request.headers.get(PROFILE_HEADER, ""))
+    return any(value.strip().lower() in TRUE_VALUES for value in values)
+
+
+def should_profile(request):
+    """Petición explícita de un usuario staff, o muestreo aleatorio del tráfico"""
+    if requested(request):
+        return request.user.is_staff
+    rate = settings.PROFILE_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def start():
+    return Sampler(threading.get_ident(), settings.PROFILE_INTERVAL_MS / 1000).start()
+
+
+def save_profile(stacks, meta):
+    """Guarda el perfil y su descripción; devuelve su identificador"""
+    directory = Path(settings.PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"{timezone.now():%Y%m%d-%H%M%S}-{get_random_string(6)}"
+    (directory / f"{name}.folded").write_text(
+        "".join(f"{stack} {count}\n" for stack, count in stacks.most_common()), encoding="utf-8"
+    )
+    (directory / f"{name}.json").write_text(
+        json.dumps({**meta, "id": name, "samples": sum(stacks.values())}), encoding="utf-8"
+    )
+    _prune(directory)
+    return name
+
+
+def _prune(directory):
+    """Conserva solo los ``settings.PROFILE_KEEP`` perfiles más recientes"""
+    for meta in sorted(directory.glob("*.json"), reverse=True)[settings.PROFILE_KEEP:]:
+        meta.with_suffix(".folded").unlink(missing_ok=True)
+        meta.unlink(missing_ok=True)
+
+
+def list_profiles(limit=100):
+    """Descripción de los perfiles, del más reciente al más antiguo"""
+    directory = Path(settings.PROFILE_DIR)
+    if not directory.is_dir():
+        return []
+    return [json.loads(path.read_text(encoding="utf-8"))
+            for path in sorted(directory.glob("*.json"), reverse=True)[:limit]]
+
+
+def load_profile(name):
+    """(descripción, texto folded) del perfil, o ``None`` si no existe"""
+    if not PROFILE_NAME.match(name):
+        return None
+    directory = Path(settings.PROFILE_DIR)
+    try:
+        meta = json.loads((directory / f"{name}.json").read_text(encoding="utf-8"))
+        folded = (directory / f"{name}.folded").read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    return meta, folded
+
+
+def top_frames(folded, limit=25):
+    """Funciones con más muestras propias (la hoja de la pila) y totales (en cualquier nivel)"""
+    own, total = Counter(), Counter()
+    for line in folded.splitlines():
+        stack, _, count = line.rpartition(" ")
+        frames = stack.split(";")
+        own[frames[-1]] += int(count)
+        for frame in set(frames):
+            total[frame] += int(count)
+    return [(frame, count, total[frame]) for frame, count in own.most_common(limit)]
+
+
+def profile_meta(request, response, elapsed, trigger):
+    return {
+        "created": timezone.now().isoformat(),
+        "path": request.get_full_path(),
+        "method": request.method,
+        "view": view_label(request),
+        "user": request.user.get_username() if request.user.is_authenticated else None,
+        "status": response.status_code,
+        "seconds": round(elapsed, 4),
+        "interval_ms": settings.PROFILE_INTERVAL_MS,
+        "trigger": trigger,
+    }
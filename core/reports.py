@@ -0,0 +1,215 @@
+import hashlib
+import time as timer
+from datetime import datetime, time, timedelta
+
+from django.core.cache import caches
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import PurchaseDetail, SupplierDelivery
+from .sharding import across_shards
+
+DEFAULT_TOP = 10
+MAX_TOP = 100
+BUCKETS = {
+    "day": TruncDay,
+    "week": TruncWeek,
+    "month": TruncMonth,
+}
+
+
+REPORT_CACHE_TIMEOUT = 60 * 60 * 24  # Las claves cambian con los datos, así que pueden vivir mucho
+
+
+def _cache():
+    """Caché ``reports``, compartida por los procesos web y el worker de tareas (ver ``settings.CACHES``)"""
+    return caches["reports"]
+
+
+class ReportError(ValueError):
+    """Parámetros de informe no válidos"""
+
+
+class Report:
+    """Informe agregado por dimensiones (tienda, producto, ...) y periodo.
+
+    ``dimensions`` asocia cada dimensión a sus campos (id, nombre) y
+    ``date_field`` es el campo de fecha usado para el rango y los periodos.
+    """
+
+    def __init__(self, name, queryset, date_field, dimensions, measures):
+        self.name = name
+        self.queryset = queryset
+        self.date_field = date_field
+        self.dimensions = dimensions
+        self.measures = measures
+
+    def parse(self, params):
+        """Valida ``group_by`` (por defecto, producto), ``bucket``, ``start``, ``end`` y ``top``"""
+        group_by = [name for name in params.get("group_by", "").split(",") if name] or ["product"]
+        unknown = [name for name in group_by if name not in self.dimensions]
+        if unknown:
+            raise ReportError(f"group_by no válido: {', '.join(unknown)}")
+
+        bucket = params.get("bucket") or None
+        if bucket and bucket not in BUCKETS:
+            raise ReportError(f"bucket no válido: {bucket}")
+
+        dates = {}
+        for param in ("start", "end"):
+            value = params.get(param)
+            dates[param] = parse_date(value) if value else None
+            if value and dates[param] is None:
+                raise ReportError(f"{param} debe tener formato AAAA-MM-DD")
+
+        try:
+            top = int(params.get("top", DEFAULT_TOP))
+        except ValueError:
+            raise ReportError("top debe ser un número")
+        if not 1 <= top <= MAX_TOP:
+            raise ReportError(f"top debe estar entre 1 y {MAX_TOP}")
+
+        return {"group_by": group_by, "bucket": bucket, "start": dates["start"], "end": dates["end"], "top": top}
+
+    def filtered(self, query):
+        """Filas del rango de fechas (límites como datetimes para poder usar el índice)"""
+        queryset = self.queryset
+        tz = timezone.get_current_timezone()
+        if query["start"]:
+            start = timezone.make_aware(datetime.combine(query["start"], time.min), tz)
+            queryset = queryset.filter(**{f"{self.date_field}__gte": start})
+        if query["end"]:
+            end = timezone.make_aware(datetime.combine(query["end"] + timedelta(days=1), time.min), tz)
+            queryset = queryset.filter(**{f"{self.date_field}__lt": end})
+        return queryset
+
+    def fingerprint(self, query):
+        """ETag del informe: cambia cuando cambian los datos o los parámetros"""
+        data = [sorted(queryset.aggregate(last_id=Max("id"), count=Count("id"), **self.measures).items())
+                for queryset in across_shards(self.filtered(query))]
+        content = f"{self.name}|{sorted(query.items())}|{data}"
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def rows(self, query):
+        # Alias internos: los nombres de las dimensiones chocan con campos del modelo
+        fields = {}
+        for name in query["group_by"]:
+            id_field, name_field = self.dimensions[name]
+            fields[f"{name}_key"], fields[f"{name}_label"] = F(id_field), F(name_field)
+        if query["bucket"]:
+            fields["period"] = BUCKETS[query["bucket"]](self.date_field)
+
+        first_measure = next(iter(self.measures))
+        querysets = across_shards(self.filtered(query).values(**fields).annotate(**self.measures))
+        if len(querysets) == 1:
+            rows = querysets[0].order_by(f"-{first_measure}", *fields)[:query["top"]]
+        else:
+            rows = self._merge(querysets, list(fields), first_measure)[:query["top"]]
+
+        series = []
+        for row in rows:
+            item = {name: {"id": row[f"{name}_key"], "name": row[f"{name}_label"]} for name in query["group_by"]}
+            if "period" in row:
+                item["period"] = timezone.localtime(row["period"]).date().isoformat()
+            item.update((measure, row[measure]) for measure in self.measures)
+            series.append(item)
+        return series
+
+    def _merge(self, querysets, fields, first_measure):
+        """Une los grupos de varios shards: un mismo grupo (p. ej. un producto) puede estar en varios"""
+        merged = {}
+        for queryset in querysets:
+            for row in queryset.order_by():
+                key = tuple(row[name] for name in fields)
+                if key not in merged:
+                    merged[key] = row
+                    continue
+                for measure in self.measures:
+                    merged[key][measure] += row[measure]
+        return sorted(merged.values(), key=lambda row: row[first_measure], reverse=True)
+
+    def build(self, query):
+        return {
+            "report": self.name,
+            "group_by": query["group_by"],
+            "bucket": query["bucket"],
+            "start": query["start"],
+            "end": query["end"],
+            "top": query["top"],
+            "series": self.rows(query),
+        }
+
+
+DELIVERY_REPORT = Report(
+    "deliveries",
+    SupplierDelivery.objects.filter(approved=True),
+    "delivery_date",
+    dimensions={
+        "store": ("store_id", "store__name"),
+        "product": ("product_id", "product__name"),
+        "supplier": ("supplier_id", "supplier__name"),
+    },
+    measures={"quantity": Sum("quantity")},
+)
+
+SALES_REPORT = Report(
+    "sales",
+    PurchaseDetail.objects.all(),
+    "purchase__date",
+    dimensions={
+        "store": ("purchase__store_id", "purchase__store__name"),
+        "product": ("product_id", "product__name"),
+    },
+    measures={"amount": Sum(F("unit_price") * F("quantity")), "quantity": Sum("quantity")},
+)
+
+
+def _count_report_stat(name, amount=1):
+    """Suma a un contador compartido de la caché de informes (aproximado: ``incr`` no es atómico
+    entre procesos con ficheros)"""
+    key = f"report:stats:{name}"
+    _cache().add(key, 0, timeout=None)
+    _cache().incr(key, amount)
+
+
+def report_cache_stats():
+    """Aciertos, fallos y tiempos de renderizado de la caché de informes, de todos los procesos"""
+    names = ["hits", "misses", "render_ms_total", "render_ms_last"]
+    values = _cache().get_many([f"report:stats:{name}" for name in names])
+    return {name: values.get(f"report:stats:{name}", 0) for name in names}
+
+
+def _delivery_fingerprint():
+    """Huella de los datos del informe: cambia con cada entrega aprobada nueva o modificada"""
+    data = SupplierDelivery.objects.filter(approved=True).aggregate(
+        last_id=Max("id"), count=Count("id"), total=Sum("quantity")
+    )
+    return f"{data['last_id']}-{data['count']}-{data['total']}"
+
+
+def delivery_charts():
+    """Gráficos del informe de entregas, desde caché si los datos no han cambiado.
+
+    matplotlib/seaborn (``core.charts``) solo se importan cuando hay que renderizar.
+    """
+    cache_key = f"report:delivery:{_delivery_fingerprint()}"
+    charts = _cache().get(cache_key)
+    if charts is not None:
+        _count_report_stat("hits")
+        return charts
+
+    from .charts import render_delivery_charts
+
+    _count_report_stat("misses")
+    started = timer.perf_counter()
+    # Consultar entregas agrupadas por producto y tienda
+    deliveries = (SupplierDelivery.objects.values("store__name", "product__name").filter(approved=True)
+                  .annotate(total_quantity=Sum("quantity")).order_by("-total_quantity")[:10])
+    charts = render_delivery_charts(list(deliveries))
+    elapsed_ms = int((timer.perf_counter() - started) * 1000)
+    _cache().set(cache_key, charts, REPORT_CACHE_TIMEOUT)
+    _cache().set("report:stats:render_ms_last", elapsed_ms, timeout=None)
+    _count_report_stat("render_ms_total", elapsed_ms)
+    return charts
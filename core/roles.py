@@ -0,0 +1,176 @@
+"""
+Caché de grupos y permisos por usuario.
+
+``user_roles`` guarda en la caché ``roles`` (compartida por todos los
+procesos, ver ``settings.CACHES``) los grupos del usuario y sus permisos
+(propios y de grupo), así que ``CachedModelBackend`` (los
+``permission_required`` y ``has_perm``) y las redirecciones por rol no
+consultan la base de datos en cada petición. Las señales de
+``core.signals`` borran la entrada de un usuario cuando cambian sus grupos o
+permisos, y cambian la versión global (todas las entradas) cuando cambian
+los permisos de un grupo o se borra un grupo o permiso. ``ROLE_CACHE_TIMEOUT``
+acota lo que puede durar una entrada si algún cambio no pasa por las señales
+(``update()`` o SQL directo).
+
+``sync_roles`` crea (en bloque y solo lo que falta) los permisos propios y los
+grupos ``ROLE_PERMISSIONS``; se ejecuta tras cada ``migrate``.
+"""
+import time
+
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.core.exceptions import PermissionDenied
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .models import Customer, Product, Purchase, Supplier, SupplierDelivery
+
+VERSION_KEY = "roles:version"
+ROLE_CACHE_TIMEOUT = 300  # Segundos
+
+# (modelo, codename, nombre) de los permisos propios de la aplicación
+PERMISSIONS = [
+    (Customer, 'view_own_purchases', 'Can view own purchases'),
+    (Supplier, 'manage_own_products', 'Can manage products'),
+    (Supplier, 'manage_deliveries', 'Can manage deliveries'),
+    (Customer, 'full_access', 'Can access full admin features'),
+    (Product, 'manage_products', 'Can manage products'),
+    (Purchase, 'view_purchases', 'Can view purchases'),
+    (SupplierDelivery, 'manage_supplier_deliveries', 'Can manage supplier deliveries'),
+]
+
+# Grupo: codenames de PERMISSIONS que se le asignan
+ROLE_PERMISSIONS = {
+    'Customers': ['view_own_purchases', 'view_purchases'],
+    'Suppliers': ['manage_own_products', 'manage_deliveries', 'manage_supplier_deliveries', 'manage_products'],
+    'Admins': ['full_access'],
+}
+
+
+def _cache():
+    return caches["roles"]
+
+
+def _version():
+    return _cache().get_or_set(VERSION_KEY, time.time_ns, timeout=None)
+
+
+def _key(user_id, version):
+    return f"roles:{version}:{user_id}"
+
+
+def _permission_names(permissions):
+    return {f"{app_label}.{codename}"
+            for app_label, codename in permissions.values_list("content_type__app_label", "codename").order_by()}
+
+
+def _load(user):
+    groups = list(user.groups.order_by("id").values_list("name", flat=True))
+    if user.is_superuser:
+        user_permissions = group_permissions = _permission_names(Permission.objects.all())
+    else:
+        user_permissions = _permission_names(user.user_permissions.all())
+        group_permissions = _permission_names(Permission.objects.filter(group__user=user))
+    return {"groups": groups, "user_permissions": user_permissions, "group_permissions": group_permissions}
+
+
+def user_roles(user):
+    """Grupos y permisos del usuario: del propio objeto, de la caché o (si no están) de la base de datos"""
+    if not hasattr(user, "_roles"):
+        key = _key(user.pk, _version())
+        roles = _cache().get(key)
+        if roles is None:
+            roles = _load(user)
+            _cache().set(key, roles, ROLE_CACHE_TIMEOUT)
+        user._roles = roles
+    return user._roles
+
+
+def primary_role(user):
+    """Primer grupo del usuario (Admins, Suppliers, Customers), o ``None``"""
+    if not user.is_authenticated:
+        return None
+    groups = user_roles(user)["groups"]
+    return groups[0] if groups else None
+
+
+def forget_users(user_ids):
+    """Invalida la caché de esos usuarios"""
+    version = _version()
+    _cache().delete_many([_key(user_id, version) for user_id in user_ids])
+
+
+def forget_all():
+    """Invalida la caché de todos los usuarios"""
+    _cache().set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend que lee los permisos de ``user_roles`` en lugar de consultarlos en cada petición.
+
+    ``django.contrib.auth.backends.ModelBackend`` va detrás en ``AUTHENTICATION_BACKENDS`` solo para
+    las sesiones abiertas antes de este backend; por eso una negativa de este corta la cadena
+    (``PermissionDenied``) en lugar de repetir la consulta de permisos o el hash de la contraseña.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        user = super().authenticate(request, username, password, **kwargs)
+        if user is None:
+            raise PermissionDenied
+        return user
+
+    def has_perm(self, user_obj, perm, obj=None):
+        if super().has_perm(user_obj, perm, obj):
+            return True
+        raise PermissionDenied
+
+    def has_module_perms(self, user_obj, app_label):
+        if super().has_module_perms(user_obj, app_label):
+            return True
+        raise PermissionDenied
+
+    def _get_permissions(self, user_obj, obj, from_name):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        return user_roles(user_obj)[f"{from_name}_permissions"]
+
+
+def sync_roles(using=DEFAULT_DB_ALIAS):
+    """Crea los permisos, grupos y asignaciones que falten; devuelve la lista de cambios (vacía si no hubo)"""
+    content_types = ContentType.objects.db_manager(using).get_for_models(*{model for model, _, _ in PERMISSIONS})
+    wanted = {(content_types[model].id, codename): name for model, codename, name in PERMISSIONS}
+    changes = []
+    with transaction.atomic(using=using):
+        permissions = {
+            (permission.content_type_id, permission.codename): permission
+            for permission in Permission.objects.using(using).filter(
+                content_type__in=content_types.values(), codename__in=[codename for _, codename in wanted])
+        }
+        missing = [Permission(content_type_id=content_type_id, codename=codename, name=name)
+                   for (content_type_id, codename), name in wanted.items()
+                   if (content_type_id, codename) not in permissions]
+        for permission in Permission.objects.using(using).bulk_create(missing):
+            permissions[permission.content_type_id, permission.codename] = permission
+            changes.append(f"permiso {permission.codename}")
+        by_codename = {codename: permissions[content_type_id, codename] for content_type_id, codename in wanted}
+
+        groups = {group.name: group for group in Group.objects.using(using).filter(name__in=ROLE_PERMISSIONS)}
+        for group in Group.objects.using(using).bulk_create(
+                [Group(name=name) for name in ROLE_PERMISSIONS if name not in groups]):
+            groups[group.name] = group
+            changes.append(f"grupo {group.name}")
+
+        through = Group.permissions.through
+        assigned = set(through.objects.using(using).filter(group__in=groups.values())
+                       .values_list("group_id", "permission_id"))
+        links = []
+        for name, codenames in ROLE_PERMISSIONS.items():
+            for codename in codenames:
+                if (groups[name].id, by_codename[codename].id) not in assigned:
+                    links.append(through(group_id=groups[name].id, permission_id=by_codename[codename].id))
+                    changes.append(f"{name} ← {codename}")
+        through.objects.using(using).bulk_create(links)
+    if links:
+        forget_all()  # bulk_create no envía m2m_changed
+    return changes
@@ -0,0 +1,95 @@
+"""
+Enrutado de lecturas a la réplica.
+
+Solo las vistas e informes marcados con ``@replica_reads`` (o el código dentro
+de ``use_replica()``) leen de la réplica; todo lo demás, y cualquier escritura,
+va a ``default``. Tras una escritura, la sesión del usuario queda fijada a
+``default`` durante ``REPLICA_STICKY_SECONDS`` para que vea sus propios cambios
+aunque la réplica aún no se haya sincronizado (ver ``ReplicaStickinessMiddleware``).
+
+La réplica es cualquier alias de ``settings.DATABASES`` llamado como
+``settings.REPLICA_DATABASE``: en local, una copia SQLite mantenida con
+``manage.py sync_replica``; en producción, una réplica real del motor que sea.
+Sin ese alias, el router no cambia nada.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+STICKY_SESSION_KEY = '_db_sticky_until'
+
+_reading_from_replica = ContextVar('reading_from_replica', default=False)
+_wrote = ContextVar('wrote', default=False)
+
+
+def replica_alias():
+    """Alias de la réplica, o ``None`` si no está configurada"""
+    alias = getattr(settings, 'REPLICA_DATABASE', 'replica')
+    return alias if alias in settings.DATABASES else None
+
+
+@contextmanager
+def use_replica():
+    """Las lecturas dentro del bloque van a la réplica, si existe"""
+    token = _reading_from_replica.set(True)
+    try:
+        yield
+    finally:
+        _reading_from_replica.reset(token)
+
+
+@contextmanager
+def track_writes():
+    """Registra si se escribe en la base de datos dentro del bloque; devuelve una función para consultarlo"""
+    token = _wrote.set(False)
+    try:
+        yield _wrote.get
+    finally:
+        _wrote.reset(token)
+
+
+def is_sticky(request):
+    """La sesión escribió hace poco y debe leer de ``default``"""
+    session = getattr(request, 'session', None)
+    return session is not None and session.get(STICKY_SESSION_KEY, 0) > time.time()
+
+
+def stick_to_default(request):
+    request.session[STICKY_SESSION_KEY] = time.time() + getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+
+
+def replica_reads(view_func):
+    """Las consultas de la vista leen de la réplica, salvo que la sesión haya escrito hace poco"""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if is_sticky(request):
+            return view_func(request, *args, **kwargs)
+        with use_replica():
+            return view_func(request, *args, **kwargs)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    """Lecturas marcadas a la réplica, escrituras siempre a ``default``"""
+
+    def db_for_read(self, model, **hints):
+        # Una escritura en la misma petición invalida la réplica hasta el final de ella
+        if _reading_from_replica.get() and not _wrote.get():
+            return replica_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # La réplica contiene los mismos datos que default
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # El esquema de la réplica llega con los datos (sync_replica o la replicación del motor)
+        return db != replica_alias()
@@ -0,0 +1,147 @@
+"""
+Particionado opcional por tienda.
+
+Con ``settings.STORE_SHARDS`` definido, las filas de ``Stock``,
+``StockMovement``, ``Purchase`` y ``PurchaseDetail`` viven en el shard de su
+tienda (``store_id % número de shards``). El catálogo (``Product`` y
+``Store``) sigue siendo global en ``default``; cada shard guarda una copia de
+solo lectura para poder hacer joins (``select_related``, ordenar por nombre de
+producto, informes), que se mantiene al guardar o borrar y con
+``manage.py shard_stores``. El resto de modelos no cambia.
+
+Las consultas de una tienda usan ``Modelo.objects.for_store(store_id)``; las
+que abarcan varias tiendas recorren ``across_shards(queryset)``. Sin shards
+configurados todo esto no cambia nada: ``for_store`` no fija base de datos y
+``across_shards`` devuelve el queryset tal cual.
+"""
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+
+SHARDED_MODELS = {'stock', 'stockmovement', 'purchase', 'purchasedetail'}
+REFERENCE_MODELS = {'product', 'store'}  # Catálogo global copiado en cada shard
+
+
+def store_shards():
+    return list(getattr(settings, 'STORE_SHARDS', []))
+
+
+def is_sharded(model):
+    return bool(store_shards()) and model._meta.app_label == 'core' and model._meta.model_name in SHARDED_MODELS
+
+
+def shard_for_store(store_id):
+    """Alias del shard de la tienda, o ``None`` (enrutado normal) si no hay shards"""
+    shards = store_shards()
+    return shards[int(store_id) % len(shards)] if shards else None
+
+
+def stores_by_shard(store_ids):
+    """``{alias: [store_id, ...]}`` para repartir una operación de varias tiendas"""
+    groups = defaultdict(list)
+    for store_id in store_ids:
+        groups[shard_for_store(store_id)].append(store_id)
+    return groups
+
+
+def across_shards(queryset):
+    """El queryset en cada shard (o solo él mismo si no hay shards)"""
+    shards = store_shards()
+    if not shards or not is_sharded(queryset.model):
+        return [queryset]
+    return [queryset.using(alias) for alias in shards]
+
+
+@contextmanager
+def atomic_for_stores(*store_ids):
+    """Transacción en ``default`` y, anidadas, en los shards de las tiendas.
+
+    No es un commit en dos fases: si un shard fallara justo al confirmar, las
+    transacciones ya confirmadas no se deshacen. Sí garantiza que cualquier
+    excepción dentro del bloque deshace los cambios en todas las bases de datos.
+    """
+    with ExitStack() as stack:
+        stack.enter_context(transaction.atomic())
+        for alias in sorted({shard_for_store(store_id) for store_id in store_ids} - {None}):
+            stack.enter_context(transaction.atomic(using=alias))
+        yield
+
+
+class ShardedQuerySet(models.QuerySet):
+    def for_store(self, store_id):
+        """Filas de la tienda, en su shard"""
+        return self.using(shard_for_store(store_id))
+
+
+def _instance_shard(instance):
+    if instance._state.db:
+        return instance._state.db
+    store_id = getattr(instance, 'store_id', None)
+    if store_id is None and getattr(instance, 'purchase_id', None):  # PurchaseDetail vive con su compra
+        return instance.purchase._state.db
+    return shard_for_store(store_id) if store_id is not None else None
+
+
+class ShardRouter:
+    """Lleva las filas de los modelos particionados al shard de su tienda"""
+
+    def _db_for_model(self, model, **hints):
+        if not is_sharded(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None and is_sharded(type(instance)):
+            return _instance_shard(instance)
+        if instance is not None and instance._meta.label_lower == 'core.store':  # store.stock_entries, ...
+            return shard_for_store(instance.pk)
+        return None  # Sin tienda conocida: el código debe usar for_store() o across_shards()
+
+    db_for_read = _db_for_model
+    db_for_write = _db_for_model
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db not in store_shards():
+            return None
+        # Los shards solo tienen las tablas particionadas y la copia del catálogo;
+        # los RunPython (sin model_name) se aplican únicamente en default
+        return app_label == 'core' and model_name in SHARDED_MODELS | REFERENCE_MODELS
+
+
+def sync_catalog(model, pks=None):
+    """Copia (o actualiza) filas del catálogo de ``default`` en todos los shards"""
+    if not store_shards() or model._meta.model_name not in REFERENCE_MODELS:
+        return
+    rows = model.objects.using(DEFAULT_DB_ALIAS).all()
+    if pks is not None:
+        rows = rows.filter(pk__in=pks)
+    rows = list(rows)
+    fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+    for alias in store_shards():
+        model.objects.using(alias).bulk_create(rows, update_conflicts=True, unique_fields=['id'],
+                                               update_fields=fields, batch_size=500)
+
+
+def delete_from_shards(instance):
+    """Borra en los shards las filas particionadas que dependían de ``instance`` (el borrado en
+    cascada de ``default`` no llega a ellos) y, si es del catálogo, su copia"""
+    model = type(instance)
+    if not store_shards():
+        return
+    from django.apps import apps
+
+    dependents = [
+        (sharded, field.name)
+        for sharded in (apps.get_model('core', name) for name in sorted(SHARDED_MODELS))
+        for field in sharded._meta.concrete_fields
+        if field.is_relation and field.related_model is model and field.remote_field.on_delete is models.CASCADE
+    ]
+    is_catalog = model._meta.app_label == 'core' and model._meta.model_name in REFERENCE_MODELS
+    if not dependents and not is_catalog:
+        return
+    for alias in store_shards():
+        for sharded, field in dependents:
+            sharded.objects.using(alias).filter(**{field: instance.pk}).delete()
+        if is_catalog:
+            # Borrado directo: el resto de tablas que dependen del catálogo no existen en el shard
+            model.objects.using(alias).filter(pk=instance.pk)._raw_delete(alias)
@@ -1,58 +1,124 @@
-from django.db.models.signals import post_migrate
+import sys
+
+from django.apps import apps
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_migrate, post_delete, post_save
 from django.dispatch import receiver
-from django.contrib.auth.models import Group, Permission
-from django.contrib.contenttypes.models import ContentType
-from core.models import Customer, Supplier, Product, Purchase, SupplierDelivery
-
-
-@receiver(post_migrate)
-def create_permissions(sender, **kwargs):
-    print("📌 Creando permisos y grupos automáticamente...")
-
-    # Definir tipos de contenido
-    customer_content_type = ContentType.objects.get_for_model(Customer)
-    supplier_content_type = ContentType.objects.get_for_model(Supplier)
-
-    # Crear permisos
-    permissions = [
-        ('view_own_purchases', 'Can view own purchases', customer_content_type),
-        ('manage_own_products', 'Can manage products', supplier_content_type),
-        ('manage_deliveries', 'Can manage deliveries', supplier_content_type),
-        ('full_access', 'Can access full admin features', ContentType.objects.get_for_model(Customer))
-    ]
-
-    for codename, name, content_type in permissions:
-        Permission.objects.get_or_create(codename=codename, name=name, content_type=content_type)
-
-    permissions = [
-        ('manage_products', 'Can manage products', ContentType.objects.get_for_model(Product)),
-        ('view_purchases', 'Can view purchases', ContentType.objects.get_for_model(Purchase)),
-    ]
-
-    for codename, name, content_type in permissions:
-        Permission.objects.get_or_create(codename=codename, name=name, content_type=content_type)
-
-    delivery_content_type = ContentType.objects.get_for_model(SupplierDelivery)
-
-    # Crear permiso de gestión de entregas
-    Permission.objects.get_or_create(
-        codename="manage_supplier_deliveries",
-        name="Can manage supplier deliveries",
-        content_type=delivery_content_type
-    )
-
-    # Crear grupos y asignar permisos
-    groups = {
-        'Customers': ['view_own_purchases', 'view_purchases'],
-        'Suppliers': ['manage_own_products', 'manage_deliveries', 'manage_supplier_deliveries', 'manage_products'],
-        'Admins': ['full_access']
-    }
-
-    for group_name, permission_codenames in groups.items():
-        group, _ = Group.objects.get_or_create(name=group_name)
-        for codename in permission_codenames:
-            permission = Permission.objects.get(codename=codename)
-            group.permissions.add(permission)
-
-    print("✅ Permisos y grupos creados correctamente.")
+from django.contrib.auth.models import Group, Permission, User
+from django.db import DEFAULT_DB_ALIAS, router
+from django.db.models import F
+from core.images import refresh_image
+from core.models import Customer, Supplier, Product, Purchase, SupplierDelivery, Stock, ProductAvailability, Store, \
+    PurchaseDetail
+from core.roles import forget_all, forget_users, sync_roles
+from core.sharding import delete_from_shards, sync_catalog
+from core.slow_queries import install as install_slow_query_log
+
+
+@receiver(post_migrate, sender=apps.get_app_config('core'))
+def create_permissions(sender, using=DEFAULT_DB_ALIAS, verbosity=1, stdout=None, **kwargs):
+    """Permisos y grupos de la aplicación, una vez por migrate y solo en las bases de datos con tablas de auth"""
+    if not router.allow_migrate_model(using, Permission):
+        return  # Shards y réplica
+    changes = sync_roles(using)
+    if changes and verbosity >= 1:
+        (stdout or sys.stdout).write(f"📌 Permisos y grupos creados: {', '.join(changes)}\n")
+
+
+@receiver(post_delete, sender=Stock)
+def remove_stock(sender, instance, **kwargs):
+    """Quita el producto del índice de disponibilidad y del total de la tienda al borrar su stock"""
+    ProductAvailability.refresh(instance.store_id, instance.product_id, 0)
+    Store.objects.filter(pk=instance.store_id).update(stock_total=F('stock_total') - instance.quantity)
+
+
+@receiver(post_delete, sender=SupplierDelivery)
+def remove_delivery(sender, instance, **kwargs):
+    Supplier.objects.filter(pk=instance.supplier_id).update(delivered_units=F('delivered_units') - instance.quantity)
+
+
+@receiver(post_delete, sender=Purchase)
+def remove_purchase(sender, instance, **kwargs):
+    Customer.objects.filter(pk=instance.customer_id).update(purchase_count=F('purchase_count') - 1)
+
+
+@receiver(post_save, sender=PurchaseDetail)
+def refresh_purchase_amount(sender, instance, using, **kwargs):
+    """Mantiene el total guardado de la compra al editar sus detalles"""
+    Purchase.refresh_amounts([instance.purchase_id], using)
+
+
+@receiver(post_delete, sender=PurchaseDetail)
+def refresh_purchase_amount_on_delete(sender, instance, using, origin=None, **kwargs):
+    """Igual al borrar detalles: una vez por compra en cada borrado, y nada si se borra la propia compra
+    (o su cliente), porque post_delete llega una vez por fila ya con todas borradas"""
+    if isinstance(origin, (Purchase, Customer)) or getattr(origin, 'model', None) in (Purchase, Customer):
+        return
+    refreshed = origin.__dict__.setdefault('_refreshed_purchases', set()) if origin is not None else set()
+    if instance.purchase_id not in refreshed:
+        refreshed.add(instance.purchase_id)
+        Purchase.refresh_amounts([instance.purchase_id], using)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Store)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Store)
+def refresh_image_manifest(sender, instance, signal, **kwargs):
+    """Mantiene el manifiesto de imágenes al subir, cambiar o borrar imágenes (no en el resto de guardados)"""
+    if instance.image and (signal is post_delete or getattr(instance, '_image_changed', True)):
+        refresh_image(instance.image.name)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Store)
+def copy_catalog_to_shards(sender, instance, using, **kwargs):
+    """Mantiene la copia del catálogo en los shards por tienda (si los hay)"""
+    if using == DEFAULT_DB_ALIAS:
+        sync_catalog(sender, [instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Store)
+@receiver(post_delete, sender=Customer)
+def remove_from_shards(sender, instance, using, **kwargs):
+    """Extiende a los shards el borrado en cascada (compras de un cliente, stock de un producto, ...)"""
+    if using == DEFAULT_DB_ALIAS:
+        delete_from_shards(instance)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def forget_user_roles(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """Invalida la caché de roles al cambiar los grupos o permisos propios de usuarios"""
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        forget_users([instance.pk])
+    elif pk_set:
+        forget_users(pk_set)
+    else:
+        forget_all()  # Se vacía un grupo o permiso desde el otro lado: no se sabe a quién afectaba
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def forget_group_roles(sender, action, **kwargs):
+    if action.startswith('post_'):
+        forget_all()
+
+
+@receiver(post_save, sender=User)
+def forget_saved_user_roles(sender, instance, update_fields, **kwargs):
+    """``is_superuser`` e ``is_active`` cambian los permisos; el ``last_login`` de cada login no"""
+    if update_fields != frozenset({'last_login'}):
+        forget_users([instance.pk])
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def forget_all_roles(sender, **kwargs):
+    forget_all()
+
 
+connection_created.connect(install_slow_query_log, dispatch_uid='core.slow_queries')
@@ -0,0 +1,101 @@
+"""
+Registro de consultas lentas.
+
+Al abrirse cada conexión (señal ``connection_created``) se le añade
+``log_slow_queries`` como ``execute_wrapper``. Las consultas que tardan más
+de ``settings.SLOW_QUERY_MS`` se escriben en el logger ``core.slow_queries``
+(un fichero rotativo, ``settings.SLOW_QUERY_LOG``) como una línea JSON con el
+SQL, los parámetros, la vista, el punto del código que la lanzó y su plan
+(``EXPLAIN``). ``recent_entries`` las lee para la página de administración.
+"""
+import json
+import logging
+import time
+import traceback
+from collections import deque
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+EXPLAINABLE = ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")
+MAX_PARAMS_LENGTH = 2000  # Caracteres; los IN (...) enormes se recortan
+
+current_view = ContextVar("current_view", default=None)  # Lo fija SlowQueryViewMiddleware
+_explaining = ContextVar("explaining", default=False)
+
+
+def _call_site():
+    """Último fotograma del proyecto (fuera de Django y de la instrumentación) que llevó a la consulta"""
+    base = str(settings.BASE_DIR)
+    skip = {__file__, str(Path(__file__).with_name("middleware.py")), str(Path(base) / "manage.py")}
+    for frame in reversed(traceback.extract_stack()):
+        if frame.filename.startswith(base) and "site-packages" not in frame.filename \
+                and frame.filename not in skip:
+            return f"{Path(frame.filename).relative_to(base)}:{frame.lineno} in {frame.name}"
+    return None  # Consultas de Django (sesión, autenticación) antes de llegar a la vista
+
+
+def explain(connection, sql, params):
+    """Plan de la consulta, una línea por paso (o el error si no se puede obtener)"""
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return []
+    token = _explaining.set(True)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+            return [str(row[-1]) for row in cursor.fetchall()]
+    except DatabaseError as exc:
+        return [f"EXPLAIN no disponible: {exc}"]
+    finally:
+        _explaining.reset(token)
+
+
+def log_slow_queries(execute, sql, params, many, context):
+    threshold = settings.SLOW_QUERY_MS
+    if threshold is None or _explaining.get():
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if elapsed_ms >= threshold:
+        connection = context["connection"]
+        logger.warning(json.dumps({
+            "time": timezone.now().isoformat(),
+            "ms": round(elapsed_ms, 1),
+            "database": connection.alias,
+            "sql": sql,
+            "params": repr(params)[:MAX_PARAMS_LENGTH],
+            "many": many,
+            "view": current_view.get(),
+            "call_site": _call_site(),
+            "plan": [] if many else explain(connection, sql, params),
+        }))
+    return result
+
+
+def install(connection, **kwargs):
+    """Receptor de ``connection_created``; la lista de wrappers sobrevive a las reconexiones"""
+    if log_slow_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(log_slow_queries)
+
+
+def recent_entries(limit=100):
+    """Últimas consultas lentas del fichero actual, de la más reciente a la más antigua"""
+    try:
+        with open(settings.SLOW_QUERY_LOG, encoding="utf-8") as handle:
+            lines = deque(handle, maxlen=limit)
+    except FileNotFoundError:
+        return []
+    entries = []
+    for line in reversed(lines):
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue  # Línea cortada por la rotación o escrita por otro logger
+    return entries
@@ -1,3 +1,1350 @@
-from django.test import TestCase
+import io
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+from collections import Counter
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from pathlib import Path
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import Group, Permission, User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import ConnectionHandler, connection, connections, router, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.http import QueryDict
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.templatetags.static import static
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from PIL import Image
+
+from supply_management.sqlite_profile import BUSY_TIMEOUT_MS, PRAGMAS, sqlite_database
+
+from . import metrics
+from .management.commands.run_jobs import Command as RunJobsCommand
+from .management.commands.startup_benchmark import measure_startup
+from .counters import recompute_counters, verify_counters
+from .images import FALLBACK_IMAGE, product_image_urls, resolve_images
+from .importer import FEEDS, CatalogImporter
+from .inventory import ConcurrentApproval, approve_deliveries, confirm_cart
+from .jobs import HANDLERS, RETRY_DELAY_SECONDS, JobContext, cancel, claim_next, enqueue, requeue_stale, run_job
+from .models import Cart, CartItem, Customer, ImageManifest, ImportFingerprint, InsufficientStock, Job, Product, \
+    ProductAvailability, Purchase, PurchaseDetail, Stock, StockMovement, Store, Supplier, SupplierDelivery
+from .middleware import ReplicaStickinessMiddleware
+from .movements import ArchiveError, archive_movements, archive_path, month_start, movement_history, read_archive, \
+    verify_archives
+from .pagination import encode_cursor, keyset_paginate
+from .reports import delivery_charts, report_cache_stats
+from .profiling import Sampler, list_profiles, save_profile, top_frames
+from .sharding import ShardRouter, across_shards, atomic_for_stores, shard_for_store
+from .routers import STICKY_SESSION_KEY, replica_reads, track_writes, use_replica
+from .roles import ROLE_PERMISSIONS, VERSION_KEY, primary_role, sync_roles, user_roles
+from .thumbnails import VARIANTS_DIR, file_hash, save_variants
+
+# Los límites de tiempo y memoria dependen de la máquina; en CI solo se comprueban con PERF_BUDGETS=1
+PERF_BUDGETS = os.environ.get('PERF_BUDGETS') == '1'
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN es específico de SQLite')
+class HotQueryPlanTests(TestCase):
+    """Las consultas de los caminos críticos deben usar un índice, no recorrer la tabla completa"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.store = Store.objects.create(name='Tienda', street='Calle 1')
+        cls.product = Product.objects.create(name='Producto', price=10)
+        cls.supplier = Supplier.objects.create(name='Proveedor', email='p@example.com', nif='P1')
+        user = User.objects.create(username='cliente')
+        cls.customer = Customer.objects.create(user=user, name='Cliente', email='c@example.com', nif='C1')
+
+    def assertUsesIndex(self, queryset, table):
+        plan = queryset.explain()
+        self.assertNotRegex(plan, rf'SCAN {table}\b(?! USING (COVERING )?INDEX)', plan)
+        self.assertRegex(plan, rf'(SEARCH|SCAN) {table} USING (COVERING )?INDEX', plan)
+
+    def test_stock_by_product_and_store(self):
+        self.assertUsesIndex(Stock.objects.filter(product=self.product, store=self.store), 'core_stock')
+
+    def test_stock_by_store(self):
+        self.assertUsesIndex(Stock.objects.filter(store=self.store), 'core_stock')
+
+    def test_catalog_availability(self):
+        self.assertUsesIndex(Product.objects.filter(availability__store_id=self.store.id),
+                             'core_productavailability')
+
+    def test_movements_by_store_and_product(self):
+        queryset = StockMovement.objects.filter(store=self.store, product=self.product).order_by('-date')
+        self.assertUsesIndex(queryset, 'core_stockmovement')
+        self.assertNotIn('TEMP B-TREE', queryset.explain())
+
+    def test_pending_deliveries(self):
+        queryset = SupplierDelivery.objects.filter(approved=False).order_by('-delivery_date')
+        self.assertUsesIndex(queryset, 'core_supplierdelivery')
+        self.assertNotIn('TEMP B-TREE', queryset.explain())
+
+    def test_deliveries_by_supplier(self):
+        queryset = SupplierDelivery.objects.filter(supplier=self.supplier).order_by('-delivery_date')
+        self.assertUsesIndex(queryset, 'core_supplierdelivery')
+        self.assertNotIn('TEMP B-TREE', queryset.explain())
+
+    def test_purchases_by_customer(self):
+        queryset = Purchase.objects.filter(customer=self.customer).order_by('-date')
+        self.assertUsesIndex(queryset, 'core_purchase')
+        self.assertNotIn('TEMP B-TREE', queryset.explain())
+
+
+class StartupBudgetTests(SimpleTestCase):
+    """Arrancar Django y resolver URLs no debe cargar matplotlib/seaborn ni salirse del presupuesto"""
+
+    def test_no_heavy_modules_at_startup(self):
+        self.assertEqual(measure_startup()['heavy'], [])
+
+    @unittest.skipUnless(PERF_BUDGETS, 'límites de tiempo y memoria solo con PERF_BUDGETS=1')
+    def test_startup_within_budget(self):
+        call_command('startup_benchmark', stdout=io.StringIO())
+
+
+@override_settings(SLOW_QUERY_MS=None)  # El EXPLAIN de una consulta lenta contaría como consulta de la vista
+class QueryBudgetTests(TestCase):
+    """Cada URL de core.urls tiene un máximo de consultas y de tiempo de respuesta con muchos datos.
+
+    El número de consultas no debe crecer con el número de filas mostradas: un N+1
+    nuevo (p. ej. ``detail.product.name`` sin ``select_related``) rompe el presupuesto.
+    El tiempo solo se comprueba con ``PERF_BUDGETS=1``.
+    """
+    STORES = 1000
+    PRODUCTS = 2000
+    STOCK_PER_STORE = 10
+    PURCHASES = 2000
+    DETAILS_PER_PURCHASE = 3
+    DELIVERIES = 3000
+    CART_ITEMS = 10  # Productos de la primera tienda, todos con stock
+    SECONDS = 1.0  # Tiempo máximo por petición (ya en caliente)
+
+    # nombre de la URL: (usuario, método, kwargs, parámetros, máximo de consultas)
+    BUDGETS = {
+        'home': (None, 'get', {}, {}, 0),
+        'store': (None, 'get', {}, {}, 1),
+        'store_products': ('customer', 'get', {'store_id': 1}, {}, 7),
+        'login': (None, 'get', {}, {}, 0),
+        'logout': ('customer', 'get', {}, {}, 4),
+        'register_customer': (None, 'get', {}, {}, 0),
+        'register_supplier': ('admin', 'get', {}, {}, 2),
+        'admin_dashboard': ('admin', 'get', {}, {}, 4),
+        'supplier_dashboard': ('supplier', 'get', {}, {}, 6),
+        'customer_dashboard': ('customer', 'get', {}, {}, 2),
+        'view_cart': ('customer', 'get', {}, {}, 4),
+        'store_dashboard': ('admin', 'get', {}, {}, 5),
+        'transfer_product': ('admin', 'get', {}, {}, 5),
+        'load_products': ('admin', 'post', {}, {}, 3),
+        'queue_delivery_report': ('admin', 'post', {}, {}, 3),
+        'job_status': ('admin', 'get', {'job_id': 'job'}, {}, 3),
+        'cancel_job': ('admin', 'post', {'job_id': 'job'}, {}, 3),
+        'supplier_delivery_dashboard': ('supplier', 'get', {}, {}, 3),
+        'purchase_history': ('customer', 'get', {}, {}, 5),
+        'add_to_cart': ('customer', 'get', {'product_id': 1, 'store_id': 1}, {}, 11),
+        'remove_from_cart': ('customer', 'get', {'cart_item_id': 'cart_item'}, {}, 9),
+        'confirm_purchase': ('customer', 'get', {}, {}, 20),
+        'approve_delivery': ('admin', 'get', {'delivery_id': 'delivery'}, {}, 14),
+        'approve_selected_deliveries': ('admin', 'post', {}, {'delivery': 'deliveries'}, 14),
+        'product_delivery_report': (None, 'get', {}, {}, 1),
+        'report_stats': ('admin', 'get', {}, {}, 2),
+        'delivery_report_data': ('customer', 'get', {}, {}, 4),
+        'sales_report_data': ('admin', 'get', {}, {}, 4),
+        'movement_history_data': ('admin', 'get', {}, {'store': 1, 'product': 1}, 4),
+        'metrics': ('admin', 'get', {}, {}, 2),
+        'slow_queries': ('admin', 'get', {}, {}, 2),
+        'request_profiles': ('admin', 'get', {}, {}, 2),
+        'request_profile': ('admin', 'get', {'name': 'profile'}, {}, 2),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        stores = Store.objects.bulk_create(
+            Store(name=f'Tienda {i}', street=f'Calle {i}') for i in range(cls.STORES)
+        )
+        products = Product.objects.bulk_create(
+            Product(name=f'Producto {i:05}', price=10 + i % 50) for i in range(cls.PRODUCTS)
+        )
+        Stock.objects.bulk_create(
+            Stock(store=store, product=products[(i * cls.STOCK_PER_STORE + j) % cls.PRODUCTS], quantity=10 + j * 20)
+            for i, store in enumerate(stores) for j in range(cls.STOCK_PER_STORE)
+        )
+        ProductAvailability.rebuild([store.id for store in stores])
+        recompute_counters()  # bulk_create no actualiza los totales guardados
+
+        cls.users = {}
+        for name, group in [('admin', 'Admins'), ('supplier', 'Suppliers'), ('customer', 'Customers')]:
+            user = User.objects.create(username=name, is_staff=name == 'admin')
+            user.groups.add(Group.objects.get(name=group))
+            cls.users[name] = user
+
+        supplier = Supplier.objects.create(user=cls.users['supplier'], name='Proveedor', email='p@example.com',
+                                           nif='P1')
+        deliveries = SupplierDelivery.objects.bulk_create(
+            SupplierDelivery(supplier=supplier, store=stores[i % 50], product=products[i % 100], quantity=5,
+                             approved=i % 3 == 0)
+            for i in range(cls.DELIVERIES)
+        )
+        pending = [delivery.id for delivery in deliveries if not delivery.approved]
+
+        customer = Customer.objects.create(user=cls.users['customer'], name='Cliente', email='c@example.com',
+                                           nif='C1')
+        purchases = Purchase.objects.bulk_create(
+            Purchase(customer=customer, store=stores[i % 20]) for i in range(cls.PURCHASES)
+        )
+        PurchaseDetail.objects.bulk_create(
+            PurchaseDetail(purchase=purchase, product=products[(i + j) % cls.PRODUCTS], quantity=1, unit_price=10)
+            for i, purchase in enumerate(purchases) for j in range(cls.DETAILS_PER_PURCHASE)
+        )
+        StockMovement.objects.bulk_create(
+            StockMovement(store=stores[0], product=products[0], quantity=1, movement_type='IN') for _ in range(500)
+        )
+
+        cart = Cart.objects.create(user=cls.users['customer'])
+        items = CartItem.objects.bulk_create(
+            CartItem(cart=cart, store=stores[0], product=products[i], quantity=1, unit_price=10)
+            for i in range(cls.CART_ITEMS)
+        )
+
+        profiles = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(profiles.cleanup)
+        cls.enterClassContext(override_settings(PROFILE_DIR=profiles.name))
+
+        cls.objects = {
+            'profile': save_profile(Counter({'main;view': 3}), {'path': '/'}),
+            'job': Job.objects.create(kind='import_catalog').id,
+            'cart_item': items[0].id,
+            'delivery': pending[0],
+            'deliveries': pending[1:201],
+        }
+
+    def _request(self, name, user, method, kwargs, params):
+        """Hace la petición y la deshace; devuelve (respuesta, consultas, segundos)"""
+        self.client.logout()
+        if user:
+            self.client.force_login(self.users[user])
+        kwargs = {key: self.objects.get(value, value) for key, value in kwargs.items()}
+        params = {key: self.objects.get(value, value) for key, value in params.items()}
+        with transaction.atomic():  # Cada petición empieza con los mismos datos
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = getattr(self.client, method)(reverse(name, kwargs=kwargs), params)
+                elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+        return response, queries.captured_queries, elapsed
+
+    def test_every_url_has_a_budget(self):
+        names = {pattern.name for pattern in get_resolver('core.urls').url_patterns if pattern.name}
+        self.assertEqual(names - set(self.BUDGETS), set())
+
+    def test_query_and_time_budgets(self):
+        for name, (user, method, kwargs, params, max_queries) in self.BUDGETS.items():
+            with self.subTest(url=name):
+                self._request(name, user, method, kwargs, params)  # En caliente: plantillas, cachés, imports
+                response, queries, elapsed = self._request(name, user, method, kwargs, params)
+                self.assertLess(response.status_code, 400)
+                self.assertLessEqual(len(queries), max_queries, '\n'.join(query['sql'] for query in queries))
+                if PERF_BUDGETS:
+                    self.assertLess(elapsed, self.SECONDS)
+
+
+class RequestMetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create(username='staff', is_staff=True)
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_requests_are_recorded_per_view(self):
+        self.client.get(reverse('store'))
+        self.client.get('/no-existe/')
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertRegex(body, r'http_requests_total\{view="store",pid="\d+",status="200"\} 1')
+        self.assertRegex(body, r'http_request_queries_count\{view="store",pid="\d+"\} 1')
+        self.assertRegex(body, r'http_request_duration_seconds_bucket\{view="<unmatched>",pid="\d+",le="\+Inf"\} 1')
+
+    def test_metrics_require_staff(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)
+
+
+class SlowQueryLogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create(username='staff', is_staff=True)
+        cls.store = Store.objects.create(name='Tienda', street='Calle 1')
+
+    def _logged(self, func):
+        with override_settings(SLOW_QUERY_MS=0), self.assertLogs('core.slow_queries', 'WARNING') as logs:
+            func()
+        return [json.loads(record.getMessage()) for record in logs.records]
+
+    def test_slow_query_is_logged_with_plan_and_call_site(self):
+        entry = self._logged(lambda: list(Stock.objects.filter(store=self.store)))[0]
+
+        self.assertIn('core_stock', entry['sql'])
+        self.assertTrue(entry['call_site'].startswith('core/tests.py:'))
+        self.assertTrue(any('core_stock' in step for step in entry['plan']), entry['plan'])
+
+    def test_entries_record_the_view(self):
+        entries = self._logged(lambda: self.client.get(reverse('store')))
+        self.assertIn('store', {entry['view'] for entry in entries})
+
+    def test_disabled_logger_logs_nothing(self):
+        self.client.force_login(self.staff)
+        with override_settings(SLOW_QUERY_MS=None), self.assertNoLogs('core.slow_queries', 'WARNING'):
+            response = self.client.get(reverse('slow_queries'))
+            list(Stock.objects.filter(store=self.store))
+        self.assertContains(response, 'Umbral: desactivado')
+
+    def test_environment_can_disable_the_logger(self):
+        probe = 'import django; django.setup(); from django.conf import settings; print(settings.SLOW_QUERY_MS)'
+        for value, expected in [('', 'None'), ('None', 'None'), ('off', 'None'), ('350', '350')]:
+            with self.subTest(value=value):
+                result = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, check=True,
+                                        env={**os.environ, 'SLOW_QUERY_MS': value})
+                self.assertEqual(result.stdout.strip(), expected)
+
+    def test_admin_page_lists_recent_entries(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as log:
+            log.write(json.dumps({'time': 'ahora', 'ms': 512.0, 'sql': 'SELECT lento', 'plan': ['SCAN core_stock']}))
+            log.write('\n')
+        self.client.force_login(self.staff)
+        with override_settings(SLOW_QUERY_LOG=log.name):
+            response = self.client.get(reverse('slow_queries'))
+        self.assertContains(response, 'SELECT lento')
+        self.assertContains(response, 'SCAN core_stock')
+
+
+class SamplingProfilerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create(username='staff', is_staff=True)
+        cls.customer = User.objects.create(username='cliente')
+
+    def setUp(self):
+        profiles = tempfile.TemporaryDirectory()
+        self.addCleanup(profiles.cleanup)
+        self.enterContext(override_settings(PROFILE_DIR=profiles.name, PROFILE_INTERVAL_MS=1))
+
+    def test_staff_can_profile_a_request(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('store'), {'profile': 1})
+        name = response['X-Profile-Id']
+
+        listing = self.client.get(reverse('request_profiles'))
+        self.assertContains(listing, reverse('request_profile', args=[name]))
+        detail = self.client.get(reverse('request_profile', args=[name]))
+        self.assertEqual(detail.context['profile']['view'], 'store')
+        download = self.client.get(reverse('request_profile', args=[name]), {'download': 1})
+        self.assertEqual(download['Content-Disposition'], f'attachment; filename="{name}.folded"')
+
+    def test_false_flag_values_do_not_profile(self):
+        self.client.force_login(self.staff)
+        for value in ('0', 'false', 'no', 'off', ''):
+            with self.subTest(value=value):
+                self.assertNotIn('X-Profile-Id', self.client.get(reverse('store'), {'profile': value}))
+                self.assertNotIn('X-Profile-Id', self.client.get(reverse('store'), HTTP_X_PROFILE=value))
+        self.assertIn('X-Profile-Id', self.client.get(reverse('store'), {'profile': 'True'}))
+
+    def test_flag_is_ignored_for_other_users(self):
+        self.client.force_login(self.customer)
+        response = self.client.get(reverse('store'), HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(list_profiles(), [])
+
+    def test_sampled_traffic_is_profiled(self):
+        with override_settings(PROFILE_SAMPLE_RATE=1.0):
+            self.client.get(reverse('store'))
+        self.assertEqual([profile['trigger'] for profile in list_profiles()], ['sample'])
+
+    def test_folded_stacks_and_top_frames(self):
+        def busy():
+            deadline = time.perf_counter() + 0.05
+            while time.perf_counter() < deadline:
+                pass
+
+        sampler = Sampler(threading.get_ident(), 0.001).start()
+        busy()
+        stacks = sampler.stop()
+        self.assertTrue(any(stack.split(';')[-1].startswith('busy ') for stack in stacks), stacks)
+
+        folded = ''.join(f'{stack} {count}\n' for stack, count in stacks.items())
+        frame, own, total = top_frames(folded)[0]
+        self.assertTrue(frame.startswith('busy '))
+        self.assertLessEqual(own, total)
+
+
+class RoleCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='cliente', password='clave-segura-1')
+        cls.customers = Group.objects.get(name='Customers')
+        cls.user.groups.add(cls.customers)
+
+    def setUp(self):
+        caches['roles'].clear()
+
+    def fresh_user(self):
+        return User.objects.get(pk=self.user.pk)  # Como request.user: un objeto nuevo en cada petición
+
+    def test_cache_is_not_the_development_one(self):
+        location = Path(caches['roles']._dir).resolve()
+        self.assertFalse(location.is_relative_to(Path(settings.BASE_DIR).resolve()), location)
+
+    def test_login_redirects_by_cached_role(self):
+        response = self.client.post(reverse('login'), {'username': 'cliente', 'password': 'clave-segura-1'})
+        self.assertRedirects(response, reverse('customer_dashboard'), fetch_redirect_response=False)
+        self.assertEqual(user_roles(self.fresh_user())['groups'], ['Customers'])
+
+    def test_permissions_are_read_from_the_cache(self):
+        self.assertTrue(self.fresh_user().has_perm('core.view_own_purchases'))
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_perm('core.view_own_purchases'))
+            self.assertFalse(user.has_perm('core.full_access'))
+            self.assertEqual(primary_role(user), 'Customers')
+
+    def test_invalidation_reaches_other_processes(self):
+        other = caches.create_connection('roles')  # La misma caché vista desde otro proceso
+        user_roles(self.fresh_user())
+        key = f"roles:{other.get(VERSION_KEY)}:{self.user.pk}"
+        self.assertEqual(other.get(key)['groups'], ['Customers'])
+        self.user.groups.add(Group.objects.get(name='Admins'))
+        self.assertIsNone(other.get(key))
+
+        version = other.get(VERSION_KEY)
+        self.customers.permissions.clear()
+        self.assertNotEqual(other.get(VERSION_KEY), version)
+
+    def test_sessions_from_the_previous_backend_stay_valid(self):
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        self.assertTrue(self.client.get(reverse('home')).wsgi_request.user.is_authenticated)
+
+    def test_wrong_password_is_rejected(self):
+        response = self.client.post(reverse('login'), {'username': 'cliente', 'password': 'otra'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+
+    def test_group_membership_change_invalidates(self):
+        self.assertFalse(self.fresh_user().has_perm('core.full_access'))
+        self.user.groups.add(Group.objects.get(name='Admins'))
+        self.assertTrue(self.fresh_user().has_perm('core.full_access'))
+        self.customers.user_set.remove(self.user)
+        self.assertFalse(self.fresh_user().has_perm('core.view_own_purchases'))
+
+    def test_group_permission_change_invalidates(self):
+        self.assertTrue(self.fresh_user().has_perm('core.view_own_purchases'))
+        self.customers.permissions.clear()
+        self.assertFalse(self.fresh_user().has_perm('core.view_own_purchases'))
+
+    def test_user_permission_change_invalidates(self):
+        self.assertFalse(self.fresh_user().has_perm('core.full_access'))
+        self.user.user_permissions.add(Permission.objects.get(codename='full_access'))
+        self.assertTrue(self.fresh_user().has_perm('core.full_access'))
+
+
+class PermissionSyncTests(TestCase):
+    SECONDS = 0.1  # Tiempo máximo de la sincronización tras cada migrate (solo con PERF_BUDGETS=1)
+
+    def test_sync_is_idempotent_and_cheap(self):
+        ContentType.objects.clear_cache()
+        started = time.perf_counter()
+        with self.assertNumQueries(6):  # Tipos de contenido, permisos, grupos, asignaciones y el savepoint
+            self.assertEqual(sync_roles(), [])
+        if PERF_BUDGETS:
+            self.assertLess(time.perf_counter() - started, self.SECONDS)
+
+    def test_sync_restores_missing_groups_and_permissions(self):
+        Group.objects.filter(name='Suppliers').delete()
+        Group.objects.get(name='Customers').permissions.clear()
+        Permission.objects.filter(codename='full_access').delete()
+
+        self.assertEqual(sync_roles(), [
+            'permiso full_access', 'grupo Suppliers',
+            'Customers ← view_own_purchases', 'Customers ← view_purchases',
+            'Suppliers ← manage_own_products', 'Suppliers ← manage_deliveries',
+            'Suppliers ← manage_supplier_deliveries', 'Suppliers ← manage_products',
+            'Admins ← full_access',
+        ])
+        self.assertEqual(sync_roles(), [])
+        for name, codenames in ROLE_PERMISSIONS.items():
+            self.assertCountEqual(Group.objects.get(name=name).permissions.values_list('codename', flat=True), codenames)
+
+    def test_migrate_reports_only_changes(self):
+        out = io.StringIO()
+        call_command('migrate', verbosity=1, stdout=out)
+        self.assertNotIn('Permisos y grupos', out.getvalue())
+
+        Group.objects.filter(name='Admins').delete()
+        call_command('migrate', verbosity=1, stdout=out)
+        self.assertEqual(out.getvalue().count('Permisos y grupos creados: grupo Admins, Admins ← full_access'), 1)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        store = Store.objects.create(name='Tienda', street='Calle 1')
+        product = Product.objects.create(name='Producto', price=10)
+        supplier = Supplier.objects.create(name='Proveedor', email='p@example.com', nif='P1')
+        cls.deliveries = SupplierDelivery.objects.bulk_create(
+            SupplierDelivery(supplier=supplier, store=store, product=product, quantity=1) for _ in range(9)
+        )
+        # Seis entregas en el mismo milisegundo (distinto microsegundo) y tres en el mismo microsegundo
+        base = timezone.now().replace(microsecond=123000)
+        for i, delivery in enumerate(cls.deliveries):
+            delivery.delivery_date = base + timedelta(microseconds=min(i, 6) * 100)
+        SupplierDelivery.objects.bulk_update(cls.deliveries, ['delivery_date'])
+        cls.ordering = ['-delivery_date', '-id']
+        cls.expected = list(SupplierDelivery.objects.order_by(*cls.ordering).values_list('id', flat=True))
+
+    def paginate(self, params=None, per_page=2):
+        request = RequestFactory().get('/', params or {})
+        return keyset_paginate(request, SupplierDelivery.objects.all(), self.ordering, per_page=per_page)
+
+    def params(self, url):
+        return QueryDict(url.lstrip('?'))
+
+    def test_forward_paging_keeps_rows_sharing_a_millisecond(self):
+        ids, page = [], self.paginate()
+        while True:
+            ids += [delivery.id for delivery in page]
+            if not page.next_url:
+                break
+            page = self.paginate(self.params(page.next_url))
+        self.assertEqual(ids, self.expected)
+
+    def test_backward_paging_returns_the_previous_pages(self):
+        pages = [self.paginate()]
+        while pages[-1].next_url:
+            pages.append(self.paginate(self.params(pages[-1].next_url)))
+        page = pages[-1]
+        for expected in reversed(pages[:-1]):
+            page = self.paginate(self.params(page.previous_url))
+            self.assertEqual([delivery.id for delivery in page], [delivery.id for delivery in expected])
+        self.assertFalse(page.has_previous)
+
+    def test_invalid_cursors_fall_back_to_the_first_page(self):
+        first = [delivery.id for delivery in self.paginate()]
+        for cursor in ['MQ==', '%%%', encode_cursor(['no es una fecha', 1]), encode_cursor([None, 1]),
+                       encode_cursor([timezone.now()]), encode_cursor({'id': 1})]:
+            with self.subTest(cursor=cursor):
+                self.assertEqual([delivery.id for delivery in self.paginate({'after': cursor})], first)
+                self.assertEqual([delivery.id for delivery in self.paginate({'before': cursor})], first)
+
+    def test_invalid_cursor_in_a_view(self):
+        response = self.client.get(reverse('store_products', args=[Store.objects.get().id]), {'after': 'MQ=='})
+        self.assertEqual(response.status_code, 200)
+
+
+class CatalogImporterTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.write(stores=['Centro,Calle 1,', 'Norte,Calle 2,'],
+                   products=['Teclado,,10.00', 'Ratón,,5.50'],
+                   stock=['Centro,Teclado,3', 'Centro,Ratón,4', 'Norte,Teclado,5'])
+
+    def write(self, stores=None, products=None, stock=None):
+        headers = {'stores': 'name,street,phone', 'products': 'name,description,price',
+                   'stock': 'store_name,product_name,quantity'}
+        for feed, rows in {'stores': stores, 'products': products, 'stock': stock}.items():
+            if rows is not None:
+                (self.directory / FEEDS[feed]).write_text('\n'.join([headers[feed], *rows]) + '\n', encoding='utf-8')
+
+    def run_import(self, **kwargs):
+        return CatalogImporter(self.directory, **kwargs).run()
+
+    def stock(self):
+        return dict(((stock.store.name, stock.product.name), stock.quantity)
+                    for stock in Stock.objects.select_related('store', 'product'))
+
+    def test_import_and_delta_skip(self):
+        report = self.run_import()
+        self.assertEqual(report.created, {'stores': 2, 'products': 2, 'stock': 3})
+        self.assertEqual(report.rejected, [])
+
+        self.write(stock=['Centro,Teclado,3', 'Centro,Ratón,9', 'Norte,Teclado,5'])
+        report = self.run_import(delta=True)
+        self.assertEqual(report.unchanged, {'stores': 2, 'products': 2, 'stock': 2})
+        self.assertEqual(report.updated['stock'], 1)
+        self.assertEqual(self.stock()[('Centro', 'Ratón')], 9)
+        self.assertEqual(Store.objects.get(name='Centro').stock_total, 12)
+
+    def test_delete_missing(self):
+        self.run_import()
+        self.write(products=['Teclado,,10.00'], stock=['Centro,Teclado,3', 'Norte,Teclado,5'])
+        report = self.run_import(delta=True, delete_missing=True)
+        self.assertEqual(report.deleted['products'], 1)
+        self.assertFalse(Product.objects.filter(name='Ratón').exists())
+        self.assertEqual(self.stock(), {('Centro', 'Teclado'): 3, ('Norte', 'Teclado'): 5})
+        self.assertFalse(ImportFingerprint.objects.filter(feed='stock', key='Centro|Ratón').exists())
+
+    def test_readded_product_recreates_its_stock(self):
+        self.run_import()
+        self.write(products=['Teclado,,10.00'])
+        self.run_import(delta=True, delete_missing=True)  # stock.csv aún trae Centro|Ratón: se rechaza
+        self.write(products=['Teclado,,10.00', 'Ratón,,5.50'])
+        report = self.run_import(delta=True)
+        self.assertEqual(report.created['products'], 1)
+        self.assertEqual(self.stock()[('Centro', 'Ratón')], 4)
+
+    def test_stock_deleted_outside_the_importer_is_recreated(self):
+        self.run_import()
+        Stock.objects.filter(store__name='Norte').delete()
+        report = self.run_import(delta=True)
+        self.assertEqual(report.created['stock'], 1)
+        self.assertEqual(self.stock()[('Norte', 'Teclado')], 5)
+
+    def test_bad_rows_are_rejected_without_stopping_the_batches(self):
+        self.write(products=['Teclado,,10.00', 'Ratón,,barato', ',,1.00', 'Pantalla,,99'],
+                   stock=['Centro,Teclado,3', 'Centro,Pantalla,-1', 'Sur,Teclado,2', 'Norte,Pantalla,7',
+                          'Norte,Teclado,x'])
+        report = self.run_import(batch_size=2)
+        self.assertEqual(report.created, {'stores': 2, 'products': 2, 'stock': 2})
+        self.assertEqual([(feed, line) for feed, line, _ in report.rejected],
+                         [('products', 3), ('products', 4), ('stock', 3), ('stock', 4), ('stock', 6)])
+        self.assertEqual(self.stock(), {('Centro', 'Teclado'): 3, ('Norte', 'Pantalla'): 7})
+        self.assertEqual(verify_counters(), [])  # bulk_create no pasa por Stock.save
+
+
+class MovementArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.store = Store.objects.create(name='Tienda', street='Calle 1')
+        cls.product = Product.objects.create(name='Producto', price=10)
+        cls.month = month_start(timezone.now() - timedelta(days=200))
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.enterContext(override_settings(MOVEMENT_ARCHIVE_DIR=directory.name))
+
+    def add_movements(self, count, day=1):
+        movements = StockMovement.objects.bulk_create(
+            StockMovement(store=self.store, product=self.product, quantity=i + 1, movement_type='IN')
+            for i in range(count)
+        )
+        StockMovement.objects.filter(id__in=[movement.id for movement in movements]) \
+            .update(date=self.month + timedelta(days=day))
+        StockMovement.objects.create(store=self.store, product=self.product, quantity=99, movement_type='OUT')
+        return [movement.id for movement in movements]
+
+    def history_ids(self):
+        return [row['id'] for row in movement_history(store_id=self.store.id)]
+
+    def test_round_trip(self):
+        archived = self.add_movements(3)
+        before = movement_history(store_id=self.store.id)
+
+        [archive] = archive_movements()
+        self.assertEqual((archive.rows, archive.first_id, archive.last_id), (3, archived[0], archived[-1]))
+        self.assertFalse(StockMovement.objects.filter(id__in=archived).exists())
+        self.assertEqual(movement_history(store_id=self.store.id), before)
+        self.assertEqual(verify_archives(), [])
+        self.assertEqual(archive_movements(), [])
+
+    def test_archiving_a_month_twice_keeps_both_exports(self):
+        first = self.add_movements(3)
+        [archive] = archive_movements()
+        late = self.add_movements(2, day=10)  # Filas que llegan tarde al mes ya archivado
+
+        with self.captureOnCommitCallbacks(execute=True):  # El fichero anterior se borra al confirmar
+            [again] = archive_movements()
+        self.assertEqual(again.pk, archive.pk)
+        self.assertEqual((again.rows, again.first_id, again.last_id), (5, first[0], late[-1]))
+        self.assertEqual(self.history_ids()[:5], first + late)
+        self.assertEqual(verify_archives(), [])
+        self.assertEqual(list(self.directory.rglob('*.csv.gz')), [archive_path(again)])
+
+    def test_limited_history_reads_only_the_newest_archives(self):
+        self.add_movements(3, day=-20)  # Mes anterior
+        self.add_movements(3)
+        self.assertEqual(len(archive_movements()), 2)
+        everything = self.history_ids()
+        self.assertEqual(len(everything), 8)  # 6 archivadas y las 2 vivas de add_movements
+
+        with unittest.mock.patch('core.movements.read_archive', wraps=read_archive) as reads:
+            newest = movement_history(store_id=self.store.id, limit=4)
+        self.assertEqual([row['id'] for row in newest], everything[-4:])
+        self.assertEqual(reads.call_count, 1)
+        self.assertEqual([row['id'] for row in movement_history(store_id=self.store.id, limit=20)], everything)
+
+    def test_history_view_is_bounded(self):
+        admin = User.objects.create(username='admin')
+        admin.groups.add(Group.objects.get(name='Admins'))
+        self.client.force_login(admin)
+        self.add_movements(3)
+        archive_movements()
+        old = StockMovement.objects.create(store=self.store, product=self.product, quantity=1, movement_type='IN')
+        StockMovement.objects.filter(pk=old.pk).update(date=timezone.now() - timedelta(days=800))
+        everything = [row['id'] for row in movement_history(store_id=self.store.id)]
+
+        url = reverse('movement_history_data')
+        data = self.client.get(url, {'store': self.store.id}).json()
+        self.assertEqual([row['id'] for row in data['movements']], everything[1:])  # Sin start: el último año
+        self.assertFalse(data['truncated'])
+
+        with unittest.mock.patch('core.views.HISTORY_MAX_ROWS', 2):
+            data = self.client.get(url, {'store': self.store.id}).json()
+        self.assertEqual([row['id'] for row in data['movements']], everything[-2:])
+        self.assertTrue(data['truncated'])
+
+    def test_tampered_archive_is_detected(self):
+        self.add_movements(2)
+        [archive] = archive_movements()
+        path = archive_path(archive)
+        path.write_bytes(path.read_bytes() + b'\0')
+        self.assertEqual(len(verify_archives()), 1)
+        self.add_movements(1, day=5)
+        with self.assertRaises(ArchiveError):
+            archive_movements()  # No se reescribe un archivo que ya no coincide con su registro
+
+
+class SQLiteProfileTests(SimpleTestCase):
+    def test_connecting_does_not_rewrite_the_database_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'db.sqlite3'
+            sqlite3.connect(path).execute('CREATE TABLE t (id INTEGER)').connection.close()
+            header = path.read_bytes()[:100]
+
+            settings_dict = ConnectionHandler({'default': sqlite_database(path)}).settings['default']
+            profile = DatabaseWrapper(settings_dict, alias='profile')  # Con los valores por defecto completados
+            with profile.cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM t')
+                cursor.execute('PRAGMA busy_timeout')
+                self.assertEqual(cursor.fetchone()[0], BUSY_TIMEOUT_MS)
+            profile.close()
+            self.assertEqual(path.read_bytes()[:100], header)  # Bytes 18-19: 1 1 sin WAL, 2 2 con WAL
+
+
+class ShardingTests(TestCase):
+    """Con dos shards SQLite temporales: enrutado, borrado en cascada y transacciones entre bases de datos"""
+    SHARDS = ['store_shard_0', 'store_shard_1']
+    databases = '__all__'  # Se resuelve en setUpClass, con los shards ya registrados
+
+    @classmethod
+    def setUpClass(cls):
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        pragmas = {**PRAGMAS, 'foreign_keys': 'OFF'}  # Como en settings
+        configured = ConnectionHandler({'default': {}, **{
+            alias: sqlite_database(Path(directory.name) / f'{alias}.sqlite3', pragmas=pragmas) for alias in cls.SHARDS
+        }}).settings
+        for alias in cls.SHARDS:
+            connections.settings[alias] = configured[alias]
+            cls.addClassCleanup(cls._remove_connection, alias)
+        cls.enterClassContext(override_settings(STORE_SHARDS=cls.SHARDS))
+        for alias in cls.SHARDS:
+            call_command('migrate', database=alias, verbosity=0)
+            connections[alias].close()  # migrate deja foreign_keys=ON en la conexión abierta
+        super().setUpClass()
+
+    @staticmethod
+    def _remove_connection(alias):
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stores = [Store.objects.create(name=f'Tienda {i}', street='Calle') for i in range(2)]
+        cls.product = Product.objects.create(name='Producto', price=10)
+        user = User.objects.create(username='cliente')
+        cls.customer = Customer.objects.create(user=user, name='Cliente', email='c@example.com', nif='C1')
+
+    def test_rows_live_in_the_shard_of_their_store(self):
+        for store in self.stores:
+            Stock.objects.for_store(store.id).create(store=store, product=self.product, quantity=5)
+        for store in self.stores:
+            alias = shard_for_store(store.id)
+            self.assertEqual(list(Stock.objects.using(alias).values_list('store_id', flat=True)), [store.id])
+            self.assertTrue(Store.objects.using(alias).filter(pk=store.pk).exists())  # Copia del catálogo
+        self.assertFalse(Stock.objects.using('default').exists())
+        self.assertEqual(sorted(qs.db for qs in across_shards(Stock.objects.all())), self.SHARDS)
+        self.assertEqual(sum(qs.count() for qs in across_shards(Stock.objects.all())), 2)
+
+    def test_router(self):
+        router = ShardRouter()
+        store = self.stores[1]
+        self.assertEqual(router.db_for_write(Stock, instance=store), shard_for_store(store.id))
+        self.assertEqual(router.db_for_read(Stock, instance=Stock(store_id=store.id)), shard_for_store(store.id))
+        self.assertIsNone(router.db_for_read(Stock))
+        self.assertIsNone(router.db_for_read(Customer, instance=store))
+        self.assertTrue(router.allow_migrate('store_shard_0', 'core', model_name='purchase'))
+        self.assertFalse(router.allow_migrate('store_shard_0', 'core', model_name='customer'))
+        self.assertFalse(router.allow_migrate('store_shard_0', 'auth', model_name='user'))
+        self.assertIsNone(router.allow_migrate('default', 'auth', model_name='user'))
+
+    def test_deleting_a_customer_removes_its_purchases_from_every_shard(self):
+        for store in self.stores:
+            purchase = Purchase.objects.for_store(store.id).create(customer=self.customer, store=store)
+            PurchaseDetail.objects.for_store(store.id).create(purchase=purchase, product=self.product, quantity=1,
+                                                              unit_price=10)
+        self.assertEqual([Purchase.objects.using(alias).count() for alias in self.SHARDS], [1, 1])
+
+        self.customer.user.delete()
+        for alias in self.SHARDS:
+            self.assertFalse(Purchase.objects.using(alias).exists())
+            self.assertFalse(PurchaseDetail.objects.using(alias).exists())
+
+    def test_deleting_a_product_removes_its_stock_from_every_shard(self):
+        for store in self.stores:
+            Stock.objects.for_store(store.id).create(store=store, product=self.product, quantity=5)
+        self.product.delete()
+        for alias in self.SHARDS:
+            self.assertFalse(Stock.objects.using(alias).exists())
+            self.assertFalse(Product.objects.using(alias).exists())
+
+    def test_atomic_for_stores_rolls_back_every_database(self):
+        with self.assertRaises(RuntimeError):
+            with atomic_for_stores(*(store.id for store in self.stores)):
+                for store in self.stores:
+                    Stock.objects.for_store(store.id).create(store=store, product=self.product, quantity=5)
+                Product.objects.create(name='Otro', price=1)
+                raise RuntimeError
+        self.assertEqual(sum(qs.count() for qs in across_shards(Stock.objects.all())), 0)
+        self.assertFalse(Product.objects.filter(name='Otro').exists())
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.store = Store.objects.create(name='Tienda', street='Calle 1')
+        cls.products = Product.objects.bulk_create(Product(name=f'Producto {i}', price=10) for i in range(20))
+        Stock.objects.bulk_create(Stock(store=cls.store, product=product, quantity=10) for product in cls.products)
+        ProductAvailability.rebuild([cls.store.id])
+        recompute_counters()
+        cls.user = User.objects.create(username='cliente')
+        cls.user.groups.add(Group.objects.get(name='Customers'))
+        cls.customer = Customer.objects.create(user=cls.user, name='Cliente', email='c@example.com', nif='C1')
+        cls.cart = Cart.objects.create(user=cls.user)
+
+    def fill_cart(self, size, quantity=1):
+        CartItem.objects.bulk_create(
+            CartItem(cart=self.cart, store=self.store, product=product, quantity=quantity, unit_price=10)
+            for product in self.products[:size]
+        )
+
+    def test_queries_do_not_grow_with_the_cart(self):
+        for size in (1, 5, 20):
+            with self.subTest(size=size), transaction.atomic():
+                self.fill_cart(size)
+                with self.assertNumQueries(13):  # Incluye los savepoints de atomic_for_stores
+                    purchase = confirm_cart(self.cart, self.customer)
+                self.assertEqual(purchase.details.count(), size)
+                transaction.set_rollback(True)
+
+    def test_insufficient_stock_changes_nothing(self):
+        self.fill_cart(3)
+        CartItem.objects.filter(product=self.products[2]).update(quantity=11)
+        before = list(Stock.objects.order_by('id').values_list('quantity', flat=True))
+
+        with self.assertRaises(InsufficientStock):
+            confirm_cart(self.cart, self.customer)
+        self.assertEqual(list(Stock.objects.order_by('id').values_list('quantity', flat=True)), before)
+        self.assertEqual(self.cart.items.count(), 3)
+        self.assertFalse(Purchase.objects.exists())
+        self.assertFalse(StockMovement.objects.exists())
+        self.assertEqual(Store.objects.get().stock_total, 200)
+
+    def test_view_reports_insufficient_stock(self):
+        self.fill_cart(1, quantity=11)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('confirm_purchase'), follow=True)
+        self.assertRedirects(response, reverse('view_cart'))
+        self.assertContains(response, 'No hay stock suficiente para completar la compra.')
+
+
+class StockCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.store = Store.objects.create(name='Tienda', street='Calle 1')
+        cls.product = Product.objects.create(name='Producto', price=10)
+        cls.stock = Stock.objects.create(store=cls.store, product=cls.product, quantity=5)
+
+    def assertStock(self, quantity, movements):
+        self.assertEqual(Stock.objects.get(pk=self.stock.pk).quantity, quantity)
+        self.assertEqual(Store.objects.get(pk=self.store.pk).stock_total, quantity)
+        self.assertEqual(StockMovement.objects.count(), movements)
+        self.assertEqual(ProductAvailability.objects.filter(store=self.store, product=self.product).exists(),
+                         quantity > 0)
+
+    def test_decrement_below_zero_leaves_the_row_unchanged(self):
+        stock = Stock.objects.get(pk=self.stock.pk)
+        with self.assertRaises(InsufficientStock):
+            stock.update_stock(6, StockMovement.DECREASE)
+        self.assertStock(5, movements=0)
+
+    def test_competing_decrements_are_not_lost(self):
+        first, second = Stock.objects.get(pk=self.stock.pk), Stock.objects.get(pk=self.stock.pk)  # Ambos leen 5
+        first.update_stock(2, StockMovement.DECREASE)
+        second.update_stock(2, StockMovement.DECREASE)
+        self.assertEqual(second.quantity, 1)
+        self.assertStock(1, movements=2)
+
+    def test_competing_decrements_cannot_oversell(self):
+        first, second = Stock.objects.get(pk=self.stock.pk), Stock.objects.get(pk=self.stock.pk)
+        first.update_stock(5, StockMovement.DECREASE)
+        with self.assertRaises(InsufficientStock):
+            second.update_stock(3, StockMovement.DECREASE)  # Su copia aún dice 5, la fila ya está a 0
+        self.assertStock(0, movements=1)
+
+
+class ProductImageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Producto', price=10, image='img/product_images/vieja.jpg')
+        Product.objects.filter(pk=cls.product.pk).update(
+            image_hash='abc', image_variants={'card': 'vieja-card.jpg', 'card_webp': 'vieja-card.webp'})
+        Job.objects.all().delete()
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = Path(media.name)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+
+    def write_image(self, name, color):
+        path = self.media / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        Image.new('RGB', (20, 10), color).save(path, 'JPEG')
+        return name
+
+    def replace_image(self, name):
+        product = Product.objects.get(pk=self.product.pk)
+        product.image = name
+        product.save()
+        return Job.objects.get(kind='render_variants')
+
+    def render(self, job):
+        HANDLERS[job.kind](JobContext(job))
+        return Product.objects.get(pk=self.product.pk)
+
+    def test_new_image_drops_the_previous_variants(self):
+        job = self.replace_image('img/product_images/nueva.jpg')
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.image_hash, product.image_variants), ('', {}))
+        self.assertEqual(job.payload['previous_hash'], 'abc')  # Se encolan las miniaturas de la imagen nueva
+
+    def test_other_edits_keep_the_variants(self):
+        product = Product.objects.get(pk=self.product.pk)
+        product.price = 12
+        product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.image_hash, 'abc')
+        self.assertFalse(Job.objects.exists())
+
+    def test_same_bytes_under_a_new_name_reuse_the_variants(self):
+        self.write_image('img/product_images/vieja.jpg', 'red')
+        Product.objects.filter(pk=self.product.pk).update(
+            image_hash=file_hash(self.media / 'img/product_images/vieja.jpg'))
+        (self.media / 'img/product_images/copia.jpg').write_bytes(
+            (self.media / 'img/product_images/vieja.jpg').read_bytes())
+
+        product = self.render(self.replace_image('img/product_images/copia.jpg'))
+        self.assertEqual(product.image_variants, {'card': 'vieja-card.jpg', 'card_webp': 'vieja-card.webp'})
+        self.assertFalse((self.media / VARIANTS_DIR).exists())  # No se ha regenerado nada
+
+    def test_new_content_renders_new_variants(self):
+        self.write_image('img/product_images/nueva.jpg', 'blue')
+        product = self.render(self.replace_image('img/product_images/nueva.jpg'))
+        self.assertEqual(product.image_hash, file_hash(self.media / 'img/product_images/nueva.jpg'))
+        self.assertEqual(set(product.image_variants), {'card', 'card_webp', 'thumb', 'thumb_webp', 'admin',
+                                                       'admin_webp'})
+        self.assertTrue((self.media / product.image_variants['card_webp']).exists())
+
+    def test_late_variants_of_a_replaced_image_are_discarded(self):
+        self.replace_image('img/product_images/nueva.jpg')
+        save_variants(self.product.pk, 'img/product_images/vieja.jpg', 'abc', {'card': 'vieja-card.jpg'})
+        self.assertEqual(Product.objects.get(pk=self.product.pk).image_variants, {})
+
+
+class ImageManifestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Producto', price=10, image='img/product_images/no-existe.jpg')
+
+    def test_missing_image_falls_back_to_the_default(self):
+        product = Product.objects.get(pk=self.product.pk)
+        product.image_variants = {'card': 'card.jpg', 'card_webp': 'card.webp'}
+        entries = resolve_images([product.image.name])
+        self.assertFalse(entries[product.image.name].exists)
+        self.assertEqual(product_image_urls(entries, product), (static(FALLBACK_IMAGE), None))
+        self.assertEqual(product_image_urls(entries, Product(name='Sin imagen', price=1)),
+                         (static(FALLBACK_IMAGE), None))
+
+    def test_known_images_resolve_in_one_query(self):
+        store = Store.objects.create(name='Tienda', street='Calle 1')
+        with self.assertNumQueries(1):
+            entries = resolve_images([self.product.image.name, store.image.name, ''])
+        self.assertEqual(entries.keys(), {self.product.image.name, FALLBACK_IMAGE})
+
+    def test_only_image_changes_refresh_the_manifest(self):
+        ImageManifest.objects.all().delete()
+        product = Product.objects.get(pk=self.product.pk)
+        product.price = 12
+        product.save()
+        self.assertFalse(ImageManifest.objects.exists())
+
+        product.image = 'img/product_images/otra.jpg'
+        product.save()
+        self.assertEqual(list(ImageManifest.objects.values_list('name', flat=True)), ['img/product_images/otra.jpg'])
+
+
+class BulkApprovalTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.store = Store.objects.create(name='Tienda', street='Calle 1')
+        cls.products = Product.objects.bulk_create(Product(name=f'Producto {i}', price=10) for i in range(2))
+        cls.admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        supplier_user = User.objects.create(username='proveedor')
+        supplier = Supplier.objects.create(user=supplier_user, name='Proveedor', email='p@example.com', nif='P1')
+        cls.deliveries = SupplierDelivery.objects.bulk_create(
+            SupplierDelivery(supplier=supplier, store=cls.store, product=cls.products[i % 2], quantity=5)
+            for i in range(4)
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def approve(self, data):
+        return self.client.post(reverse('approve_selected_deliveries'), data, follow=True)
+
+    def test_selected_deliveries_update_stock_once_per_product(self):
+        response = self.approve({'delivery': [delivery.id for delivery in self.deliveries[:3]]})
+        self.assertContains(response, '3 entregas aprobadas.')
+        self.assertEqual(SupplierDelivery.objects.filter(approved=True).count(), 3)
+        self.assertEqual(dict(Stock.objects.values_list('product_id', 'quantity')),
+                         {self.products[0].id: 10, self.products[1].id: 5})
+        self.assertEqual(Store.objects.get().stock_total, 15)
+        self.assertEqual(StockMovement.objects.count(), 3)
+
+    def test_all_pending_goes_to_the_job_queue_above_the_limit(self):
+        with unittest.mock.patch('core.views.INLINE_APPROVAL_LIMIT', 3):
+            response = self.approve({'all': '1'})
+        self.assertContains(response, 'Las 4 entregas se aprobarán en segundo plano.')
+        job = Job.objects.get(kind='approve_deliveries')
+        self.assertEqual(sorted(job.payload['delivery_ids']), [delivery.id for delivery in self.deliveries])
+        self.assertFalse(SupplierDelivery.objects.filter(approved=True).exists())
+
+    def test_all_pending_below_the_limit_is_approved_inline(self):
+        self.approve({'all': '1'})
+        self.assertFalse(SupplierDelivery.objects.filter(approved=False).exists())
+        self.assertFalse(Job.objects.exists())
+
+    def test_racing_approval_is_reported(self):
+        race = ConcurrentApproval('Algunas entregas ya se habían aprobado; inténtalo de nuevo.')
+        with unittest.mock.patch('core.views.approve_deliveries', side_effect=race):
+            response = self.approve({'delivery': [self.deliveries[0].id]})
+        self.assertContains(response, 'inténtalo de nuevo')
+
+        with unittest.mock.patch('core.admin.approve_deliveries', side_effect=race):
+            response = self.client.post(
+                reverse('admin:core_supplierdelivery_changelist'),
+                {'action': 'approve_selected', '_selected_action': [self.deliveries[0].id]}, follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'inténtalo de nuevo')
+
+
+class ReportDataTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.stores = Store.objects.bulk_create(Store(name=f'Tienda {i}', street='Calle 1') for i in range(2))
+        cls.product = Product.objects.create(name='Producto', price=10)
+        cls.user = User.objects.create(username='cliente')
+        supplier = Supplier.objects.create(user=User.objects.create(username='proveedor'), name='Proveedor',
+                                           email='p@example.com', nif='P1')
+        cls.deliveries = SupplierDelivery.objects.bulk_create(
+            SupplierDelivery(supplier=supplier, store=store, product=cls.product, quantity=quantity, approved=True)
+            for store, quantity in [(cls.stores[0], 5), (cls.stores[1], 7), (cls.stores[1], 1)]
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def report(self, headers=None, **params):
+        return self.client.get(reverse('delivery_report_data'), params, **(headers or {}))
+
+    def test_groups_and_orders_by_the_first_measure(self):
+        response = self.report(group_by='store', top=1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['series'], [
+            {'store': {'id': self.stores[1].id, 'name': 'Tienda 1'}, 'quantity': 8},
+        ])
+
+    def test_empty_group_by_uses_the_default_dimension(self):
+        for group_by in ('', ','):
+            with self.subTest(group_by=group_by):
+                data = self.report(group_by=group_by).json()
+                self.assertEqual(data['group_by'], ['product'])
+                self.assertEqual(data['series'], [{'product': {'id': self.product.id, 'name': 'Producto'},
+                                                   'quantity': 13}])
+
+    def test_invalid_parameters_are_rejected(self):
+        for params in ({'group_by': 'color'}, {'bucket': 'year'}, {'start': 'ayer'}, {'top': '0'}):
+            with self.subTest(**params):
+                response = self.report(**params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+    def test_unchanged_data_answers_not_modified(self):
+        etag = self.report()['ETag']
+        self.assertEqual(self.report(headers={'HTTP_IF_NONE_MATCH': etag}).status_code, 304)
+        self.assertEqual(self.report(group_by='store', headers={'HTTP_IF_NONE_MATCH': etag}).status_code, 200)
+
+        SupplierDelivery.objects.filter(pk=self.deliveries[0].pk).update(quantity=6)
+        response = self.report(headers={'HTTP_IF_NONE_MATCH': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_sales_report_needs_full_access(self):
+        self.assertEqual(self.client.get(reverse('sales_report_data')).status_code, 403)
+
+
+class JobQueueTests(TestCase):
+    """Reintentos y cancelaciones de ``core.jobs`` (``run_job`` en el propio proceso)"""
+
+    def setUp(self):
+        self.calls = []
+        self.enterContext(unittest.mock.patch.dict(HANDLERS, {'test': self.handler}))
+        # run_job cierra las conexiones al acabar; en el test la transacción tiene que seguir abierta
+        self.enterContext(unittest.mock.patch.object(connections, 'close_all'))
+
+    def handler(self, ctx):
+        self.calls.append(ctx.job.attempts)
+        ctx.progress(50, 'working')
+        if ctx.payload.get('fail'):
+            raise RuntimeError('boom')
+        return {'ok': True}
+
+    def run_next(self):
+        job_id = claim_next()
+        if job_id is not None:
+            run_job(job_id)
+        return job_id
+
+    def test_failures_are_retried_with_backoff_until_max_attempts(self):
+        job = enqueue('test', {'fail': True}, max_attempts=2)
+        self.assertEqual(self.run_next(), job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertIn('boom', job.error)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=RETRY_DELAY_SECONDS - 5))
+        self.assertIsNone(self.run_next())  # Aún no toca
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.run_next()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, self.calls), (Job.FAILED, 2, [1, 2]))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_admin_retry_clears_the_failed_attempt(self):
+        job = enqueue('test', {'fail': True}, max_attempts=1)
+        self.run_next()
+        admin.site._registry[Job].retry_jobs(None, Job.objects.filter(pk=job.pk))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.progress, job.message, job.error, job.finished_at),
+                         (Job.PENDING, 0, 0, '', '', None))
+
+    def test_success_stores_the_result(self):
+        job = enqueue('test')
+        self.run_next()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress, job.result), (Job.SUCCEEDED, 100, {'ok': True}))
+
+    def test_cancelled_pending_job_never_runs(self):
+        job = enqueue('test')
+        self.assertTrue(cancel(job.id))
+        self.assertIsNone(self.run_next())
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.CANCELLED)
+        self.assertFalse(cancel(job.id))  # Ya terminada
+        self.assertEqual(self.calls, [])
+
+    def test_running_job_stops_at_its_next_progress(self):
+        job = enqueue('test')
+        job_id = claim_next()
+        self.assertTrue(cancel(job_id))
+        run_job(job_id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.cancel_requested, job.result), (Job.CANCELLED, True, None))
+
+    def test_stale_sweep_follows_the_heartbeat(self):
+        job = enqueue('test', max_attempts=1)
+        other = enqueue('test')
+        claim_next(), claim_next()
+        long_ago = timezone.now() - timedelta(hours=2)
+        Job.objects.update(started_at=long_ago)  # Tareas lentas pero vivas
+        self.assertEqual(requeue_stale(timedelta(minutes=2)), (0, 0))
+
+        Job.objects.update(heartbeat_at=long_ago)
+        self.assertEqual(requeue_stale(timedelta(minutes=2)), (1, 1))
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.FAILED)  # Sin intentos restantes
+        self.assertEqual(Job.objects.get(pk=other.pk).status, Job.PENDING)
+
+    def test_broken_pool_releases_its_jobs(self):
+        crashed, finished = enqueue('test'), enqueue('test')
+        claim_next(), claim_next()
+        ok = Future()
+        ok.set_result(None)
+        running = {RunJobsCommand.failed_future(BrokenProcessPool('un proceso del pool terminó de golpe')): crashed.id,
+                   ok: finished.id}
+        self.assertTrue(RunJobsCommand(stdout=io.StringIO()).reap(running))
+        self.assertEqual(running, {})
+        crashed.refresh_from_db()
+        self.assertEqual(crashed.status, Job.PENDING)
+        self.assertIn('BrokenProcessPool', crashed.error)
+        self.assertEqual(Job.objects.get(pk=finished.pk).status, Job.RUNNING)  # Su resultado lo guarda run_job
+
+    def test_queueing_a_report_needs_a_post(self):
+        admin = User.objects.create(username='admin')
+        admin.groups.add(Group.objects.get(name='Admins'))
+        self.client.force_login(admin)
+        self.assertEqual(self.client.get(reverse('queue_delivery_report')).status_code, 405)
+        self.assertFalse(Job.objects.exists())
+        self.assertRedirects(self.client.post(reverse('queue_delivery_report')), reverse('admin_dashboard'))
+        self.assertEqual(Job.objects.get().kind, 'render_delivery_report')
+
+
+class CounterConsistencyTests(TestCase):
+    """Los contadores guardados (``core.counters``) siguen cuadrando tras las operaciones habituales"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.store = Store.objects.create(name='Tienda', street='Calle 1')
+        cls.products = Product.objects.bulk_create(Product(name=f'Producto {i}', price=10 + i) for i in range(3))
+        for product in cls.products:
+            Stock.objects.create(store=cls.store, product=product, quantity=10)
+        ProductAvailability.rebuild([cls.store.id])
+        user = User.objects.create(username='cliente')
+        cls.customer = Customer.objects.create(user=user, name='Cliente', email='c@example.com', nif='C1')
+        cls.cart = Cart.objects.create(user=user)
+        supplier_user = User.objects.create(username='proveedor')
+        cls.supplier = Supplier.objects.create(user=supplier_user, name='Proveedor', email='p@example.com',
+                                               nif='P1')
+
+    def test_no_drift_after_checkout_and_approval(self):
+        CartItem.objects.bulk_create(
+            CartItem(cart=self.cart, store=self.store, product=product, quantity=2, unit_price=product.price)
+            for product in self.products
+        )
+        confirm_cart(self.cart, self.customer)
+
+        deliveries = [SupplierDelivery.objects.create(supplier=self.supplier, store=self.store, product=product,
+                                                      quantity=4)
+                      for product in self.products]
+        approve_deliveries([delivery.id for delivery in deliveries[:2]])
+        deliveries[2].approved = True
+        deliveries[2].save()
+
+        self.assertEqual(verify_counters(), [])
+        self.assertEqual(Store.objects.get().stock_total, 30 - 6 + 12)
+        self.assertEqual(Supplier.objects.get().delivered_units, 12)
+        self.assertEqual(Customer.objects.get().purchase_count, 1)
+
+    def checkout(self):
+        CartItem.objects.bulk_create(
+            CartItem(cart=self.cart, store=self.store, product=product, quantity=1, unit_price=product.price)
+            for product in self.products
+        )
+        return confirm_cart(self.cart, self.customer)
+
+    def test_deleting_details_refreshes_each_purchase_once(self):
+        purchase = self.checkout()
+        with unittest.mock.patch.object(Purchase, 'refresh_amounts', wraps=Purchase.refresh_amounts) as refresh:
+            PurchaseDetail.objects.filter(purchase=purchase, product__in=self.products[:2]).delete()
+        self.assertEqual(refresh.call_count, 1)
+        self.assertEqual(Purchase.objects.get(pk=purchase.pk).amount, self.products[2].price)
+        self.assertEqual(verify_counters(), [])
+
+    def test_deleting_a_purchase_skips_the_amount_refresh(self):
+        purchase = self.checkout()
+        with unittest.mock.patch.object(Purchase, 'refresh_amounts', wraps=Purchase.refresh_amounts) as refresh:
+            purchase.delete()
+        self.assertEqual(refresh.call_count, 0)
+        self.assertFalse(PurchaseDetail.objects.exists())
+        self.assertEqual(verify_counters(), [])
+
+    def test_drift_is_found_and_recomputed(self):
+        Store.objects.update(stock_total=1)
+        self.assertEqual(verify_counters(), [('Store', self.store.id, 'stock_total', 1, 30)])
+        recompute_counters()
+        self.assertEqual(verify_counters(), [])
+
+
+class ReplicaStickinessTests(TestCase):
+    """Con réplica configurada, una sesión que acaba de escribir lee de ``default``"""
+
+    def setUp(self):
+        self.enterContext(unittest.mock.patch('core.routers.replica_alias', return_value='replica'))
+        self.enterContext(unittest.mock.patch('core.middleware.replica_alias', return_value='replica'))
+        self.session = {}
+
+    def handle(self, view):
+        request = RequestFactory().get('/')
+        request.session = self.session
+        return ReplicaStickinessMiddleware(replica_reads(view))(request)
+
+    def read_alias(self, request=None):
+        return router.db_for_read(Product)
+
+    def write(self, request):
+        Product.objects.create(name='Producto', price=10)
+        return router.db_for_read(Product)
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        self.assertEqual(self.handle(self.read_alias), 'replica')
+        self.assertEqual(self.handle(self.write), 'default')  # También en la petición que escribe
+        self.assertEqual(self.handle(self.read_alias), 'default')
+
+        self.session[STICKY_SESSION_KEY] = time.time() - 1  # Pasado REPLICA_STICKY_SECONDS
+        self.assertEqual(self.handle(self.read_alias), 'replica')
+
+    def test_reads_outside_replica_views_use_the_primary(self):
+        self.assertEqual(self.read_alias(), 'default')
+        with track_writes(), use_replica():
+            self.assertEqual(self.read_alias(), 'replica')
+            Product.objects.create(name='Producto', price=10)
+            self.assertEqual(self.read_alias(), 'default')
+
+
+class ReportCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        store = Store.objects.create(name='Tienda', street='Calle 1')
+        product = Product.objects.create(name='Producto', price=10)
+        supplier = Supplier.objects.create(user=User.objects.create(username='proveedor'), name='Proveedor',
+                                           email='p@example.com', nif='P1')
+        SupplierDelivery.objects.create(supplier=supplier, store=store, product=product, quantity=5, approved=True)
+
+    def setUp(self):
+        caches['reports'].clear()
+
+    def test_charts_and_stats_are_shared_between_processes(self):
+        charts = delivery_charts()  # Lo renderiza el worker de tareas...
+        other = caches.create_connection('reports')  # ...y lo sirve otro proceso
+        with unittest.mock.patch('core.reports.caches', {'reports': other}):
+            self.assertEqual(delivery_charts(), charts)
+            stats = report_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(report_cache_stats(), stats)
@@ -0,0 +1,97 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from PIL import Image
+
+from .models import Product
+
+# Tamaños generados para cada imagen de producto (además de su versión WebP)
+VARIANTS = {
+    "card": (500, 500),
+    "thumb": (150, 150),
+    "admin": (80, 80),
+}
+VARIANTS_DIR = "img/product_images/variants"
+
+def file_hash(path):
+    """Hash SHA-256 del contenido del fichero"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def render_variants(media_root, name, previous_hash=""):
+    """Genera las variantes de una imagen. Se ejecuta en el pool de procesos,
+    por eso no accede a la base de datos ni a los settings de Django.
+
+    Devuelve ``(hash, variantes)``; las variantes son ``None`` si la imagen
+    no ha cambiado desde la última vez.
+    """
+    path = os.path.join(media_root, name)
+    digest = file_hash(path)
+    if digest == previous_hash:
+        return digest, None
+
+    os.makedirs(os.path.join(media_root, VARIANTS_DIR), exist_ok=True)
+    stem = os.path.splitext(os.path.basename(name))[0]
+    variants = {}
+    with Image.open(path) as img:
+        img = img.convert("RGB")
+        for variant, size in VARIANTS.items():
+            resized = img.copy()
+            resized.thumbnail(size)
+            base = f"{VARIANTS_DIR}/{stem}-{digest[:12]}-{variant}"
+            resized.save(os.path.join(media_root, base + ".jpg"), "JPEG", quality=85, optimize=True)
+            resized.save(os.path.join(media_root, base + ".webp"), "WEBP", quality=80)
+            variants[variant] = base + ".jpg"
+            variants[variant + "_webp"] = base + ".webp"
+    return digest, variants
+
+
+def save_variants(product_id, name, digest, variants):
+    """Registra las variantes generadas sin volver a llamar a Product.save; no
+    hace nada si entretanto el producto cambió de imagen"""
+    if variants is not None:
+        Product.objects.filter(pk=product_id, image=name).update(image_hash=digest, image_variants=variants)
+
+
+def schedule_variants(product, previous_hash="", previous_variants=None):
+    """Encola en el worker de tareas (``manage.py run_jobs``) la generación de variantes.
+
+    Si el fichero nuevo tiene el mismo contenido que la imagen anterior
+    (``previous_hash``), no se regenera nada y se recuperan ``previous_variants``.
+    """
+    from .jobs import enqueue
+
+    return enqueue("render_variants", {
+        "product_id": product.pk,
+        "name": product.image.name,
+        "previous_hash": previous_hash,
+        "previous_variants": previous_variants or {},
+    })
+
+
+def generate_all(force=False):
+    """Genera (de forma síncrona) las variantes de todos los productos con imagen"""
+    products = list(Product.objects.exclude(image="").exclude(image=None).only("id", "image", "image_hash"))
+    generated, failed = 0, []
+    with ProcessPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS) as executor:
+        futures = [
+            (product.pk, product.image.name, executor.submit(render_variants, str(settings.MEDIA_ROOT),
+                                                             product.image.name, "" if force else product.image_hash))
+            for product in products
+        ]
+        for product_id, name, future in futures:
+            try:
+                digest, variants = future.result()
+            except Exception as exc:
+                failed.append((product_id, exc))
+                continue
+            if variants is not None:
+                save_variants(product_id, name, digest, variants)
+                generated += 1
+    return generated, failed
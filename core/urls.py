@@ -4,7 +4,9 @@ from django.urls import path
 from .views import home, user_login, user_logout, register_customer, view_cart, store_products, admin_dashboard, \
     supplier_dashboard, customer_dashboard, register_supplier, store_dashboard, transfer_product, load_products, \
     supplier_delivery_dashboard, store, add_to_cart, purchase_history, remove_from_cart, confirm_purchase, \
-    approve_delivery, product_delivery_report
+    approve_delivery, product_delivery_report, report_stats, delivery_report_data, sales_report_data, \
+    queue_delivery_report, job_status, cancel_job, approve_selected_deliveries, movement_history_data, \
+    metrics, slow_queries, request_profiles, request_profile
 
 urlpatterns = [
     path('', home, name='home'),
@@ -24,6 +26,9 @@ urlpatterns = [
     path('transfer-product/', transfer_product, name='transfer_product'),
     #
     path('load-products/', load_products, name='load_products'),
+    path('jobs/delivery-report/', queue_delivery_report, name='queue_delivery_report'),
+    path('jobs/<int:job_id>/', job_status, name='job_status'),
+    path('jobs/<int:job_id>/cancel/', cancel_job, name='cancel_job'),
     path('supplier-deliveries/', supplier_delivery_dashboard, name='supplier_delivery_dashboard'),
     path('purchase-history/', purchase_history, name='purchase_history'),
     #
@@ -32,7 +37,16 @@ urlpatterns = [
     path("remove-from-cart/<int:cart_item_id>/", remove_from_cart, name="remove_from_cart"),
     path("confirm-purchase/", confirm_purchase, name="confirm_purchase"),
     path("approve-delivery/<int:delivery_id>/", approve_delivery, name="approve_delivery"),
+    path("approve-deliveries/", approve_selected_deliveries, name="approve_selected_deliveries"),
     path("product-delivery-report/", product_delivery_report, name="product_delivery_report"),
+    path("product-delivery-report/stats/", report_stats, name="report_stats"),
+    path("api/reports/deliveries/", delivery_report_data, name="delivery_report_data"),
+    path("api/reports/sales/", sales_report_data, name="sales_report_data"),
+    path("api/movements/", movement_history_data, name="movement_history_data"),
+    path("metrics", metrics, name="metrics"),
+    path("slow-queries/", slow_queries, name="slow_queries"),
+    path("profiles/", request_profiles, name="request_profiles"),
+    path("profiles/<str:name>/", request_profile, name="request_profile"),
 
 
 
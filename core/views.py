@@ -1,27 +1,41 @@
 
-# import matplotlib
-# matplotlib.use("Agg")  # Evita intentos de GUI en un entorno de servidor
+from datetime import datetime, time, timedelta
 
-import csv
-import os
 from django.conf import settings
+from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
-import matplotlib.pyplot as plt
-import seaborn as sns
-import io
-import base64
 from django.shortcuts import render
-from django.db.models import Sum
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User, Group
-from django.http import JsonResponse
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import condition, require_POST
 from django.shortcuts import render, redirect, get_object_or_404
 from .forms import CustomerForm, SupplierForm, CustomLoginForm, CustomUserCreationForm, TransferProductForm, \
     SupplierDeliveryForm
 from django.contrib.auth.decorators import login_required, permission_required
 
-from .models import SupplierDelivery, Stock, Product, Store, Purchase, PurchaseDetail, Cart, CartItem, Supplier
+from .images import resolve_images, product_image_urls
+from .jobs import cancel, enqueue
+from .metrics import render as render_metrics
+from .profiling import list_profiles, load_profile, top_frames
+from .slow_queries import recent_entries
+from .movements import movement_history
+from .inventory import ConcurrentApproval, approve_deliveries, confirm_cart
+from .pagination import keyset_paginate
+from .roles import user_roles
+from .routers import replica_reads
+from .sharding import across_shards, atomic_for_stores
+from .reports import DELIVERY_REPORT, SALES_REPORT, ReportError, delivery_charts, report_cache_stats
+from .models import SupplierDelivery, Stock, Product, Store, PurchaseDetail, Cart, CartItem, Supplier, \
+    InsufficientStock, Job
+
+CATALOG_PER_PAGE = 48
+INLINE_APPROVAL_LIMIT = 500  # Por encima, la aprobación en bloque pasa al worker de tareas
 
 
 def home(request):
@@ -42,14 +56,16 @@ def store(request):
 def store_products(request, store_id):
     store = get_object_or_404(Store, id=store_id)
     request.session['store_id'] = store.id
-    # Filtrar productos que tengan stock disponible en alguna tienda
-    products = Product.objects.filter(stock_entries__quantity__gt=0, stock_entries__store_id=store_id).distinct()
+    # Productos con stock disponible en la tienda, según el índice de disponibilidad
+    page = keyset_paginate(request, Product.objects.filter(availability__store_id=store_id), ['id'],
+                           per_page=CATALOG_PER_PAGE)
+    products = page.object_list
+    # 🔹 URLs resueltas desde el manifiesto (con imagen por defecto si no existe)
+    images = resolve_images(product.image.name for product in products)
     for product in products:
-        image_path = os.path.join(settings.MEDIA_ROOT, str(product.image))
-        if not os.path.exists(image_path):
-            product.image = "img/sin-imagen.jpg"  # 🔹 Imagen por defecto si no existe
+        product.image_url, product.image_webp_url = product_image_urls(images, product)
 
-    return render(request, 'core/list_product.html', {'store': store, 'products': products})
+    return render(request, 'core/list_product.html', {'store': store, 'products': products, 'page': page})
 
 
 def register_customer(request):
@@ -89,12 +105,13 @@ def user_login(request):
             user = form.get_user()
             login(request, user)
 
-            # Redirección basada en el grupo del usuario
-            if user.groups.filter(name="Admins").exists():
+            # Redirección basada en el grupo del usuario (una consulta, que queda en la caché de roles)
+            groups = user_roles(user)["groups"]
+            if "Admins" in groups:
                 return redirect('admin_dashboard')
-            elif user.groups.filter(name="Suppliers").exists():
+            elif "Suppliers" in groups:
                 return redirect('supplier_dashboard')
-            elif user.groups.filter(name="Customers").exists():
+            elif "Customers" in groups:
                 return redirect('customer_dashboard')
             else:
                 return redirect('home')
@@ -113,88 +130,80 @@ def user_logout(request):
 @permission_required('core.full_access', raise_exception=True)
 def admin_dashboard(request):
     # Filtrar entregas que aún no han sido aprobadas
-    pending_deliveries = SupplierDelivery.objects.filter(approved=False).order_by("-delivery_date")
+    pending_deliveries = keyset_paginate(
+        request, SupplierDelivery.objects.filter(approved=False).select_related("store", "product"),
+        ["-delivery_date", "-id"]
+    )
 
     return render(request, "core/dashboard/admin.html", {
-        "pending_deliveries": pending_deliveries
+        "pending_deliveries": pending_deliveries,
+        "page": pending_deliveries,
+        "jobs": Job.objects.order_by("-id")[:10],
     })
 
 
 @login_required
 @permission_required('core.full_access', raise_exception=True)
+@require_POST
 def load_products(request):
-    archivos = {
-        "stores": "static/img/product_images/stores.csv",
-        "products": "static/img/product_images/products.csv",
-        "stock": "static/img/product_images/stock.csv"
-    }
-    for tipo, archivo in archivos.items():
-        if os.path.exists(archivo):
-            print(f"✅ Cargando {tipo} desde {archivo}")
-            with open(archivo, newline='', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-
-                # 🔹 Carga de tiendas (`stores.csv`)
-                if tipo == "stores":
-                    for row in reader:
-                        store = Store.objects.create(
-                            name=row['name'],
-                            street=row['street'],
-                            phone=row['phone']
-                        )
-                        store.save()
-                        print(f"✅ Tienda {store.name} cargada correctamente.")
-
-                # 🔹 Carga de productos (`products.csv`)
-                elif tipo == "products":
-                    for row in reader:
-                        product = Product.objects.create(
-                            name=row['name'],
-                            description=row['description'],
-                            price=row['price']
-                        )
-                        product.save()
-                        print(f"✅ Producto {product.name} cargado correctamente.")
-
-                # 🔹 Carga de stock (`stock.csv`)
-                elif tipo == "stock":
-                    for row in reader:
-                        store = Store.objects.filter(name=row['store_name']).first()
-                        product = Product.objects.filter(name=row['product_name']).first()
-                        if store and product:
-                            stock, created = Stock.objects.get_or_create(
-                                store=store,
-                                product=product
-                            )
-                            stock.quantity = int(row['quantity'])
-                            stock.save()
-                            print(f"✅ Stock actualizado: {stock.quantity} unidades de {product.name} en {store.name}.")
-                        else:
-                            print(
-                                f"❌ Error: No se encontró la tienda/producto {row['store_name']} - {row['product_name']}.")
-        else:
-            print(f"❌ El archivo {archivo} no existe.")
+    # La importación se ejecuta en el worker de tareas (manage.py run_jobs)
+    enqueue('import_catalog', user=request.user)
+    return redirect('admin_dashboard')
+
+
+@login_required
+@permission_required('core.full_access', raise_exception=True)
+@require_POST
+def queue_delivery_report(request):
+    enqueue('render_delivery_report', user=request.user)
+    return redirect('admin_dashboard')
+
+
+@login_required
+@permission_required('core.full_access', raise_exception=True)
+def job_status(request, job_id):
+    job = get_object_or_404(Job, id=job_id)
+    return JsonResponse({
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'attempts': job.attempts,
+        'result': job.result,
+        'finished': job.is_finished(),
+    })
+
 
-    return redirect('home')
+@login_required
+@permission_required('core.full_access', raise_exception=True)
+@require_POST
+def cancel_job(request, job_id):
+    cancel(job_id)
+    return redirect('admin_dashboard')
 
 
 @login_required
 @permission_required('core.full_access', raise_exception=True)
+@replica_reads
 def store_dashboard(request):
     store_id = request.GET.get('store')  # Capturar filtro de tienda
     product_id = request.GET.get('product')  # Capturar filtro de producto
 
-    stock_entries = Stock.objects.all().order_by('product__name')
+    stock_entries = Stock.objects.select_related('product', 'store')
     if store_id:
-        stock_entries = stock_entries.filter(store_id=store_id)
+        stock_entries = stock_entries.for_store(store_id).filter(store_id=store_id)
     if product_id:
         stock_entries = stock_entries.filter(product_id=product_id)
+    stock_entries = keyset_paginate(request, stock_entries if store_id else across_shards(stock_entries),
+                                    ['product__name', 'id'])
 
     stores = Store.objects.all()
     products = Product.objects.all()
 
     return render(request, 'core/dashboard/store_dashboard.html', {
         'stock_entries': stock_entries,
+        'page': stock_entries,
         "stores": stores,
         "products": products
     })
@@ -211,16 +220,19 @@ def transfer_product(request):
             to_store = form.cleaned_data['to_store']
             quantity = form.cleaned_data['quantity']
 
-            from_stock = Stock.objects.filter(product=product, store=from_store).first()
-            to_stock, created = Stock.objects.get_or_create(product=product, store=to_store)
+            from_stock = Stock.objects.for_store(from_store.id).filter(product=product, store=from_store).first()
+            to_stock, created = Stock.objects.for_store(to_store.id).get_or_create(product=product, store=to_store)
 
-            if from_stock and from_stock.quantity >= quantity:
-                from_stock.update_stock(quantity, 'OUT')  # Usa update_stock()
-                to_stock.update_stock(quantity, 'IN')  # Usa update_stock()
+            try:
+                if not from_stock:
+                    raise InsufficientStock("No hay stock en la tienda de origen.")
+                with atomic_for_stores(from_store.id, to_store.id):  # Ambos movimientos o ninguno
+                    from_stock.update_stock(quantity, 'OUT')  # Usa update_stock()
+                    to_stock.update_stock(quantity, 'IN')  # Usa update_stock()
                 print(
                     f"✅ Transferencia exitosa: {quantity} unidades de '{product.name}' de '{from_store.name}' a '{to_store.name}'.")
                 return redirect('store_dashboard')
-            else:
+            except InsufficientStock:
                 print("❌ Error: Stock insuficiente para la transferencia.")
 
     else:
@@ -266,19 +278,47 @@ def approve_delivery(request, delivery_id):
     delivery = get_object_or_404(SupplierDelivery, id=delivery_id)
 
     if not delivery.approved:
-        delivery.approved = True
-        delivery.save()
+        try:
+            approve_deliveries([delivery.id])
+        except ConcurrentApproval:
+            pass  # Ya la aprobó otra petición
 
     return redirect('admin_dashboard')  # Redirigir después de aprobar
 
 
+@staff_member_required
+@require_POST
+def approve_selected_deliveries(request):
+    if request.POST.get('all'):  # Todas las pendientes, no solo las de la página
+        delivery_ids = list(SupplierDelivery.objects.filter(approved=False).values_list('id', flat=True))
+    else:
+        delivery_ids = [int(value) for value in request.POST.getlist('delivery') if value.isdigit()]
+
+    if len(delivery_ids) > INLINE_APPROVAL_LIMIT:
+        enqueue('approve_deliveries', {'delivery_ids': delivery_ids}, user=request.user)
+        messages.info(request, f"Las {len(delivery_ids)} entregas se aprobarán en segundo plano.")
+    elif delivery_ids:
+        try:
+            approved = approve_deliveries(delivery_ids)
+        except ConcurrentApproval as exc:  # Las que queden pendientes siguen en el listado
+            messages.error(request, str(exc))
+        else:
+            messages.success(request, f"{approved} entregas aprobadas.")
+
+    return redirect('admin_dashboard')
+
+
 @login_required
 @permission_required('core.manage_products', raise_exception=True)
+@replica_reads
 def supplier_dashboard(request):
     supplier = get_object_or_404(Supplier, user=request.user)
 
     # Obtener todas las entregas realizadas por el proveedor
-    deliveries = SupplierDelivery.objects.filter(supplier=supplier).order_by('-delivery_date')
+    deliveries = keyset_paginate(
+        request, SupplierDelivery.objects.filter(supplier=supplier).select_related('store', 'product'),
+        ['-delivery_date', '-id']
+    )
     form = SupplierDeliveryForm(request.POST or None)
 
     if request.method == "POST" and form.is_valid():
@@ -290,60 +330,146 @@ def supplier_dashboard(request):
     return render(request, "core/dashboard/supplier.html", {
         "supplier": supplier,
         "deliveries": deliveries,
+        "page": deliveries,
         "form": form
     })
 
 
 @login_required
 @permission_required('core.manage_supplier_deliveries', raise_exception=True)
+@replica_reads
 def supplier_delivery_dashboard(request):
-    deliveries = SupplierDelivery.objects.all()
-    return render(request, 'core/supplier_deliveries.html', {'deliveries': deliveries})
+    deliveries = keyset_paginate(request, SupplierDelivery.objects.select_related('supplier', 'store'), ['-id'])
+    return render(request, 'core/supplier_deliveries.html', {'deliveries': deliveries, 'page': deliveries})
+
+
+REPORT_DATA_MAX_AGE = 60  # Segundos que el navegador reutiliza un informe JSON sin revalidar
 
+
+@replica_reads
 def product_delivery_report(request):
-    # Consultar entregas agrupadas por producto y tienda
-    deliveries = SupplierDelivery.objects.values("store__name", "product__name").filter(approved=True).annotate(total_quantity=Sum("quantity")).order_by("-total_quantity")[:10]
-
-    # Extraer los datos
-    stores = [d["store__name"] for d in deliveries]
-    products = [d["product__name"] for d in deliveries]
-    quantities = [d["total_quantity"] for d in deliveries]
-
-    # Crear gráfico de barras con los 10 primeros productos
-    plt.figure(figsize=(12, 6))
-    # plt.bar(products, quantities)
-    sns.barplot(x=products, y=quantities, hue=stores)
-    plt.xticks(rotation=45, ha='right', fontsize=10)
-    plt.xlabel("Producto")
-    plt.ylabel("Cantidad entregada")
-    plt.title("Top 10 Productos más entregados por tienda")
-    plt.tight_layout()
-
-    # Guardar en un buffer de memoria
-    bar_buffer = io.BytesIO()
-    plt.savefig(bar_buffer, format="png")
-    bar_buffer.seek(0)
-    bar_chart = base64.b64encode(bar_buffer.getvalue()).decode("utf-8")
-    bar_buffer.close()
-
-    # Crear gráfico de pastel
-    plt.figure(figsize=(7, 7))
-    plt.pie(quantities, labels=products, autopct="%1.2f%%", colors=sns.color_palette("pastel"))
-    plt.title("Distribución de productos entregados")
-
-    # Guardar en otro buffer de memoria
-    pie_buffer = io.BytesIO()
-    plt.savefig(pie_buffer, format="png")
-    pie_buffer.seek(0)
-    pie_chart = base64.b64encode(pie_buffer.getvalue()).decode("utf-8")
-    pie_buffer.close()
-
-    return render(request, "core/reports/product_delivery_report.html", {
-        "bar_chart": bar_chart,
-        "pie_chart": pie_chart,
+    return render(request, "core/reports/product_delivery_report.html", delivery_charts())
+
+
+@staff_member_required
+def report_stats(request):
+    return JsonResponse(report_cache_stats())
+
+
+@staff_member_required
+def slow_queries(request):
+    return render(request, 'core/admin/slow_queries.html', {
+        'entries': recent_entries(),
+        'threshold_ms': settings.SLOW_QUERY_MS,
+        'log_path': settings.SLOW_QUERY_LOG,
     })
 
 
+@staff_member_required
+def request_profiles(request):
+    return render(request, 'core/admin/profiles.html', {
+        'profiles': list_profiles(),
+        'sample_rate': settings.PROFILE_SAMPLE_RATE,
+    })
+
+
+@staff_member_required
+def request_profile(request, name):
+    profile = load_profile(name)
+    if profile is None:
+        raise Http404("Perfil no encontrado")
+    meta, folded = profile
+
+    if request.GET.get('download'):
+        response = HttpResponse(folded, content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{name}.folded"'
+        return response
+    return render(request, 'core/admin/profile.html', {'profile': meta, 'frames': top_frames(folded)})
+
+
+@staff_member_required
+def metrics(request):
+    """Métricas de las peticiones de este proceso, para Prometheus"""
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _report_etag(report):
+    """ETag basado en la huella de los datos, para responder 304 sin agregar de nuevo"""
+    def etag(request):
+        try:
+            return report.fingerprint(report.parse(request.GET))
+        except ReportError:
+            return None
+    return etag
+
+
+def _report_response(report, request):
+    try:
+        query = report.parse(request.GET)
+    except ReportError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    response = JsonResponse(report.build(query))
+    patch_cache_control(response, private=True, max_age=REPORT_DATA_MAX_AGE)
+    return response
+
+
+HISTORY_MAX_ROWS = 5000
+HISTORY_DEFAULT_DAYS = 365  # Rango si no se indica ``start``
+
+
+@login_required
+@permission_required('core.full_access', raise_exception=True)
+@replica_reads
+def movement_history_data(request):
+    """Movimientos de stock (archivados y recientes) de una tienda y/o producto; ``end`` incluido.
+
+    Sin ``start`` se devuelve el último año; como mucho los ``HISTORY_MAX_ROWS`` movimientos más recientes.
+    """
+    params = {}
+    for param in ('store', 'product'):
+        value = request.GET.get(param)
+        if value and not value.isdigit():
+            return JsonResponse({"error": f"{param} debe ser un número"}, status=400)
+        params[param] = int(value) if value else None
+    if params['store'] is None and params['product'] is None:
+        return JsonResponse({"error": "Indica store, product o ambos"}, status=400)
+
+    tz = timezone.get_current_timezone()
+    for param in ('start', 'end'):
+        value = request.GET.get(param)
+        day = parse_date(value) if value else None
+        if value and day is None:
+            return JsonResponse({"error": f"{param} debe tener formato AAAA-MM-DD"}, status=400)
+        if param == 'end' and day:
+            day += timedelta(days=1)
+        params[param] = timezone.make_aware(datetime.combine(day, time.min), tz) if day else None
+
+    if params['start'] is None:
+        params['start'] = (params['end'] or timezone.now()) - timedelta(days=HISTORY_DEFAULT_DAYS)
+
+    # Una fila de más indica si el rango tenía más movimientos de los devueltos
+    rows = movement_history(params['store'], params['product'], params['start'], params['end'],
+                            limit=HISTORY_MAX_ROWS + 1)
+    return JsonResponse({
+        "start": params['start'].isoformat(),
+        "movements": [{**row, "date": row["date"].isoformat()} for row in rows[-HISTORY_MAX_ROWS:]],
+        "truncated": len(rows) > HISTORY_MAX_ROWS,
+    })
+
+
+@login_required
+@replica_reads
+@condition(etag_func=_report_etag(DELIVERY_REPORT))
+def delivery_report_data(request):
+    return _report_response(DELIVERY_REPORT, request)
+
+
+@login_required
+@permission_required('core.full_access', raise_exception=True)
+@replica_reads
+@condition(etag_func=_report_etag(SALES_REPORT))
+def sales_report_data(request):
+    return _report_response(SALES_REPORT, request)
 
 
 @login_required
@@ -356,9 +482,10 @@ def customer_dashboard(request):
 def view_cart(request):
     # cart = Cart.objects.filter(user=request.user).first()
     cart = Cart.objects.get(user=request.user)
-    store_id = cart.items.first().store.id if cart.items.exists() else None
+    # Una sola consulta para las filas, la tienda y el total
+    cart_items = list(cart.items.select_related('product', 'store'))
+    store_id = cart_items[0].store_id if cart_items else None
 
-    cart_items = cart.items.all()
     # Calcular el total del carrito
     total_cart = sum(item.total_price() for item in cart_items)
 
@@ -386,9 +513,13 @@ def add_to_cart(request, product_id, store_id):
 
 
 @login_required
+@replica_reads
 def purchase_history(request):
-    purchases = request.user.customer.purchases.all().order_by('-date')
-    return render(request, 'core/dashboard/purchase_history.html', {'purchases': purchases})
+    details = PurchaseDetail.objects.select_related('product')
+    purchases = across_shards(request.user.customer.purchases.select_related('store')
+                              .prefetch_related(Prefetch('details', queryset=details)))
+    purchases = keyset_paginate(request, purchases, ['-date', '-id'])
+    return render(request, 'core/dashboard/purchase_history.html', {'purchases': purchases, 'page': purchases})
 
 
 @login_required
@@ -408,29 +539,15 @@ def remove_from_cart(request, cart_item_id):
 def confirm_purchase(request):
     cart = Cart.objects.get(user=request.user)
 
-    if not cart.items.exists():
-        return redirect("cart_view")  # Evitar compras vacías
-
-    # Crear la compra
-    purchase = Purchase.objects.create(customer=request.user.customer, store=cart.items.first().store)
-
-    # Registrar los detalles de compra
-    for item in cart.items.all():
-        PurchaseDetail.objects.create(
-            purchase=purchase,
-            product=item.product,
-            quantity=item.quantity,
-            unit_price=item.unit_price
-        )
-
-        # Actualizar stock del producto en la tienda
-        stock = Stock.objects.get(product=item.product, store=item.store)
+    try:
+        purchase = confirm_cart(cart, request.user.customer)
+    except InsufficientStock:
+        messages.error(request, "No hay stock suficiente para completar la compra.")
+        return redirect("view_cart")
 
-        if stock.quantity >= item.quantity:  # Evitar stock negativo
-            stock.update_stock(item.quantity, 'OUT')  # Usa update_stock()
+    if purchase is None:
+        return redirect("view_cart")  # Evitar compras vacías
 
-    # Vaciar el carrito después de la compra
-    cart.items.all().delete()
     request.session['count_cart'] = 0  # Resetear contador
 
     return redirect("purchase_history")  # Redirigir al historial de compras
@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from pathlib import Path
 import os
 
+from .sqlite_profile import PRAGMAS, sqlite_database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -42,11 +44,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',  # Primera: mide la petición completa (/metrics)
+    'core.middleware.SlowQueryViewMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ReplicaStickinessMiddleware',
+    'core.middleware.SamplingProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     # 'whitenoise.middleware.WhiteNoiseMiddleware',  # Añadir esta línea
@@ -66,6 +72,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'core.context_processors.role',
             ],
         },
     },
@@ -76,13 +83,62 @@ WSGI_APPLICATION = 'supply_management.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Perfil de producción de SQLite: busy_timeout, caché y conexiones persistentes; el modo WAL
+# se activa una vez por despliegue con manage.py sqlite_wal
+# (ver supply_management/sqlite_profile.py y manage.py sqlite_benchmark)
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'database/supply.sqlite3',
+    'default': sqlite_database(BASE_DIR / 'database/supply.sqlite3'),
+}
+
+# Réplica de solo lectura para dashboards e informes (core.routers). Se activa con
+# REPLICA_DATABASE_PATH; en local, la copia se mantiene con manage.py sync_replica
+REPLICA_DATABASE = 'replica'
+REPLICA_STICKY_SECONDS = 10  # Tras escribir, la sesión lee de default durante este tiempo
+
+if os.environ.get('REPLICA_DATABASE_PATH'):
+    DATABASES[REPLICA_DATABASE] = {
+        **sqlite_database(os.environ['REPLICA_DATABASE_PATH']),
+        'TEST': {'MIRROR': 'default'},
     }
+
+# Shards por tienda para Stock, StockMovement, Purchase y PurchaseDetail (core.sharding).
+# STORE_SHARD_COUNT=N los reparte en N ficheros SQLite de STORE_SHARD_DIR; se crean
+# y se rellenan con manage.py shard_stores. Sin la variable, todo sigue en default
+STORE_SHARDS = []
+for _index in range(int(os.environ.get('STORE_SHARD_COUNT', 0))):
+    _alias = f'store_shard_{_index}'
+    _shard_dir = Path(os.environ.get('STORE_SHARD_DIR', BASE_DIR / 'database'))
+    # Las claves ajenas a clientes y al catálogo de default no se pueden comprobar desde un shard
+    DATABASES[_alias] = sqlite_database(_shard_dir / f'{_alias}.sqlite3', pragmas={**PRAGMAS, 'foreign_keys': 'OFF'})
+    STORE_SHARDS.append(_alias)
+
+DATABASE_ROUTERS = ['core.sharding.ShardRouter', 'core.routers.ReplicaRouter']
+
+# Permisos leídos de la caché de roles (core.roles) en lugar de consultarlos en cada petición.
+# ModelBackend sigue en la lista solo para que las sesiones abiertas con él sigan siendo válidas
+AUTHENTICATION_BACKENDS = ['core.roles.CachedModelBackend', 'django.contrib.auth.backends.ModelBackend']
+
+# La caché por defecto es local a cada proceso. Las de roles e informes tienen que ser compartidas
+# por todos los procesos (web y run_jobs) para que una invalidación, un gráfico renderizado o las
+# estadísticas de aciertos lleguen a todos: ficheros en una sola máquina, Redis o Memcached
+# (ROLE_CACHE_*/REPORT_CACHE_* BACKEND y LOCATION) con varias
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'roles': {
+        'BACKEND': os.environ.get('ROLE_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('ROLE_CACHE_LOCATION', str(BASE_DIR / 'database/cache/roles')),
+    },
+    'reports': {
+        'BACKEND': os.environ.get('REPORT_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('REPORT_CACHE_LOCATION', str(BASE_DIR / 'database/cache/reports')),
+    },
 }
 
+# Los tests usan carpetas temporales para las cachés compartidas (ver supply_management/test_runner.py)
+TEST_RUNNER = 'supply_management.test_runner.TestRunner'
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -123,6 +179,58 @@ STATICFILES_DIRS = [
 
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
+# Procesos de manage.py generate_thumbnails; las imágenes subidas se procesan en el worker
+# de tareas (manage.py run_jobs), no en los procesos web
+THUMBNAIL_WORKERS = 2
+
+# Procesos del worker de tareas (manage.py run_jobs)
+JOB_WORKERS = 2
+
+# Archivo mensual de movimientos de stock (core.movements, manage.py archive_movements):
+# los meses anteriores a los últimos MOVEMENT_HOT_MONTHS pasan a CSV comprimidos
+MOVEMENT_ARCHIVE_DIR = BASE_DIR / 'database/archive'
+MOVEMENT_HOT_MONTHS = 3
+
+# Consultas más lentas que SLOW_QUERY_MS (None lo desactiva) se registran con su plan
+# en SLOW_QUERY_LOG (core.slow_queries, /slow-queries/). En el entorno, SLOW_QUERY_MS vacía,
+# "none" u "off" lo desactivan
+_slow_query_ms = os.environ.get('SLOW_QUERY_MS', '200').strip()
+SLOW_QUERY_MS = None if _slow_query_ms.lower() in ('', 'none', 'off') else int(_slow_query_ms)
+SLOW_QUERY_LOG = BASE_DIR / 'database/slow_queries.log'
+
+# Perfilado por muestreo (core.profiling, /profiles/): staff con ?profile=1 o la cabecera
+# X-Profile, y además al azar una fracción PROFILE_SAMPLE_RATE de todas las peticiones
+PROFILE_DIR = BASE_DIR / 'database/profiles'
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL_MS = 5
+PROFILE_KEEP = 200  # Perfiles conservados; se borran los más antiguos
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'slow_queries': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SLOW_QUERY_LOG,
+            'maxBytes': 5 * 1024 * 1024,
+            'backupCount': 5,
+            'encoding': 'utf-8',
+            'delay': True,
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'core.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -0,0 +1,56 @@
+"""
+Perfil de producción para las bases de datos SQLite del proyecto.
+
+Cada conexión nueva ejecuta los PRAGMA de ``PRAGMAS`` (vía ``init_command``),
+que solo duran lo que la conexión: ``synchronous=NORMAL`` (seguro con WAL),
+espera ante bloqueos en lugar de fallar con "database is locked" y más
+caché/mmap. Las conexiones se reutilizan entre peticiones (``CONN_MAX_AGE``) y
+las transacciones toman el bloqueo de escritura al empezar (``BEGIN
+IMMEDIATE``), así la espera la gestiona ``busy_timeout``.
+
+El modo WAL (``FILE_PRAGMAS``), para que las lecturas no bloqueen a los
+escritores, se graba en la cabecera del fichero: no se aplica al conectar (lo
+que reescribiría una base de datos versionada en cada arranque o test) sino una
+sola vez en cada despliegue con ``manage.py sqlite_wal``.
+
+Uso en settings::
+
+    DATABASES = {'default': sqlite_database(BASE_DIR / 'database/supply.sqlite3')}
+"""
+
+BUSY_TIMEOUT_MS = 5000
+
+# Se graban en el fichero: manage.py sqlite_wal
+FILE_PRAGMAS = {
+    'journal_mode': 'WAL',
+}
+
+# Por conexión
+PRAGMAS = {
+    'synchronous': 'NORMAL',
+    'busy_timeout': BUSY_TIMEOUT_MS,
+    'cache_size': -64000,  # En KiB cuando es negativo: 64 MB por conexión
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+def init_command(pragmas=None):
+    """Sentencias ``PRAGMA`` separadas por ';', tal como las espera el backend sqlite3 de Django"""
+    return ';'.join(f'PRAGMA {name}={value}' for name, value in (pragmas or PRAGMAS).items())
+
+
+def sqlite_database(name, conn_max_age=600, pragmas=None, **options):
+    """Entrada de ``settings.DATABASES`` con el perfil de producción aplicado"""
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'CONN_MAX_AGE': conn_max_age,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': init_command(pragmas),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': BUSY_TIMEOUT_MS / 1000,
+            **options,
+        },
+    }
@@ -0,0 +1,34 @@
+"""
+Runner de ``manage.py test``.
+
+Las cachés compartidas ``roles`` (core.roles) y ``reports`` (core.reports) son
+FileBasedCache en ``database/cache/``, las mismas carpetas que usa el servidor
+de desarrollo, y sus claves no dependen de la base de datos. Durante los tests
+apuntan a una carpeta temporal: ni los tests leen entradas de la base de datos
+de desarrollo ni borran la caché del servidor.
+"""
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+SHARED_CACHES = ['roles', 'reports']
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache_dir = tempfile.TemporaryDirectory()
+        self._caches = override_settings(CACHES={
+            **settings.CACHES,
+            **{alias: {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                       'LOCATION': f'{self._cache_dir.name}/{alias}'}
+               for alias in SHARED_CACHES},
+        })
+        self._caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._caches.disable()
+        self._cache_dir.cleanup()
+        super().teardown_test_environment(**kwargs)